@@ -246,6 +246,121 @@ def downgrade(cog, quiet, index):
     run(apply_migration(cog, quiet, index, downgrade=True))
 
 
+async def partition_tables(pool, cog, quiet):
+    async with pool.acquire() as con:
+        tr = con.transaction()
+        await tr.start()
+        for table in Table.all_tables():
+            if not table.is_partitioned():
+                continue
+
+            try:
+                converted = await table.convert_to_partitioned(verbose=not quiet, connection=con)
+            except Exception:
+                click.echo(
+                    f"Could not partition {table.__tablename__}.\n{traceback.format_exc()}",
+                    err=True,
+                )
+                await tr.rollback()
+                break
+            else:
+                if converted:
+                    click.echo(f"Partitioned {table.__tablename__}.")
+                else:
+                    click.echo(f"No work needed for {table.__tablename__}.")
+        else:
+            await tr.commit()
+
+
+@db.command(short_help="converts a cog's tables to partitioned tables", options_metavar="[options]")
+@click.argument("cog", metavar="<cog>")
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def partition(cog, quiet):
+    """Converts existing tables that are declared as partitioned.
+
+    PostgreSQL can't partition a table in place, so this copies
+    every row into a new table. This can take a while on big tables.
+    """
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    try:
+        pool = run(Table.create_pool(config.database_uri))
+    except Exception:
+        click.echo(
+            f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}",
+            err=True,
+        )
+        return
+
+    if not cog.startswith("clam.cogs."):
+        cog = f"clam.cogs.{cog}"
+
+    try:
+        importlib.import_module(cog)
+    except Exception:
+        click.echo(f"Could not load {cog}.\n{traceback.format_exc()}", err=True)
+        return
+
+    run(partition_tables(pool, cog, quiet))
+
+
+async def repair_tables(pool, cog, quiet):
+    async with pool.acquire() as con:
+        tr = con.transaction()
+        await tr.start()
+        for table in Table.all_tables():
+            try:
+                repaired = await table.repair(verbose=not quiet, connection=con)
+            except Exception:
+                click.echo(
+                    f"Could not repair {table.__tablename__}.\n{traceback.format_exc()}",
+                    err=True,
+                )
+                await tr.rollback()
+                break
+            else:
+                if repaired:
+                    click.echo(f"Repaired {table.__tablename__}.")
+                elif not quiet:
+                    click.echo(f"No work needed for {table.__tablename__}.")
+        else:
+            await tr.commit()
+
+
+@db.command(short_help="applies schema changes to existing tables", options_metavar="[options]")
+@click.argument("cog", metavar="<cog>")
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def repair(cog, quiet):
+    """Applies changes that init and migrate can't make to existing tables.
+
+    This covers things like new unique indexes, which may need
+    duplicate rows cleaned up before they can be built.
+    """
+
+    run = asyncio.get_event_loop().run_until_complete
+
+    try:
+        pool = run(Table.create_pool(config.database_uri))
+    except Exception:
+        click.echo(
+            f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}",
+            err=True,
+        )
+        return
+
+    if not cog.startswith("clam.cogs."):
+        cog = f"clam.cogs.{cog}"
+
+    try:
+        importlib.import_module(cog)
+    except Exception:
+        click.echo(f"Could not load {cog}.\n{traceback.format_exc()}", err=True)
+        return
+
+    run(repair_tables(pool, cog, quiet))
+
+
 async def remove_databases(pool, cog, quiet):
     async with pool.acquire() as con:
         tr = con.transaction()
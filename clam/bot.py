@@ -3,6 +3,7 @@ import datetime
 import json
 import logging
 import os.path
+import time
 import traceback
 
 import aiohttp
@@ -14,7 +15,9 @@ from cleverbot import async_ as cleverbot
 from discord.ext import commands
 
 from .config import Config
-from .utils import db
+from .utils import cache, db, metrics
+from .utils.loopmonitor import LoopMonitor
+from .utils.pipeline import MessagePipeline
 from .utils.context import Context
 from .utils.errors import PrivateCog
 from .utils.prefixes import Prefixes
@@ -107,6 +110,19 @@ class Clam(commands.Bot):
         self.uptime = None
         self.highlight_words = []
 
+        self.metrics = metrics.Registry()
+        self.metrics_server = None
+        self.loop_monitor = None
+        self._command_latency = self.metrics.histogram(
+            "clam_command_latency_seconds",
+            "Time taken to run a command, including checks and converters.",
+            ("command", "failed"),
+        )
+
+        # cogs register their on_message handlers here instead of as listeners
+        self.message_pipeline = MessagePipeline(self)
+        self.add_listener(self.message_pipeline.process, "on_message")
+
         log.info("Preparing external features...")
         try:
             self.google_client = async_cse.Search(self.config.google_api_key)
@@ -140,6 +156,18 @@ class Clam(commands.Bot):
             log.info(f"Loading extension '{extension}'")
             await self.load_extension(f"clam.cogs.{extension}")
 
+        threshold = self.config.slow_callback_threshold / 1000
+        self.loop_monitor = LoopMonitor(self.loop, threshold=threshold)
+        self.loop_monitor.start()
+        self.metrics.add_collector("bot", self.collect_metrics)
+
+        if self.config.metrics_port:
+            log.info("Starting metrics server...")
+            self.metrics_server = metrics.MetricsServer(
+                self.metrics, host=self.config.metrics_host, port=self.config.metrics_port
+            )
+            await self.metrics_server.start()
+
         log.info("Preparing status webhook...")
         if self.config.status_hook:
             self.status_hook = discord.Webhook.from_url(
@@ -176,6 +204,46 @@ class Clam(commands.Bot):
 
         super().dispatch(event, *args, **kwargs)
 
+    def collect_metrics(self):
+        registry = self.metrics
+
+        pool = self.pool
+        size = pool.get_size()
+        registry.gauge("clam_db_pool_size", "Connections currently open in the pool.").set(size)
+        registry.gauge("clam_db_pool_in_use", "Connections currently acquired from the pool.").set(
+            size - pool.get_idle_size()
+        )
+
+        # asyncpg has no public API for this one
+        queue = getattr(pool, "_queue", None)
+        waiters = len(getattr(queue, "_getters", ()))
+        registry.gauge("clam_db_pool_waiters", "Tasks waiting on Pool.acquire.").set(waiters)
+
+        registry.gauge("clam_gateway_latency_seconds", "Websocket heartbeat latency.").set(self.latency)
+        registry.gauge("clam_guilds", "Guilds the bot is in.").set(len(self.guilds))
+
+        monitor = self.loop_monitor
+        if monitor is not None:
+            registry.gauge("clam_event_loop_lag_seconds", "Most recent event loop lag sample.").set(
+                monitor.lag
+            )
+            registry.gauge("clam_event_loop_lag_max_seconds", "Worst event loop lag seen.").set(
+                monitor.max_lag
+            )
+            registry.counter(
+                "clam_event_loop_blocked_total", "Times the event loop was blocked past the threshold."
+            ).set(monitor.total_events)
+
+        hits = registry.counter("clam_cache_hits_total", "Cache hits per cached function.", ("cache",))
+        misses = registry.counter("clam_cache_misses_total", "Cache misses per cached function.", ("cache",))
+        ratio = registry.gauge("clam_cache_hit_ratio", "Cache hit ratio per cached function.", ("cache",))
+        for name, func in list(cache.caches.items()):
+            cache_hits, cache_misses = func.get_stats()
+            hits.set(cache_hits, cache=name)
+            misses.set(cache_misses, cache=name)
+            total = cache_hits + cache_misses
+            ratio.set(cache_hits / total if total else 0.0, cache=name)
+
     def add_to_blacklist(self, user):
         self.blacklist.append(str(user.id))
 
@@ -299,6 +367,18 @@ class Clam(commands.Bot):
 
         await self.invoke(ctx)
 
+    async def invoke(self, ctx):
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command is not None:
+                self._command_latency.observe(
+                    time.perf_counter() - start,
+                    command=ctx.command.qualified_name,
+                    failed=str(ctx.command_failed).lower(),
+                )
+
     async def on_message(self, message):
         if self.debug.full and message.guild.id not in [
             454469821376102410,
@@ -331,13 +411,21 @@ class Clam(commands.Bot):
             await self.status_hook.send("Disconnected from Discord")
 
     async def close(self):
-        await self.pool.close()
-        await self.google_client.close()
-        await self.cleverbot.close()
+        if self.metrics_server:
+            await self.metrics_server.close()
+
+        if self.loop_monitor:
+            self.loop_monitor.stop()
 
+        # players are saved to the database, so this has to happen before the pool closes
         music = self.get_cog("Music")
         if music:
-            await music.stop_all_players()
+            await music.stop_all_players(save_queues=True)
+            await music.flush_plays()
+
+        await self.pool.close()
+        await self.google_client.close()
+        await self.cleverbot.close()
 
         if not self.session.closed:
             await self.session.close()
@@ -94,6 +94,13 @@ class Admin(commands.Cog):
 
         self.dm_sessions = self.bot.dm_sessions
 
+        bot.message_pipeline.add_stage("dm_sender", self.dm_sender, bots=False)
+        bot.message_pipeline.add_stage("dm_listener", self.dm_listener, guilds=False, bots=False)
+
+    def cog_unload(self):
+        self.bot.message_pipeline.remove_stage("dm_sender")
+        self.bot.message_pipeline.remove_stage("dm_listener")
+
     def get_dm_session(self, channel):
         if channel.id in self.dm_sessions.keys():
             dm_session = self.dm_sessions[channel.id]
@@ -593,14 +600,11 @@ class Admin(commands.Cog):
         if ctx.channel != channel:
             await ctx.send(ctx.tick(True, "Sent DM"))
 
-    @commands.Cog.listener("on_message")
-    async def dm_sender(self, message):
+    async def dm_sender(self, message, facts):
         dm_session = self.get_dm_session(message.channel)
 
         if not dm_session:
             return
-        if message.author.bot:
-            return
         if message.content.startswith(self.bot.guild_prefix(message.guild)):
             return
 
@@ -622,9 +626,8 @@ class Admin(commands.Cog):
         em.set_footer(text="Outgoing DM")
         return await channel.send(embed=em)
 
-    @commands.Cog.listener("on_message")
-    async def dm_listener(self, message):
-        if not isinstance(message.channel, discord.DMChannel) or message.author.bot:
+    async def dm_listener(self, message, facts):
+        if not isinstance(message.channel, discord.DMChannel):
             return
 
         if message.content.startswith(("c.", "!", "?")):
@@ -123,6 +123,10 @@ class Highlight(commands.Cog):
         # channel: {member: task}
         self.typing_users = {}
 
+        bot.metrics.add_collector("highlight", self.collect_metrics)
+        bot.message_pipeline.add_stage("typing_canceller", self.typing_message_canceller)
+        bot.message_pipeline.add_stage("highlight", self.highlight_stage, dms=False, bots=False)
+
     async def cog_check(self, ctx):
         return await commands.guild_only().predicate(ctx)
 
@@ -362,11 +366,7 @@ class Highlight(commands.Cog):
 
         return seen
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.author.bot:
-            return
-
+    async def highlight_stage(self, message, facts):
         # Check if the word is in the highlight words cache
         # Create a task so I can run the queries and send the messages concurrently
         # and not one at a time
@@ -376,7 +376,7 @@ class Highlight(commands.Cog):
         for highlight in self.bot.highlight_words:
             escaped = re.escape(highlight)
             hl = re.compile(r"(?:\W+)?(?:{0})[{0}]*(?:\W+|('|\")?s)?$".format(escaped), re.I)
-            for word in message.content.lower().split():
+            for word in facts.words:
                 match = hl.match(word)
 
                 if not match:
@@ -861,6 +861,14 @@ class Highlight(commands.Cog):
 
     def cog_unload(self):
         self.bulk_insert_loop.stop()
+        self.bot.metrics.remove_collector("highlight")
+        self.bot.message_pipeline.remove_stage("typing_canceller")
+        self.bot.message_pipeline.remove_stage("highlight")
+
+    def collect_metrics(self):
+        registry = self.bot.metrics
+        depth = registry.gauge("clam_batch_queue_depth", "Rows waiting to be bulk inserted.", ("queue",))
+        depth.set(len(self._highlight_data_batch), queue="highlights")
 
     @tasks.loop(seconds=10.0)
     async def bulk_insert_loop(self):
@@ -925,8 +933,7 @@ class Highlight(commands.Cog):
         task = self.bot.loop.create_task(self.typing_wait(channel.id, user.id, stop_time))
         typing_channel[user.id] = task
 
-    @commands.Cog.listener("on_message")
-    async def typing_message_canceller(self, message):
+    async def typing_message_canceller(self, message, facts):
         if self.is_typing(message.channel, message.author):
             self.typing_users[message.channel.id][message.author.id].cancel()
             self.typing_users[message.channel.id].pop(message.author.id)
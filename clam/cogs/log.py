@@ -1,9 +1,12 @@
+import asyncio
 import datetime
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from clam.utils import cache, checks, db, humantime
+from clam.utils.auditlog import AuditLogPoller
+from clam.utils.logsink import LogSink
 
 
 class GuildLogsTable(db.Table, table_name="guild_logs"):
@@ -16,6 +19,8 @@ class GuildLogsTable(db.Table, table_name="guild_logs"):
     log_automod_actions = db.Column(db.Boolean, default=True)
     log_mod_actions = db.Column(db.Boolean, default=False)
 
+    webhook_url = db.Column(db.String)
+
 
 class GuildLog:
     @classmethod
@@ -30,6 +35,8 @@ class GuildLog:
         self.log_member_actions = record["log_member_actions"]
         self.log_automod_actions = record["log_automod_actions"]
         self.log_mod_actions = record["log_mod_actions"]
+        # older databases don't have this column until they're migrated
+        self.webhook_url = record.get("webhook_url")
 
         self.options = {
             "log_joins": self.log_joins,
@@ -52,27 +59,27 @@ class GuildLog:
             return None
         return self.guild.get_channel(self.channel_id)
 
-    async def log_automod_action(self, **message_kwargs):
-        channel = self.channel
+    def send(self, embed):
+        """Queues an embed to be sent to the log channel."""
 
-        if not channel:
+        if not self.channel:
             return
 
+        log = self.bot.get_cog("Log")
+        if log:
+            log.get_log_sink(self.id).add(embed)
+
+    async def log_automod_action(self, *, embed):
         if not self.log_automod_actions:
             return
 
-        await channel.send(**message_kwargs)
-
-    async def log_mod_action(self, **message_kwargs):
-        channel = self.channel
-
-        if not channel:
-            return
+        self.send(embed)
 
+    async def log_mod_action(self, *, embed):
         if not self.log_mod_actions:
             return
 
-        await channel.send(**message_kwargs)
+        self.send(embed)
 
 
 class Log(commands.Cog):
@@ -82,6 +89,72 @@ class Log(commands.Cog):
         self.bot = bot
         self.emoji = "\N{CLIPBOARD}"
 
+        # guild_id: AuditLogPoller
+        self._audit_log_pollers = {}
+
+        # guild_id: LogSink
+        self._log_sinks = {}
+        self._flush_lock = asyncio.Lock()
+        self.flush_logs.start()
+
+        bot.metrics.add_collector("log", self.collect_metrics)
+
+    def cog_unload(self):
+        for poller in self._audit_log_pollers.values():
+            poller.close()
+
+        self.flush_logs.stop()
+        self.bot.metrics.remove_collector("log")
+
+    def collect_metrics(self):
+        registry = self.bot.metrics
+        depth = registry.gauge("clam_batch_queue_depth", "Rows waiting to be bulk inserted.", ("queue",))
+        depth.set(sum(len(s) for s in self._log_sinks.values()), queue="guild_logs")
+
+    def get_log_sink(self, guild_id):
+        sink = self._log_sinks.get(guild_id)
+        if sink is None:
+            sink = self._log_sinks[guild_id] = LogSink(self.bot, guild_id)
+        return sink
+
+    async def flush_log_sinks(self):
+        for guild_id, sink in list(self._log_sinks.items()):
+            if not sink:
+                continue
+
+            guild_log = await self.get_guild_log(guild_id)
+            await sink.flush(guild_log)
+
+    @tasks.loop(seconds=2.0)
+    async def flush_logs(self):
+        async with self._flush_lock:
+            await self.flush_log_sinks()
+
+    @flush_logs.after_loop
+    async def after_flush_logs(self):
+        # send anything that was queued before the cog unloaded
+        if self.flush_logs.is_being_cancelled():
+            return
+
+        async with self._flush_lock:
+            await self.flush_log_sinks()
+
+    def get_audit_log_poller(self, guild):
+        poller = self._audit_log_pollers.get(guild.id)
+        if poller is None:
+            poller = self._audit_log_pollers[guild.id] = AuditLogPoller(guild)
+        return poller
+
+    async def find_audit_log_entry(self, guild, actions, *, target_id=None, seconds=10, attempts=2):
+        """Finds a recent audit log entry for an event that just happened."""
+
+        if not guild.me.guild_permissions.view_audit_log:
+            return None
+
+        since = discord.utils.utcnow() - datetime.timedelta(seconds=seconds)
+        poller = self.get_audit_log_poller(guild)
+        return await poller.find(actions, target_id=target_id, since=since, attempts=attempts)
+
     @cache.cache()
     async def get_guild_log(self, guild_id):
         query = "SELECT * FROM guild_logs WHERE id=$1;"
@@ -104,7 +177,11 @@ class Log(commands.Cog):
         options = [f"{ctx.tick(v)} {k[4:].replace('_', ' ')}" for k, v in log.options.items()]
         options = "\n".join(options)
 
-        message = f"**Logging is enabled**\nChannel: {log.channel.mention}\nLogging:\n{options}"
+        webhook = "Yes" if log.webhook_url else "No"
+        message = (
+            f"**Logging is enabled**\nChannel: {log.channel.mention}\n"
+            f"Using webhook: {webhook}\nLogging:\n{options}"
+        )
 
         await ctx.send(message)
 
@@ -125,7 +202,8 @@ class Log(commands.Cog):
 
         query = """INSERT INTO guild_logs (id, channel_id)
                    VALUES ($1, $2) ON CONFLICT (id) DO UPDATE SET
-                        channel_id=excluded.channel_id;
+                        channel_id=excluded.channel_id,
+                        webhook_url=NULL;
                 """
         await ctx.db.execute(query, ctx.guild.id, channel.id)
 
@@ -155,7 +233,8 @@ class Log(commands.Cog):
 
         query = """INSERT INTO guild_logs (id, channel_id)
                    VALUES ($1, $2) ON CONFLICT (id) DO UPDATE SET
-                        channel_id=excluded.channel_id;
+                        channel_id=excluded.channel_id,
+                        webhook_url=NULL;
                 """
         await ctx.db.execute(query, ctx.guild.id, channel.id)
 
@@ -180,6 +259,53 @@ class Log(commands.Cog):
         await ctx.send(ctx.tick(True, "Disabled logging for this server."))
         self.get_guild_log.invalidate(self, ctx.guild.id)
 
+    @log.group(name="webhook", invoke_without_command=True)
+    @checks.has_permissions(manage_guild=True, manage_webhooks=True)
+    @commands.bot_has_permissions(manage_webhooks=True)
+    async def log_webhook(self, ctx):
+        """Sends logs through a webhook in the log channel.
+
+        Webhooks can send logs faster than regular messages
+        and are less likely to be rate limited during raids.
+        """
+
+        guild_log = await self.get_guild_log(ctx.guild.id)
+        if not guild_log or not guild_log.channel:
+            return await ctx.send("Logging is not enabled.")
+
+        reason = f"Log webhook creation by {ctx.author} (ID: {ctx.author.id})"
+        try:
+            webhook = await guild_log.channel.create_webhook(name=f"{ctx.me.name} Logs", reason=reason)
+        except discord.HTTPException:
+            return await ctx.send(ctx.tick(False, "I couldn't create a webhook in the log channel."))
+
+        query = "UPDATE guild_logs SET webhook_url=$1 WHERE id=$2;"
+        await ctx.db.execute(query, webhook.url, ctx.guild.id)
+        self.get_guild_log.invalidate(self, ctx.guild.id)
+
+        await ctx.send(ctx.tick(True, f"Now sending logs through a webhook in {guild_log.channel.mention}."))
+
+    @log_webhook.command(name="remove", aliases=["disable"])
+    @checks.has_permissions(manage_guild=True)
+    async def log_webhook_remove(self, ctx):
+        """Stops sending logs through a webhook."""
+
+        guild_log = await self.get_guild_log(ctx.guild.id)
+        if not guild_log or not guild_log.webhook_url:
+            return await ctx.send("Logs are not being sent through a webhook.")
+
+        query = "UPDATE guild_logs SET webhook_url=NULL WHERE id=$1;"
+        await ctx.db.execute(query, ctx.guild.id)
+        self.get_guild_log.invalidate(self, ctx.guild.id)
+
+        webhook = discord.Webhook.from_url(guild_log.webhook_url, session=self.bot.session)
+        try:
+            await webhook.delete(reason=f"Log webhook removal by {ctx.author} (ID: {ctx.author.id})")
+        except discord.HTTPException:
+            pass
+
+        await ctx.send(ctx.tick(True, "Logs will now be sent as regular messages."))
+
     async def toggle_logging_option(self, ctx, option, human_friendly_option):
         guild_log = await self.get_guild_log(ctx.guild.id)
         if not guild_log:
@@ -276,22 +402,16 @@ class Log(commands.Cog):
             inline=False
         )
 
-        if guild_log.channel:
-            await guild_log.channel.send(embed=em)
+        guild_log.send(em)
 
-    async def log_mod_action(self, guild, emoji, valid_actions, *, action=None, can_be_me=True):
+    async def log_mod_action(self, guild, target, emoji, valid_actions, *, action=None, can_be_me=True):
         guild_log = await self.get_guild_log(guild.id)
         if not guild_log or not guild_log.log_mod_actions:
             return
 
-        entries = [entry async for entry in guild.audit_logs(limit=1)]
+        entry = await self.find_audit_log_entry(guild, valid_actions, target_id=target.id)
 
-        if not entries:
-            return
-
-        entry = entries[0]
-
-        if entry.action not in valid_actions:
+        if not entry:
             return
 
         if not can_be_me and entry.user == self.bot.user:
@@ -301,15 +421,15 @@ class Log(commands.Cog):
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild, user):
-        await self.log_mod_action(guild, "\N{HAMMER}", (discord.AuditLogAction.ban,), can_be_me=False)
+        await self.log_mod_action(guild, user, "\N{HAMMER}", (discord.AuditLogAction.ban,), can_be_me=False)
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild, user):
-        await self.log_mod_action(guild, "\N{SPARKLES}", (discord.AuditLogAction.unban,), can_be_me=False)
+        await self.log_mod_action(guild, user, "\N{SPARKLES}", (discord.AuditLogAction.unban,), can_be_me=False)
 
     @commands.Cog.listener("on_member_remove")
     async def on_member_kick(self, member):
-        await self.log_mod_action(member.guild, "\N{BOXING GLOVE}", (discord.AuditLogAction.kick,), can_be_me=False)
+        await self.log_mod_action(member.guild, member, "\N{BOXING GLOVE}", (discord.AuditLogAction.kick,), can_be_me=False)
 
     @commands.Cog.listener("on_member_update")
     async def on_member_update(self, before, after):
@@ -326,7 +446,7 @@ class Log(commands.Cog):
             if set(before.roles) - set(after.roles) == {settings.mute_role}:
                 emoji = "\N{SPEAKER WITH THREE SOUND WAVES}"
                 await self.log_mod_action(
-                    before.guild, emoji,
+                    before.guild, after, emoji,
                     (discord.AuditLogAction.member_role_update,),
                     action="Unmute",
                     can_be_me=False
@@ -337,6 +457,7 @@ class Log(commands.Cog):
                 emoji = "\N{SPEAKER WITH CANCELLATION STROKE}"
                 await self.log_mod_action(
                     before.guild,
+                    after,
                     emoji,
                     (discord.AuditLogAction.member_role_update,),
                     action="Mute",
@@ -373,8 +494,7 @@ class Log(commands.Cog):
         content = message.content[:1000] + ("..." if len(message.content) > 1000 else "")
         em.add_field(name="Content", value=content or "No content", inline=False)
 
-        if guild_log.channel:
-            await guild_log.channel.send(embed=em)
+        guild_log.send(em)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -411,8 +531,7 @@ class Log(commands.Cog):
         em.add_field(name="Before", value=before.content[:1000] + ("..." if len(before.content) > 1000 else ""), inline=False)
         em.add_field(name="After", value=after.content[:1000] + ("..." if len(after.content) > 1000 else ""), inline=False)
 
-        if guild_log.channel:
-            await guild_log.channel.send(embed=em)
+        guild_log.send(em)
 
     # JOINS/LEAVES
 
@@ -458,8 +577,7 @@ class Log(commands.Cog):
                         em.color = 0xDDA453  # yellow
                         em.title = "Member Joined (Very New Member)"
 
-        if guild_log.channel:
-            await guild_log.channel.send(embed=em)
+        guild_log.send(em)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
@@ -472,16 +590,19 @@ class Log(commands.Cog):
         if not guild_log.log_leaves:
             return
 
-        no_nos = (
-            discord.AuditLogAction.member_prune,
-            discord.AuditLogAction.kick,
-            discord.AuditLogAction.ban
-            )
+        # don't log kicks/bans/prunes
+        # most removals are plain leaves, so only wait on a single fetch
+        removals = (discord.AuditLogAction.kick, discord.AuditLogAction.ban)
+        if await self.find_audit_log_entry(
+            member.guild, removals, target_id=member.id, seconds=5, attempts=1
+        ):
+            return
 
-        audit_logs = [entry async for entry in member.guild.audit_logs(limit=1)]
+        # the lookup above already fetched recent entries, so prunes come from the cache
+        poller = self.get_audit_log_poller(member.guild)
         five_seconds_ago = discord.utils.utcnow() - datetime.timedelta(seconds=5)
-        if audit_logs and audit_logs[0].action in no_nos and audit_logs[0].created_at >= five_seconds_ago:
-            return  # don't log kicks/prunes
+        if poller.get((discord.AuditLogAction.member_prune,), since=five_seconds_ago):
+            return
 
         em = discord.Embed(title="Member Left", description=member.mention, color=discord.Color.orange())
         em.set_author(name=str(member), icon_url=member.display_avatar.url)
@@ -492,8 +613,7 @@ class Log(commands.Cog):
             inline=False,
         )
 
-        if guild_log.channel:
-            await guild_log.channel.send(embed=em)
+        guild_log.send(em)
 
 
 async def setup(bot):
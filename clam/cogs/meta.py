@@ -467,8 +467,11 @@ class Meta(commands.Cog):
         bot.help_command = ClamHelpCommand()
         bot.help_command.cog = self
 
+        bot.message_pipeline.add_stage("mention_reply", self.on_mention_msg)
+
     def cog_unload(self):
         self.bot.help_command = self._original_help_command
+        self.bot.message_pipeline.remove_stage("mention_reply")
 
     def i_category(self, ctx):
         return (
@@ -482,8 +485,7 @@ class Meta(commands.Cog):
             f"use: `{self.bot.guild_prefix(ctx.guild)}help [command]`‍"
         )
 
-    @commands.Cog.listener("on_message")
-    async def on_mention_msg(self, message):
+    async def on_mention_msg(self, message, facts):
         if self.bot.debug.full:
             return
 
@@ -19,10 +19,15 @@ from jishaku.models import copy_context_with
 
 
 from clam.utils import cache, checks, db, humantime
+from clam.utils.wordfilter import WordMatcher
 from clam.utils.checks import has_manage_guild
 from clam.utils.emojis import GREEN_TICK, LOADING, RED_TICK
 from clam.utils.flags import NoUsageFlagGroup
 from clam.utils.formats import human_join, plural
+from clam.utils.menus import UpdatingMessage
+from clam.utils.overwrites import OverwriteUpdater
+from clam.utils.purge import PurgeEngine, compile_predicate
+from clam.utils.spam import SpamDetector
 from clam.utils.utils import is_int
 
 
@@ -47,6 +52,13 @@ class SpamViolations(db.Table, table_name="spam_violations"):
     user_id = db.Column(db.Integer(big=True))
     violated_at = db.Column(db.Datetime, default="now() at time zone 'utc'")
 
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        statement = super().create_table(exists_ok=exists_ok)
+        # AutoMod counts violations per member on every spam detection
+        sql = "CREATE INDEX IF NOT EXISTS spam_violations_member_idx ON spam_violations (guild_id, user_id);"
+        return statement + "\n" + sql
+
 
 class GuildSettingsTable(db.Table, table_name="guild_settings"):
     id = db.Column(db.Integer(big=True), primary_key=True)
@@ -76,14 +88,30 @@ class GuildSettings:
         self.automod_mode = record["automod_mode"]
         self.violation_count = record["violation_count"]
         self.ignore_roles = record["ignore_roles"]
-        self.ignored_channels = record["ignored_channels"] or []
-        self.ignored_roles = record["ignored_roles"] or []
-        self.ignored_members = record["ignored_members"] or []
+        self.ignored_channels = frozenset(record["ignored_channels"] or ())
+        self.ignored_roles = frozenset(record["ignored_roles"] or ())
+        self.ignored_members = frozenset(record["ignored_members"] or ())
         self.mention_count = record["mention_count"]
         self.forbidden_words = record["forbidden_words"] or []
 
         return self
 
+    @property
+    def automod_enabled(self):
+        """Whether AutoMod or mention spam banning needs to look at messages."""
+        return bool(self.automod_mode) or bool(self.mention_count)
+
+    def is_automod_ignored(self, channel_id, member_id, role_ids):
+        """Checks the ignore lists. ``role_ids`` shouldn't include @everyone."""
+        if self.ignore_roles and role_ids:
+            return True
+
+        return (
+            member_id in self.ignored_members
+            or channel_id in self.ignored_channels
+            or not self.ignored_roles.isdisjoint(role_ids)
+        )
+
     @property
     def mute_role(self):
         guild = self.bot.get_guild(self.id)
@@ -194,11 +222,6 @@ class BannedUser(commands.Converter):
 
 # Spam detector
 
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message):
-        return (message.channel.id, message.content)
-
-
 class SpamChecker:
     """This spam checker does a few things.
 
@@ -211,25 +234,13 @@ class SpamChecker:
     just catches regular singular spam bots.
 
     From experience these values aren't reached unless someone is actively spamming.
+
+    The counting itself is done by :class:`clam.utils.spam.SpamDetector`,
+    which has a hard cap on how much it keeps track of.
     """
 
     def __init__(self):
-        self.by_content = CooldownByContent.from_cooldown(
-            15, 17.0, commands.BucketType.member
-        )
-        self.by_user = commands.CooldownMapping.from_cooldown(
-            10, 12.0, commands.BucketType.user
-        )
-        self.last_join = None
-        self.new_user = commands.CooldownMapping.from_cooldown(
-            30, 35.0, commands.BucketType.channel
-        )
-
-        # user_id flag mapping (for about 30 minutes)
-        self.fast_joiners = cache.ExpiringCache(seconds=1800.0)
-        self.hit_and_run = commands.CooldownMapping.from_cooldown(
-            10, 12, commands.BucketType.channel
-        )
+        self.detector = SpamDetector()
 
     def is_new(self, member):
         now = discord.utils.utcnow()
@@ -241,38 +252,47 @@ class SpamChecker:
         if message.guild is None:
             return False
 
-        current = message.created_at.timestamp()
+        return self.detector.check(
+            message.author.id,
+            message.channel.id,
+            message.content,
+            message.created_at.timestamp(),
+            is_new=self.is_new(message.author),
+        )
 
-        if message.author.id in self.fast_joiners:
-            bucket = self.hit_and_run.get_bucket(message)
-            if bucket.update_rate_limit(current):
-                return True
+    def is_fast_join(self, member):
+        joined = member.joined_at or discord.utils.utcnow()
+        return self.detector.joined(member.id, joined.timestamp())
 
-        if self.is_new(message.author):
-            new_bucket = self.new_user.get_bucket(message)
-            if new_bucket.update_rate_limit(current):
-                return True
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
-            return True
+# Purges searching more than this many messages show their progress
+PURGE_PROGRESS_THRESHOLD = 500
 
-        content_bucket = self.by_content.get_bucket(message)
-        if content_bucket.update_rate_limit(current):
-            return True
 
-        return False
+# AutoMod enforcement
 
-    def is_fast_join(self, member):
-        joined = member.joined_at or discord.utils.utcnow()
-        if self.last_join is None:
-            self.last_join = joined
-            return False
-        is_fast = (joined - self.last_join).total_seconds() <= 2.0
-        self.last_join = joined
-        if is_fast:
-            self.fast_joiners[member.id] = True
-        return is_fast
+# How many punishments can be sent to Discord at once per guild
+ENFORCEMENT_CONCURRENCY = 3
+
+
+class EnforcementKind(enum.Enum):
+    tempmute = "Tempmuted"
+    ban = "Banned"
+    mention_ban = "Banned for mention spam"
+
+
+class EnforcementAction:
+    """An AutoMod punishment waiting to be carried out."""
+
+    __slots__ = ("kind", "member", "reason", "violations", "until", "succeeded")
+
+    def __init__(self, kind, member, reason, *, violations=None, until=None):
+        self.kind = kind
+        self.member = member
+        self.reason = reason
+        self.violations = violations
+        self.until = until
+        self.succeeded = False
 
 
 class NoMuteRole(commands.CommandError):
@@ -355,6 +375,13 @@ class Moderation(commands.Cog):
         # guild_id: SpamChecker
         self._spam_check = defaultdict(SpamChecker)
 
+        # IDs of guilds with AutoMod or mention spam banning enabled
+        self._automod_guilds = set()
+
+        # guild_id: WordMatcher
+        # Compiled forbidden words, rebuilt when the words change
+        self._forbidden_matchers = {}
+
         # guild_id: List[(member_id, insertion)]
         # A batch of data for bulk inserting mute role changes
         # True - insert, False - remove
@@ -364,13 +391,56 @@ class Moderation(commands.Cog):
         self.batch_updates.add_exception_type(asyncpg.PostgresConnectionError)
         self.batch_updates.start()
 
+        # AutoMod punishments are sent with bounded concurrency,
+        # and their DB writes and logs are flushed in batches
+        # Set[(guild_id, member_id)] of members with a punishment in progress
+        self._pending_enforcement = set()
+        # (guild_id, member_id): violations that haven't been inserted yet
+        self._pending_violations = Counter()
+        # guild_id: asyncio.Semaphore
+        self._enforcement_limits = {}
+        # guild_id: List[EnforcementAction] of finished punishments to log
+        self._enforcement_batch = defaultdict(list)
+        # List[dict] of spam violations to insert
+        self._violation_batch = []
+        # List[(when, event, args)] of tempmute timers to create
+        self._timer_batch = []
+        self.enforcement_updates.add_exception_type(asyncpg.PostgresConnectionError)
+        self.enforcement_updates.start()
+
         # (guild_id, channel_id): List[str]
         # A batch list of message content for message
         self.message_batches = defaultdict(list)
         self._batch_message_lock = asyncio.Lock(loop=bot.loop)
 
+        bot.metrics.add_collector("moderation", self.collect_metrics)
+        bot.message_pipeline.add_stage("automod", self.automod_stage, dms=False, bots=False, background=True)
+        bot.message_pipeline.add_stage(
+            "forbidden_words", self.forbidden_words_stage, dms=False, bots=False, background=True
+        )
+
+    async def cog_load(self):
+        query = "SELECT id FROM guild_settings WHERE automod_mode > 0 OR mention_count > 0;"
+        records = await self.bot.pool.fetch(query)
+        self._automod_guilds = {r["id"] for r in records}
+
     def cog_unload(self):
         self.batch_updates.stop()
+        self.enforcement_updates.stop()
+        self.bot.metrics.remove_collector("moderation")
+        self.bot.message_pipeline.remove_stage("automod")
+        self.bot.message_pipeline.remove_stage("forbidden_words")
+
+    def collect_metrics(self):
+        registry = self.bot.metrics
+        depth = registry.gauge("clam_batch_queue_depth", "Rows waiting to be bulk inserted.", ("queue",))
+        depth.set(sum(len(b) for b in self._data_batch.values()), queue="mutes")
+        depth.set(sum(len(b) for b in self.message_batches.values()), queue="automod_messages")
+        depth.set(len(self._violation_batch), queue="spam_violations")
+        depth.set(len(self._timer_batch), queue="tempmute_timers")
+        registry.gauge("clam_automod_pending_actions", "AutoMod punishments that haven't been flushed yet.").set(
+            len(self._pending_enforcement)
+        )
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, NoMuteRole) or isinstance(error, RoleHierarchyFailure):
@@ -434,11 +504,30 @@ class Moderation(commands.Cog):
             return GuildSettings.from_record(record, self.bot)
         return None
 
+    async def refresh_automod_state(self, guild_id):
+        """Invalidates a guild's settings and updates whether AutoMod runs there."""
+
+        self.get_guild_settings.invalidate(self, guild_id)
+        settings = await self.get_guild_settings(guild_id)
+
+        if settings and settings.automod_enabled:
+            self._automod_guilds.add(guild_id)
+        else:
+            self._automod_guilds.discard(guild_id)
+
     @cache.cache()
     async def get_spam_violations(self, guild_id, user_id):
         query = "SELECT * FROM spam_violations WHERE guild_id=$1 AND user_id=$2;"
         return await self.bot.pool.fetch(query, guild_id, user_id) or []
 
+    @cache.cache(maxsize=1024)
+    async def get_spam_violation_count(self, guild_id, user_id):
+        query = "SELECT COUNT(*) FROM spam_violations WHERE guild_id=$1 AND user_id=$2;"
+        count = await self.bot.pool.fetchval(query, guild_id, user_id)
+
+        # violations that are still waiting to be inserted
+        return count + self._pending_violations[(guild_id, user_id)]
+
     async def log_mod_action(self, ctx, action, emoji, moderator, target, reason, duration=None):
         guild_log = await ctx.get_guild_log()
         if guild_log:
@@ -1052,31 +1141,35 @@ class Moderation(commands.Cog):
         await ctx.send(f"{ctx.tick(True)} Set mute role to **`{role}`**")
 
     async def update_channel_overwrites(self, role: discord.Role, reason: str):
-        succeeded = 0
-        failed = []
+        overwrite = discord.PermissionOverwrite(
+            send_messages=False, add_reactions=False, speak=False
+        )
+        updater = OverwriteUpdater(role.guild, role, overwrite, reason=reason)
+        return await updater.run()
 
-        for channel in role.guild.channels:
-            overwrites = channel.overwrites
-            overwrites[role] = discord.PermissionOverwrite(
-                send_messages=False, add_reactions=False, speak=False
-            )
-            try:
-                await channel.edit(overwrites=overwrites, reason=reason)
-                succeeded += 1
+    def format_overwrite_result(self, result):
+        message = (
+            f"Checked {result.total} channels:"
+            f"\n  - {len(result.changed)} changed"
+            f"\n  - {len(result.unchanged)} already up to date"
+            f"\n  - {len(result.failed)} failed"
+        )
 
-            except discord.HTTPException:
+        if result.failed:
+            failed = []
+            for channel, _ in result.failed:
                 if isinstance(channel, discord.TextChannel):
-                    formatted = channel.mention
+                    failed.append(channel.mention)
 
                 elif isinstance(channel, discord.VoiceChannel):
-                    formatted = f"<:voice_channel:665577300552843294> {channel.name}"
+                    failed.append(f"<:voice_channel:665577300552843294> {channel.name}")
 
                 else:
-                    formatted = channel.name
+                    failed.append(channel.name)
 
-                failed.append(formatted)
+            message += f"\n\nChannels failed: {', '.join(failed)}"
 
-        return succeeded, failed
+        return message
 
     @mute_role.command(name="create")
     @commands.bot_has_permissions(manage_channels=True, manage_roles=True)
@@ -1102,7 +1195,7 @@ class Moderation(commands.Cog):
             reason = f"Creation of Muted role by {ctx.author} (ID: {ctx.author.id})"
 
             role = await guild.create_role(name=name, color=color, reason=reason)
-            succeeded, failed = await self.update_channel_overwrites(role, reason)
+            result = await self.update_channel_overwrites(role, reason)
 
         query = """INSERT INTO guild_settings (id, mute_role_id)
                    VALUES ($1, $2) ON CONFLICT (id) DO UPDATE SET
@@ -1112,17 +1205,8 @@ class Moderation(commands.Cog):
         await ctx.db.execute(query, ctx.guild.id, role.id)
         self.get_guild_settings.invalidate(self, ctx.guild.id)
 
-        message = (
-            "Created mute role and changed channel overwrites.\n"
-            f"Attempted to change {len(guild.channels)} channels:"
-            f"\n  - {succeeded} succeeded\n  - {len(failed)} failed"
-        )
-
-        if failed:
-            formatted = ", ".join(failed)
-            message += f"\n\nChannels failed: {formatted}"
-
-        await ctx.send(message)
+        message = "Created mute role and changed channel overwrites.\n"
+        await ctx.send(message + self.format_overwrite_result(result))
 
     @mute_role.command(name="update", aliases=["sync"])
     @commands.bot_has_permissions(manage_channels=True, manage_roles=True)
@@ -1138,19 +1222,10 @@ class Moderation(commands.Cog):
         reason = f"Update of Muted role by {ctx.author} (ID: {ctx.author.id})"
 
         async with ctx.typing():
-            succeeded, failed = await self.update_channel_overwrites(role, reason)
-
-        message = (
-            "Updated channel overwrites.\n"
-            f"Attempted to change {len(ctx.guild.channels)} channels:"
-            f"\n  - {succeeded} succeeded\n  - {len(failed)} failed"
-        )
-
-        if failed:
-            formatted = ", ".join(failed)
-            message += f"\n\nChannels failed: {formatted}"
+            result = await self.update_channel_overwrites(role, reason)
 
-        await ctx.send(message)
+        message = "Updated channel overwrites.\n"
+        await ctx.send(message + self.format_overwrite_result(result))
 
     @mute_role.command(name="unbind")
     @commands.bot_has_permissions(manage_channels=True, manage_roles=True)
@@ -1300,10 +1375,20 @@ class Moderation(commands.Cog):
         if after is not None:
             after = discord.Object(id=after)
 
+        engine = PurgeEngine(ctx.channel, limit=limit, check=predicate, before=before, after=after)
+
+        progress = None
+        if limit > PURGE_PROGRESS_THRESHOLD:
+            em = discord.Embed(title="Purging messages", color=discord.Color.red())
+            progress = UpdatingMessage(embed=em)
+            progress.add_label(LOADING, "Searching messages")
+            progress.add_label(LOADING, "Deleting messages")
+            await progress.start(ctx)
+
+        succeeded = False
         try:
-            deleted = await ctx.channel.purge(
-                limit=limit, before=before, after=after, check=predicate
-            )
+            spammers = await engine.run(progress)
+            succeeded = True
 
         except discord.Forbidden:
             return await ctx.send("I do not have permissions to delete messages.")
@@ -1311,8 +1396,14 @@ class Moderation(commands.Cog):
         except discord.HTTPException as e:
             return await ctx.send(f"Error: {e} (try a smaller search?)")
 
-        spammers = Counter(m.author.display_name for m in deleted)
-        deleted = len(deleted)
+        finally:
+            if progress:
+                progress.change_label(0, emoji=ctx.tick(succeeded))
+                progress.change_label(1, emoji=ctx.tick(succeeded))
+                await progress.stop()
+                await progress.message.delete(delay=10)
+
+        deleted = sum(spammers.values())
         messages = [f'{deleted} message{" was" if deleted == 1 else "s were"} removed.']
         if deleted:
             messages.append("")
@@ -1400,7 +1491,8 @@ class Moderation(commands.Cog):
                     await ctx.send(str(e))
                     return
 
-            predicates.append(lambda m: m.author in users)
+            user_ids = {u.id for u in users}
+            predicates.append(lambda m: m.author.id in user_ids)
 
         if flags.contains:
             predicates.append(
@@ -1417,13 +1509,7 @@ class Moderation(commands.Cog):
                 lambda m: any(m.content.endswith(s) for s in flags.ends)
             )
 
-        op = all if not flags._or else any
-
-        def predicate(m):
-            r = op(p(m) for p in predicates)
-            if flags._not:
-                return not r
-            return r
+        predicate = compile_predicate(predicates, require_all=not flags._or, negate=flags._not)
 
         async def warn_them(search):
             return await ctx.confirm(
@@ -1478,9 +1564,7 @@ class Moderation(commands.Cog):
         if prefixes:
             predicates.append(lambda m: any(m.content.startswith(p) for p in prefixes))
 
-        def predicate(m):
-            r = any(p(m) for p in predicates)
-            return r
+        predicate = compile_predicate(predicates, require_all=False)
 
         search = max(0, min(2000, search))  # clamp from 0-2000
         await self.do_purge(ctx, search, predicate)
@@ -1751,8 +1835,8 @@ class Moderation(commands.Cog):
         def check(m):
             return m.author == ctx.me or m.content.startswith(prefixes)
 
-        deleted = await ctx.channel.purge(limit=search, check=check, before=ctx.message)
-        return Counter(m.author.display_name for m in deleted)
+        engine = PurgeEngine(ctx.channel, limit=search, check=check, before=ctx.message)
+        return await engine.run()
 
     @commands.command()
     @checks.has_permissions(manage_messages=True)
@@ -1790,40 +1874,235 @@ class Moderation(commands.Cog):
         query = """UPDATE guild_settings
                    SET muted_members = x.result_array
                    FROM jsonb_to_recordset($1::jsonb) AS
-                   x(id BIGINT, result_array BIGINT[])
+                   x(guild_id BIGINT, result_array BIGINT[])
                    WHERE guild_settings.id = x.guild_id;
                 """
 
         if not self._data_batch:
             return
 
+        batch, self._data_batch = self._data_batch, defaultdict(list)
+
         final_data = []
-        for guild_id, data in self._data_batch.items():
+        for guild_id, data in batch.items():
             # If it's touched this function then chances are that this has hit cache before
             # so it's not actually doing a query, hopefully.
             config = await self.get_guild_settings(guild_id)
-            as_set = config.muted_members
+            as_set = set(config.muted_members)
             for member_id, insertion in data:
                 func = as_set.add if insertion else as_set.discard
                 func(member_id)
 
             final_data.append({"guild_id": guild_id, "result_array": list(as_set)})
-            self.get_guild_settings.invalidate(self, guild_id)
 
-        await self.bot.pool.execute(query, final_data)
-        self._data_batch.clear()
+        try:
+            await self.bot.pool.execute(query, final_data)
+        except Exception:
+            # put the changes back in front of any newer ones to try again
+            for guild_id, data in batch.items():
+                self._data_batch[guild_id][:0] = data
+            raise
+
+        for guild_id in batch:
+            self.get_guild_settings.invalidate(self, guild_id)
 
     @tasks.loop(seconds=15.0)
     async def batch_updates(self):
         async with self._batch_lock:
             await self.bulk_insert()
 
-    async def register_spam_violation(self, member, message):
-        query = """INSERT INTO spam_violations (guild_id, user_id, channel_id)
-                   VALUES ($1, $2, $3);
-                """
-        await self.bot.pool.execute(query, member.guild.id, member.id, message.channel.id)
-        self.get_spam_violations.invalidate(self, member.guild.id, member.id)
+    def register_spam_violation(self, member, message):
+        """Queues a spam violation to be inserted with the next enforcement flush."""
+
+        self._violation_batch.append(
+            {
+                "guild_id": member.guild.id,
+                "user_id": member.id,
+                "channel_id": message.channel.id,
+                "violated_at": datetime.datetime.utcnow().isoformat(),
+            }
+        )
+        self._pending_violations[(member.guild.id, member.id)] += 1
+
+        # keep the cached count up to date instead of refetching it
+        counts = self.get_spam_violation_count
+        key = counts.get_key(self, member.guild.id, member.id)
+        if key in counts.cache:
+            counts.cache[key] += 1
+
+    def enqueue_enforcement(self, settings, action):
+        """Schedules an AutoMod punishment.
+
+        Punishments run with at most ``ENFORCEMENT_CONCURRENCY`` requests per guild
+        at a time, and are logged and saved in batches by :meth:`flush_enforcement`.
+        """
+
+        member = action.member
+        self._pending_enforcement.add((member.guild.id, member.id))
+
+        limit = self._enforcement_limits.get(member.guild.id)
+        if limit is None:
+            limit = self._enforcement_limits[member.guild.id] = asyncio.Semaphore(ENFORCEMENT_CONCURRENCY)
+
+        self.bot.loop.create_task(self.run_enforcement(settings, action, limit))
+
+    async def run_enforcement(self, settings, action, limit):
+        member = action.member
+        guild_id = member.guild.id
+
+        try:
+            async with limit:
+                if action.kind is EnforcementKind.tempmute:
+                    await member.add_roles(settings.mute_role, reason=action.reason)
+                else:
+                    await member.ban(reason=action.reason)
+
+        except discord.HTTPException:
+            log.info(f"[AutoMod] Failed to punish {member} (ID: {member.id}) in {member.guild}: {action.reason}")
+
+        else:
+            action.succeeded = True
+            log.info(f"[AutoMod] {action.kind.value} {member} (ID: {member.id}) in {member.guild}: {action.reason}")
+
+            if action.kind is EnforcementKind.tempmute:
+                self._data_batch[guild_id].append((member.id, True))
+                self._timer_batch.append(
+                    (action.until, "tempmute", [guild_id, settings.mute_role_id, None, member.id])
+                )
+
+        finally:
+            self._enforcement_batch[guild_id].append(action)
+
+    async def flush_enforcement(self):
+        if self._violation_batch:
+            query = """INSERT INTO spam_violations (guild_id, user_id, channel_id, violated_at)
+                       SELECT x.guild_id, x.user_id, x.channel_id, x.violated_at
+                       FROM jsonb_to_recordset($1::jsonb) AS
+                       x(guild_id BIGINT, user_id BIGINT, channel_id BIGINT, violated_at TIMESTAMP);
+                    """
+
+            violations, self._violation_batch = self._violation_batch, []
+            try:
+                await self.bot.pool.execute(query, violations)
+            except Exception:
+                log.exception(f"[AutoMod] Failed to insert {plural(len(violations)):spam violation}")
+                # put them back to try again on the next flush
+                self._violation_batch[:0] = violations
+            else:
+                inserted = Counter((v["guild_id"], v["user_id"]) for v in violations)
+                self._pending_violations -= inserted
+                for guild_id, user_id in inserted:
+                    self.get_spam_violations.invalidate(self, guild_id, user_id)
+
+        if self._timer_batch:
+            timers = self.bot.get_cog("Timers")
+            if timers:
+                to_create, self._timer_batch = self._timer_batch, []
+                try:
+                    await timers.create_timers(to_create)
+                except Exception:
+                    log.exception(f"[AutoMod] Failed to create {plural(len(to_create)):tempmute timer}")
+                    # short timers were already dispatched in memory, only retry the ones that go in the database
+                    cutoff = discord.utils.utcnow() + datetime.timedelta(seconds=60)
+                    self._timer_batch[:0] = [t for t in to_create if t[0] > cutoff]
+
+        try:
+            await self.bulk_insert()
+        except Exception:
+            # bulk_insert already put the mute changes back for the next flush
+            log.exception("[AutoMod] Failed to update muted members")
+
+        if not self._enforcement_batch:
+            return
+
+        batch, self._enforcement_batch = self._enforcement_batch, defaultdict(list)
+        for guild_id, actions in batch.items():
+            for action in actions:
+                self._pending_enforcement.discard((guild_id, action.member.id))
+
+            try:
+                await self.log_enforcement(guild_id, actions)
+            except discord.HTTPException:
+                log.exception(f"[AutoMod] Failed to log {plural(len(actions)):action} in guild ID {guild_id}")
+
+    @tasks.loop(seconds=5.0)
+    async def enforcement_updates(self):
+        async with self._batch_lock:
+            await self.flush_enforcement()
+
+    def enforcement_embed(self, action):
+        member = action.member
+
+        if action.kind is EnforcementKind.tempmute:
+            em = discord.Embed(
+                title="[AutoMod] Member Auto-Tempmuted",
+                description=member.mention,
+                color=discord.Color.orange()
+            )
+            em.add_field(name="Previous Spam Violations", value=action.violations)
+            em.add_field(name="Mute Duration", value=humantime.timedelta(action.until, discord_fmt=False))
+
+        elif action.kind is EnforcementKind.ban:
+            em = discord.Embed(
+                title="[AutoMod] Member Auto-Banned",
+                description=member.mention,
+                color=discord.Color.red()
+            )
+            if action.violations is not None:
+                em.add_field(name="Previous Spam Violations", value=action.violations)
+
+        else:
+            em = discord.Embed(
+                title="[AutoMod] Member auto-banned for mention spamming",
+                description=member.mention,
+                color=discord.Color.red()
+            )
+
+        em.set_author(name=str(member), icon_url=member.display_avatar.url)
+        em.add_field(name="Account Created", value=humantime.fulltime(member.created_at))
+        return em
+
+    def enforcement_summary_embed(self, actions):
+        em = discord.Embed(
+            title="[AutoMod] Raid Summary",
+            description=f"AutoMod acted on {plural(len(actions)):member} in the last few seconds.",
+            color=discord.Color.red(),
+            timestamp=discord.utils.utcnow(),
+        )
+
+        groups = defaultdict(list)
+        for action in actions:
+            groups[action.kind.value if action.succeeded else "Failed"].append(action.member)
+
+        for name, members in groups.items():
+            value = ""
+            for index, member in enumerate(members):
+                formatted = f"{member.mention} "
+                if len(value + formatted) > 990:
+                    value += f"...and {len(members) - index} more"
+                    break
+                value += formatted
+
+            em.add_field(name=f"{name} ({len(members)})", value=value, inline=False)
+
+        return em
+
+    async def log_enforcement(self, guild_id, actions):
+        succeeded = [a for a in actions if a.succeeded]
+        if not succeeded and len(actions) == 1:
+            return
+
+        guild_log = await self.bot.get_guild_log(guild_id)
+        if not guild_log:
+            return
+
+        # collapse raids into one message instead of one per member
+        if len(actions) == 1:
+            em = self.enforcement_embed(actions[0])
+        else:
+            em = self.enforcement_summary_embed(actions)
+
+        await guild_log.log_automod_action(embed=em)
 
     async def do_automod(self, settings, guild_id, member, message):
         mode = settings.automod_mode
@@ -1835,7 +2114,11 @@ class Moderation(commands.Cog):
         if not checker.is_spamming(message):
             return
 
-        violations = await self.get_spam_violations(guild_id, member.id)
+        # they're already being dealt with
+        if (guild_id, member.id) in self._pending_enforcement:
+            return
+
+        violations = await self.get_spam_violation_count(guild_id, member.id)
         mute_times = [
             600,    # 10 minutes
             3600,   # 1 hour
@@ -1843,109 +2126,61 @@ class Moderation(commands.Cog):
             86400,  # 1 day
         ]
 
-        medium_and_mute = mode == AutomodMode.medium.value and len(violations) < settings.violation_count
+        medium_and_mute = mode == AutomodMode.medium.value and violations < settings.violation_count
         if mode == AutomodMode.low.value or medium_and_mute:
-            # Mute the member
-            if len(violations) > 3:
-                mute_time = mute_times[-1]
-                dt = datetime.datetime.utcnow() + datetime.timedelta(seconds=mute_time)
+            if not settings.mute_role:
+                log.info(f"[AutoMod] Can't tempmute {member} (ID: {member.id}) in {member.guild}, there's no mute role")
+                return
 
-            else:
-                mute_time = mute_times[len(violations)]
-                dt = datetime.datetime.utcnow() + datetime.timedelta(seconds=mute_time)
+            # Mute the member
+            mute_time = mute_times[min(violations, len(mute_times) - 1)]
+            dt = discord.utils.utcnow() + datetime.timedelta(seconds=mute_time)
 
-            await self.register_spam_violation(member, message)
+            self.register_spam_violation(member, message)
 
             friendly = humantime.timedelta(dt, brief=True, discord_fmt=False)
             reason = (
                 f"[AutoMod] Auto-tempmute for {friendly} "
-                f"({plural(len(violations)):previous violation|previous violations})"
+                f"({plural(violations):previous violation|previous violations})"
             )
 
-            try:
-                await self.tempmute_member(settings, member, dt, reason)
-            except Exception:
-                log.info(f"[AutoMod] Failed to tempmute {member} (ID: {member.id}) for {humantime.timedelta(dt, discord_fmt=False)}")
-            else:
-                log.info(f"[AutoMod] Tempmuted {member} (ID: {member.id}) for {humantime.timedelta(dt, discord_fmt=False)}")
-
-                guild_log = await self.bot.get_guild_log(member.guild.id)
-                if guild_log:
-                    em = discord.Embed(
-                        title="[AutoMod] Member Auto-Tempmuted",
-                        description=member.mention,
-                        color=discord.Color.orange()
-                    )
-                    em.set_author(name=str(member), icon_url=member.display_avatar.url)
-                    em.add_field(name="Previous Spam Violations", value=len(violations))
-                    em.add_field(name="Mute Duration", value=humantime.timedelta(dt, discord_fmt=False))
-                    em.add_field(name="Account Created", value=humantime.fulltime(member.created_at))
-
-                    await guild_log.log_automod_action(embed=em)
-
+            action = EnforcementAction(
+                EnforcementKind.tempmute, member, reason, violations=violations, until=dt
+            )
+            self.enqueue_enforcement(settings, action)
             return
 
         if mode == AutomodMode.medium.value:
-            member_violations = f" ({plural(len(violations)):previous violation|previous violations})"
+            member_violations = f" ({plural(violations):previous violation|previous violations})"
         else:
             member_violations = ""
 
-        try:
-            await member.ban(reason=f"[AutoMod] Auto-ban from spam{member_violations}")
-        except discord.HTTPException:
-            log.info(
-                f"[AutoMod] Failed to ban {member} (ID: {member.id}) from server {member.guild}{member_violations}."
-            )
-        else:
-            log.info(
-                f"[AutoMod] Banned {member} (ID: {member.id}) from server {member.guild}{member_violations}."
-            )
-
-            guild_log = await self.bot.get_guild_log(member.guild.id)
-            if guild_log:
-                em = discord.Embed(
-                    title="[AutoMod] Member Auto-Banned",
-                    description=member.mention,
-                    color=discord.Color.red()
-                )
-                em.set_author(name=str(member), icon_url=member.display_avatar.url)
-                if mode == AutomodMode.medium.value:
-                    em.add_field(name="Previous Spam Violations", value=len(violations))
-
-                em.add_field(name="Account Created", value=humantime.fulltime(member.created_at))
+        action = EnforcementAction(
+            EnforcementKind.ban,
+            member,
+            f"[AutoMod] Auto-ban from spam{member_violations}",
+            violations=violations if mode == AutomodMode.medium.value else None,
+        )
+        self.enqueue_enforcement(settings, action)
 
-                await guild_log.log_automod_action(embed=em)
+    async def automod_stage(self, message, facts):
+        # most guilds don't use AutoMod, so bail before touching settings
+        if message.guild.id not in self._automod_guilds:
+            return
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
         author = message.author
         if author.id in (self.bot.user.id, self.bot.owner_id):
             return
 
-        if message.guild is None:
-            return
-
         if not isinstance(author, discord.Member):
             return
 
-        if author.bot:
-            return
-
         guild_id = message.guild.id
-        settings = await self.get_guild_settings(guild_id)
+        settings = await facts.get_settings()
         if settings is None:
             return
 
-        if settings.ignore_roles and len(author.roles) > 1:
-            return
-
-        if author.id in settings.ignored_members:
-            return
-
-        if message.channel.id in settings.ignored_channels:
-            return
-
-        if any(r.id in settings.ignored_roles for r in author.roles):
+        if await facts.is_ignored():
             return
 
         await self.do_automod(settings, guild_id, author, message)
@@ -1957,31 +2192,20 @@ class Moderation(commands.Cog):
         if not settings.mention_count:
             return
 
+        if (guild_id, author.id) in self._pending_enforcement:
+            return
+
         # check if it meets the thresholds required
         mention_count = sum(not m.bot and m.id != author.id for m in message.mentions)
         if mention_count < settings.mention_count:
             return
 
-        try:
-            await author.ban(reason=f"[AutoMod] Spamming mentions ({mention_count} mentions)")
-        except Exception:
-            log.info(
-                f"Failed to autoban member {author} (ID: {author.id}) in guild ID {guild_id}"
-            )
-        else:
-            log.info(
-                f"[MentionSpam] Banned {author} (ID: {author.id}) from server {author.guild} for spamming {mention_count} mentions.")
-            guild_log = await self.bot.get_guild_log(author.guild.id)
-            if guild_log:
-                em = discord.Embed(
-                    title="[AutoMod] Member auto-banned for mention spamming",
-                    description=author.mention,
-                    color=discord.Color.red()
-                )
-                em.set_author(name=str(author), icon_url=author.display_avatar.url)
-                em.add_field(name="Account Created", value=humantime.fulltime(author.created_at))
-
-                await guild_log.log_automod_action(embed=em)
+        action = EnforcementAction(
+            EnforcementKind.mention_ban,
+            author,
+            f"[AutoMod] Spamming mentions ({mention_count} mentions)",
+        )
+        self.enqueue_enforcement(settings, action)
 
     @commands.group(aliases=["raid"], invoke_without_command=True)
     @checks.has_permissions(manage_guild=True)
@@ -1998,6 +2222,9 @@ class Moderation(commands.Cog):
         To learn more about a mode, use `{prefix}help automod <mode>`
         To set automod to a mode, use `{prefix}automod <mode>`
 
+        When AutoMod acts on several members at once (like during a raid),
+        its log messages are combined into a single summary.
+
         You must have Manage Server permissions to use this command or
         its subcommands.
         """
@@ -2055,7 +2282,7 @@ class Moderation(commands.Cog):
                 """
 
         await ctx.db.execute(query, ctx.guild.id, AutomodMode.low.value)
-        self.get_guild_settings.invalidate(self, ctx.guild.id)
+        await self.refresh_automod_state(ctx.guild.id)
 
         guild_log = await ctx.get_guild_log()
         if not guild_log or not guild_log.log_automod_actions:
@@ -2096,7 +2323,7 @@ class Moderation(commands.Cog):
                 """
 
         await ctx.db.execute(query, ctx.guild.id, AutomodMode.medium.value, violations)
-        self.get_guild_settings.invalidate(self, ctx.guild.id)
+        await self.refresh_automod_state(ctx.guild.id)
 
         guild_log = await ctx.get_guild_log()
         if not guild_log or not guild_log.log_automod_actions:
@@ -2130,7 +2357,7 @@ class Moderation(commands.Cog):
                 """
 
         await ctx.db.execute(query, ctx.guild.id, AutomodMode.high.value)
-        self.get_guild_settings.invalidate(self, ctx.guild.id)
+        await self.refresh_automod_state(ctx.guild.id)
 
         guild_log = await ctx.get_guild_log()
         if not guild_log or not guild_log.log_automod_actions:
@@ -2153,7 +2380,7 @@ class Moderation(commands.Cog):
 
         await ctx.db.execute(query, ctx.guild.id, AutomodMode.off.value)
         self._spam_check.pop(ctx.guild.id, None)
-        self.get_guild_settings.invalidate(self, ctx.guild.id)
+        await self.refresh_automod_state(ctx.guild.id)
 
         await ctx.send(ctx.tick(True, "AutoMod disabled."))
 
@@ -2167,6 +2394,8 @@ class Moderation(commands.Cog):
                    RETURNING id;
                    """
         records = await ctx.db.fetch(query, ctx.guild.id, member.id)
+        self.get_spam_violations.invalidate(self, ctx.guild.id, member.id)
+        self.get_spam_violation_count.invalidate(self, ctx.guild.id, member.id)
 
         if not records:
             return await ctx.send("That member has no spam violations on record.")
@@ -2401,7 +2630,7 @@ class Moderation(commands.Cog):
         if count == 0:
             query = """UPDATE guild_settings SET mention_count = NULL WHERE id=$1;"""
             await ctx.db.execute(query, ctx.guild.id)
-            self.get_guild_settings.invalidate(self, ctx.guild.id)
+            await self.refresh_automod_state(ctx.guild.id)
             return await ctx.send("Auto-banning members has been disabled.")
 
         if count <= 3:
@@ -2416,7 +2645,7 @@ class Moderation(commands.Cog):
                        mention_count = $2;
                 """
         await ctx.db.execute(query, ctx.guild.id, count)
-        self.get_guild_settings.invalidate(self, ctx.guild.id)
+        await self.refresh_automod_state(ctx.guild.id)
         await ctx.send(
             f"Now auto-banning members that mention more than {count} users."
         )
@@ -2451,6 +2680,7 @@ class Moderation(commands.Cog):
                 """
         await ctx.db.execute(query, ctx.guild.id, forbidden_words)
         self.get_guild_settings.invalidate(self, ctx.guild.id)
+        self._forbidden_matchers.pop(ctx.guild.id, None)
         await ctx.send(ctx.tick(True, f"Members will now be kicked if they say `{word}`."))
 
     @commands.command()
@@ -2476,6 +2706,7 @@ class Moderation(commands.Cog):
                 """
         await ctx.db.execute(query, ctx.guild.id, forbidden_words)
         self.get_guild_settings.invalidate(self, ctx.guild.id)
+        self._forbidden_matchers.pop(ctx.guild.id, None)
         await ctx.send(ctx.tick(True, f"Members are now free to say `{word}`."))
 
     @commands.group(invoke_without_command=True)
@@ -2516,6 +2747,7 @@ class Moderation(commands.Cog):
                 """
         await ctx.db.execute(query, ctx.guild.id, [])
         self.get_guild_settings.invalidate(self, ctx.guild.id)
+        self._forbidden_matchers.pop(ctx.guild.id, None)
         await ctx.send(ctx.tick(True, "Members are now free to say anything they like."))
 
     async def revert_member_on_rejoin(self, member):
@@ -2609,7 +2841,16 @@ class Moderation(commands.Cog):
 
             await guild_log.log_automod_action(embed=em)
 
-    async def detect_forbidden_word(self, message):
+    def get_forbidden_matcher(self, settings):
+        matcher = self._forbidden_matchers.get(settings.id)
+
+        # the words can also change without going through the commands (e.g. a manual db edit)
+        if matcher is None or matcher.words != tuple(settings.forbidden_words):
+            matcher = self._forbidden_matchers[settings.id] = WordMatcher(settings.forbidden_words)
+
+        return matcher
+
+    async def detect_forbidden_word(self, message, *, settings=None):
         """Detects if a forbidden word is in a message and takes appropriate action."""
 
         if message.author.bot:
@@ -2618,11 +2859,8 @@ class Moderation(commands.Cog):
         if not message.guild:
             return
 
-        bot_permissions = message.guild.me.guild_permissions
-        if not bot_permissions.kick_members or not bot_permissions.create_instant_invite:
-            return
-
-        settings = await self.get_guild_settings(message.guild.id)
+        if settings is None:
+            settings = await self.get_guild_settings(message.guild.id)
 
         if not settings:
             return
@@ -2633,17 +2871,24 @@ class Moderation(commands.Cog):
         # if await self.bot.is_owner(message.author):
         #     return
 
-        # remove whitespace.
-        content = "".join(message.content.split())
+        matcher = self.get_forbidden_matcher(settings)
+        word = matcher.search(message.content)
+        if word is None:
+            return
 
-        for word in settings.forbidden_words:
-            if word in content.lower():
-                await self.bonk_member(message, word)
-                break
+        # computing permissions isn't free, so only do it once we have a match
+        bot_permissions = message.guild.me.guild_permissions
+        if not bot_permissions.kick_members or not bot_permissions.create_instant_invite:
+            return
+
+        await self.bonk_member(message, word)
+
+    async def forbidden_words_stage(self, message, facts):
+        settings = await facts.get_settings()
+        if not settings:
+            return
 
-    @commands.Cog.listener("on_message")
-    async def on_message_forbidden_detector(self, message):
-        await self.detect_forbidden_word(message)
+        await self.detect_forbidden_word(message, settings=settings)
 
     @commands.Cog.listener("on_message_edit")
     async def on_message_edit_forbidden_detector(self, before, after):
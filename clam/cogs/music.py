@@ -1,7 +1,6 @@
 import asyncio
 import datetime
 import enum
-import functools
 import importlib
 import itertools
 import logging
@@ -9,8 +8,10 @@ import os.path
 import random
 import re
 import sys
+import time
 import traceback
 import typing
+from collections import Counter
 from urllib.parse import urlparse
 
 import asyncpg
@@ -19,20 +20,27 @@ import humanize
 import youtube_dl
 from async_timeout import timeout
 from discord import app_commands
-from discord.ext import commands, flags, menus
+from discord.ext import commands, flags, menus, tasks
 
-from clam.utils import colors, db, humantime, stopwatch
+from clam.utils import cache, colors, db, humantime, stopwatch
+from clam.utils.audiostream import ActiveDownload
+from clam.utils.opuscache import OpusCache
 from clam.utils.context import Context
 from clam.utils.emojis import GREEN_TICK, LOADING, RED_TICK
 from clam.utils.flags import NoUsageFlagCommand
 from clam.utils.formats import plural
 from clam.utils.menus import MenuPages, UpdatingMessage
+from clam.utils.musiccache import MusicCache
+from clam.utils.ytdl import YTDLExecutor
 
 log = logging.getLogger("clam.music")
 bin_log = logging.getLogger("clam.music.bin")
 ytdl_log = logging.getLogger("clam.music.ytdl")
 player_log = logging.getLogger("clam.music.player")
 
+# Volume players start at, and the gain Opus copies are encoded with
+DEFAULT_VOLUME = 0.5
+
 
 class SongsTable(db.Table, table_name="songs"):
     id = db.PrimaryKeyColumn()
@@ -46,14 +54,169 @@ class SongsTable(db.Table, table_name="songs"):
     info = db.Column(db.JSON, default="'{}'::jsonb")  # info dict that youtube_dl gives
     plays = db.Column(db.Integer, default=0)
 
+    # size of the downloaded file, NULL if it isn't in the cache
+    file_size = db.Column(db.Integer(big=True))
+    last_played = db.Column(db.Datetime())
+
     registered_at = db.Column(db.Datetime(), default="now() at time zone 'utc'")
     last_updated = db.Column(db.Datetime(), default="now() at time zone 'utc'")
 
     @classmethod
     def create_table(cls, *, exists_ok=True):
         statement = super().create_table(exists_ok=exists_ok)
-        sql = "CREATE INDEX IF NOT EXISTS songs_title_trgm_idx ON songs USING GIN (title gin_trgm_ops);"
-        return statement + "\n" + sql
+        # GiST instead of GIN so title searches can be ordered by distance (<->) from the index
+        sql = "CREATE INDEX IF NOT EXISTS songs_title_trgm_idx ON songs USING GIST (title gist_trgm_ops);"
+        # songs are fetched concurrently, so inserts rely on this to avoid duplicates
+        uniq = "CREATE UNIQUE INDEX IF NOT EXISTS songs_uniq_idx ON songs (song_id, extractor);"
+        return "\n".join((statement, sql, uniq))
+
+    @classmethod
+    async def repair(cls, *, verbose=False, connection=None):
+        """Merges duplicate songs into the oldest copy, then builds songs_uniq_idx."""
+
+        async with db.MaybeAcquire(connection, pool=cls._pool) as con:
+            query = "SELECT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'songs_uniq_idx');"
+            if await con.fetchval(query):
+                return False
+
+            statements = [
+                """CREATE TEMPORARY TABLE songs_duplicates ON COMMIT DROP AS
+                   SELECT id, keep FROM (
+                       SELECT id, MIN(id) OVER (PARTITION BY song_id, extractor) AS keep FROM songs
+                   ) AS s
+                   WHERE id <> keep;
+                """,
+                """UPDATE songs SET plays = COALESCE(songs.plays, 0) + x.plays
+                   FROM (
+                       SELECT d.keep, SUM(COALESCE(s.plays, 0)) AS plays
+                       FROM songs_duplicates d INNER JOIN songs s ON s.id = d.id
+                       GROUP BY d.keep
+                   ) AS x
+                   WHERE songs.id = x.keep;
+                """,
+            ]
+
+            # rows pointing at a duplicate are moved to the song that's kept
+            if await con.fetchval("SELECT to_regclass('song_aliases') IS NOT NULL;"):
+                statements.append(
+                    """DELETE FROM song_aliases WHERE id IN (
+                           SELECT id FROM (
+                               SELECT a.id, ROW_NUMBER() OVER (
+                                   PARTITION BY a.alias, a.user_id, COALESCE(d.keep, a.song_id) ORDER BY a.id
+                               ) AS n
+                               FROM song_aliases a LEFT JOIN songs_duplicates d ON d.id = a.song_id
+                           ) AS x
+                           WHERE n > 1
+                       );
+                    """
+                )
+                statements.append(
+                    """UPDATE song_aliases SET song_id = d.keep
+                       FROM songs_duplicates d WHERE song_aliases.song_id = d.id;
+                    """
+                )
+
+            if await con.fetchval("SELECT to_regclass('song_plays') IS NOT NULL;"):
+                statements.append(
+                    """UPDATE song_plays SET song_id = d.keep
+                       FROM songs_duplicates d WHERE song_plays.song_id = d.id;
+                    """
+                )
+
+            statements.append("DELETE FROM songs USING songs_duplicates d WHERE songs.id = d.id;")
+            statements.append("CREATE UNIQUE INDEX songs_uniq_idx ON songs (song_id, extractor);")
+
+            async with con.transaction():
+                for sql in statements:
+                    if verbose:
+                        print(sql)
+                    await con.execute(sql)
+
+        return True
+
+
+# What each song adds to the summary. Durations are in seconds.
+SONGS_SUMMARY_AGGREGATES = """COUNT(*),
+       COALESCE(SUM(plays), 0),
+       COALESCE(SUM((info->>'duration')::FLOAT), 0),
+       COALESCE(SUM((info->>'duration')::FLOAT * plays), 0),
+       COALESCE(SUM(file_size), 0)"""
+
+
+class SongsSummaryTable(db.Table, table_name="songs_summary"):
+    """Running totals for the whole songs table, kept in a single row.
+
+    Statement level triggers on ``songs`` apply the difference made by
+    every insert, update and delete, so reading the totals never has to
+    scan the table.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)  # always 1
+
+    songs = db.Column(db.Integer(big=True), default=0, nullable=False)
+    plays = db.Column(db.Integer(big=True), default=0, nullable=False)
+    duration = db.Column(db.Float, default=0, nullable=False)
+    played_duration = db.Column(db.Float, default=0, nullable=False)  # duration * plays
+    cache_bytes = db.Column(db.Integer(big=True), default=0, nullable=False)
+
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        statement = super().create_table(exists_ok=exists_ok)
+
+        seed = f"""INSERT INTO songs_summary (id, songs, plays, duration, played_duration, cache_bytes)
+                   SELECT 1, {SONGS_SUMMARY_AGGREGATES}
+                   FROM songs
+                   ON CONFLICT (id) DO NOTHING;
+                """
+
+        # the transition tables only exist for the operations that have them,
+        # plpgsql doesn't look at the branches that aren't taken
+        function = f"""CREATE OR REPLACE FUNCTION songs_summary_update() RETURNS TRIGGER AS $$
+                       BEGIN
+                           IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                               UPDATE songs_summary AS s
+                               SET songs = s.songs - x.songs, plays = s.plays - x.plays,
+                                   duration = s.duration - x.duration,
+                                   played_duration = s.played_duration - x.played_duration,
+                                   cache_bytes = s.cache_bytes - x.cache_bytes
+                               FROM (SELECT {SONGS_SUMMARY_AGGREGATES} FROM old_songs)
+                                    AS x(songs, plays, duration, played_duration, cache_bytes)
+                               WHERE s.id = 1;
+                           END IF;
+
+                           IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                               UPDATE songs_summary AS s
+                               SET songs = s.songs + x.songs, plays = s.plays + x.plays,
+                                   duration = s.duration + x.duration,
+                                   played_duration = s.played_duration + x.played_duration,
+                                   cache_bytes = s.cache_bytes + x.cache_bytes
+                               FROM (SELECT {SONGS_SUMMARY_AGGREGATES} FROM new_songs)
+                                    AS x(songs, plays, duration, played_duration, cache_bytes)
+                               WHERE s.id = 1;
+                           END IF;
+
+                           RETURN NULL;
+                       END;
+                       $$ LANGUAGE plpgsql;
+                    """
+
+        triggers = """DROP TRIGGER IF EXISTS songs_summary_insert ON songs;
+                      CREATE TRIGGER songs_summary_insert AFTER INSERT ON songs
+                      REFERENCING NEW TABLE AS new_songs
+                      FOR EACH STATEMENT EXECUTE PROCEDURE songs_summary_update();
+
+                      DROP TRIGGER IF EXISTS songs_summary_update ON songs;
+                      CREATE TRIGGER songs_summary_update AFTER UPDATE ON songs
+                      REFERENCING OLD TABLE AS old_songs NEW TABLE AS new_songs
+                      FOR EACH STATEMENT EXECUTE PROCEDURE songs_summary_update();
+
+                      DROP TRIGGER IF EXISTS songs_summary_delete ON songs;
+                      CREATE TRIGGER songs_summary_delete AFTER DELETE ON songs
+                      REFERENCING OLD TABLE AS old_songs
+                      FOR EACH STATEMENT EXECUTE PROCEDURE songs_summary_update();
+                   """
+
+        return "\n".join((statement, seed, function, triggers))
 
 
 class SongAliases(db.Table, table_name="song_aliases"):
@@ -72,14 +235,84 @@ class SongAliases(db.Table, table_name="song_aliases"):
         return statement + "\n" + sql
 
 
-# Silence useless bug reports messages
-youtube_dl.utils.bug_reports_message = lambda: ""
+# Append-only listening history. Rows are written in batches by the
+# play count flush loop, never updated.
+class SongPlays(db.Table, table_name="song_plays"):
+    id = db.PrimaryKeyColumn()
+
+    song_id = db.Column(db.Integer, index=True)  # songs.id
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    user_id = db.Column(db.Integer(big=True), index=True)  # who requested the song
+    played_at = db.Column(db.Datetime, index=True)
+
+
+# Plays kept for the next flush when saving them fails, the oldest are dropped past this
+MAX_PENDING_PLAYS = 10000
+
+
+# Players saved when the bot shuts down, restored when it starts again
+# Saved players older than this aren't restored
+PLAYER_STATE_MAX_AGE = datetime.timedelta(hours=1)
+
+
+class MusicPlayerStates(db.Table, table_name="music_player_states"):
+    guild_id = db.Column(db.Integer(big=True), primary_key=True)
+    voice_channel_id = db.Column(db.Integer(big=True))
+    text_channel_id = db.Column(db.Integer(big=True))
+
+    # the current song first, then the queue
+    extractors = db.Column(db.Array(db.String))
+    song_ids = db.Column(db.Array(db.String))
+    requester_ids = db.Column(db.Array(db.Integer(big=True)))
+    position = db.Column(db.Integer, default=0)  # seconds into the current song
+
+    loop = db.Column(db.Boolean, default=False)
+    loop_queue = db.Column(db.Boolean, default=False)
+    notify = db.Column(db.Boolean, default=False)
+    volume = db.Column(db.Float, default=0.5)
+
+    saved_at = db.Column(db.Datetime, default="now() at time zone 'utc'")
 
 
 class YTDLError(commands.CommandError):
     pass
 
 
+class FirstFrameMixin:
+    """Calls ``_on_first_frame`` once, when the first frame of audio is read."""
+
+    _on_first_frame = None
+
+    def read(self):
+        data = super().read()
+
+        if data and self._on_first_frame:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback()
+
+        return data
+
+
+class VolumeSource(FirstFrameMixin, discord.PCMVolumeTransformer):
+    """A volume transformer that reports when its first frame is read."""
+
+    def __init__(self, original, volume=1.0, *, on_first_frame=None):
+        super().__init__(original, volume)
+        self._on_first_frame = on_first_frame
+
+
+class OpusSource(FirstFrameMixin, discord.FFmpegOpusAudio):
+    """An Ogg Opus file sent to Discord as-is, without re-encoding.
+
+    It has no volume control, so it's only used when the volume matches
+    the gain the copy was encoded with.
+    """
+
+    def __init__(self, source, *, on_first_frame=None, **kwargs):
+        super().__init__(source, codec="opus", **kwargs)
+        self._on_first_frame = on_first_frame
+
+
 class Aborted(RuntimeError):
     pass
 
@@ -261,7 +494,7 @@ class Song:
         *,
         data: dict,
         source: discord.FFmpegPCMAudio = None,
-        volume: float = 0.5,
+        volume: float = DEFAULT_VOLUME,
         filename=None,
     ):
         self.ffmpeg_options = self.FFMPEG_OPTIONS.copy()
@@ -301,6 +534,16 @@ class Song:
         self.dislikes = data.get("dislike_count")
         self.stream_url = data.get("url")
 
+        # the download this song is streamed from, if it's still downloading
+        self.download = None
+        self.stream = None
+
+        # how the current source plays the song: stream, opus, or file
+        self.source_mode = None
+
+        # where the song starts, in seconds
+        self.start_position = 0
+
         # database stuff
         self.database = False
         self.registered_at = None
@@ -316,18 +559,51 @@ class Song:
     @volume.setter
     def volume(self, volume: float):
         self._volume = volume
-        if self.source:
+        if self.source and not self.source.is_opus():
             self.source.volume = volume
 
-    def make_source(self):
+    def start_at(self, position):
+        self.start_position = position
+        self.ffmpeg_options["options"] = f"-ss {self.timestamp_duration(position)}"
+
+    @property
+    def is_streaming(self):
+        return self.download is not None and not self.download.done
+
+    def get_opus_copy(self):
+        """Returns the path to this song's Opus copy if it can be played as-is."""
+
+        music = self.ctx.bot.get_cog("Music")
+        if not music or not music.opus or self.volume != music.opus.gain:
+            return None
+
+        return music.opus.get(self.extractor, self.id)
+
+    def make_source(self, *, on_first_frame=None):
         if self.source:
-            self.source.cleanup()
-            self.source = None
+            self.discard_source()
 
-        source = discord.FFmpegPCMAudio(self.filename, **self.ffmpeg_options)
-        self.source = discord.PCMVolumeTransformer(source, self.volume)
+        if self.is_streaming:
+            self.stream = self.download.open()
+            source = discord.FFmpegPCMAudio(self.stream, pipe=True, **self.ffmpeg_options)
+            self.source_mode = "stream"
+
+        elif opus := self.get_opus_copy():
+            self.source = OpusSource(opus, on_first_frame=on_first_frame, **self.ffmpeg_options)
+            self.source_mode = "opus"
+            return
+
+        else:
+            source = discord.FFmpegPCMAudio(self.filename, **self.ffmpeg_options)
+            self.source_mode = "file"
+
+        self.source = VolumeSource(source, self.volume, on_first_frame=on_first_frame)
 
     def discard_source(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
         self.source.cleanup()
         self.source = None
 
@@ -363,15 +639,11 @@ class Song:
             ytdl_log.info(f"Found song in database: {song.id}")
             return song
 
-        query = """SELECT *
-                   FROM songs
-                   ORDER BY similarity(title, $1) DESC
-                """
-
-        record = await ctx.db.fetchrow(query, search)
+        music = ctx.bot.get_cog("Music")
+        record = await music.fetch_song_by_title(search)
 
         if not record:
-            return await ctx.send(f":x: Could not find a match for `{search}`")
+            return None
 
         return cls.from_record(record, ctx)
 
@@ -412,6 +684,119 @@ class Song:
 
         return cls.from_record(record, ctx)
 
+    @classmethod
+    async def insert_song(cls, ctx, filename, info):
+        """Inserts a song into the database if it isn't there yet, and returns its ID.
+
+        Songs are fetched concurrently, so this relies on songs_uniq_idx to
+        avoid duplicates. Databases that haven't been repaired yet don't
+        have it, and fall back to checking before inserting.
+        """
+
+        song_id = info.get("id")
+        extractor = info.get("extractor")
+        music = ctx.bot.get_cog("Music")
+
+        if music and music.songs_unique:
+            # the no-op update makes RETURNING work if someone else inserted it first
+            query = """INSERT INTO songs (filename, title, song_id, extractor, info)
+                       VALUES ($1, $2, $3, $4, $5::jsonb)
+                       ON CONFLICT (song_id, extractor) DO UPDATE SET song_id = EXCLUDED.song_id
+                       RETURNING songs.id;
+                    """
+            return await ctx.db.fetchval(query, filename, info.get("title"), song_id, extractor, info)
+
+        query = "SELECT id FROM songs WHERE song_id=$1 AND extractor=$2 ORDER BY id LIMIT 1;"
+        existing = await ctx.db.fetchval(query, song_id, extractor)
+        if existing is not None:
+            return existing
+
+        query = """INSERT INTO songs (filename, title, song_id, extractor, info)
+                   VALUES ($1, $2, $3, $4, $5::jsonb)
+                   RETURNING songs.id;
+                """
+        return await ctx.db.fetchval(query, filename, info.get("title"), song_id, extractor, info)
+
+    @classmethod
+    async def extract_info(
+        cls, ctx, url, *, playlist=False, download=True, process=True, on_start=None
+    ):
+        """Runs youtube_dl on the music worker pool instead of the default executor."""
+
+        options = cls.YTDL_PLAYLIST_OPTIONS if playlist else cls.YTDL_OPTIONS
+        guild_id = ctx.guild.id if ctx.guild else None
+
+        music = ctx.bot.get_cog("Music")
+        return await music.ytdl.extract_info(
+            options, url, download=download, process=process, guild_id=guild_id, on_start=on_start
+        )
+
+    @staticmethod
+    def is_downloaded(bot, extractor, song_id):
+        music = bot.get_cog("Music")
+        return music is not None and (extractor, song_id) in music.cache
+
+    @staticmethod
+    async def register_download(ctx, filename):
+        music = ctx.bot.get_cog("Music")
+        if music:
+            await music.register_download(filename)
+
+    @staticmethod
+    def is_streaming_enabled(bot):
+        music = bot.get_cog("Music")
+        return music is not None and music.streaming
+
+    async def ensure_downloaded(self, bot):
+        """Downloads the song if its file isn't in the cache.
+
+        With streaming on, this only starts the download, and the song
+        plays from the file while it's being written.
+        """
+
+        if self.is_downloaded(bot, self.extractor, self.id):
+            return
+
+        music = bot.get_cog("Music")
+        if music and music.streaming:
+            download = music.start_download(self)
+            self.download = download
+
+            # the job might still be waiting for a ytdl worker
+            await download.wait_started()
+            if download.failed:
+                raise YTDLError(f"Couldn't download `{self.url}`")
+
+            if download.done:
+                self.filename = download.path
+            return
+
+        download = music.get_download(self) if music else None
+        if download:
+            # it's already being prefetched, so just wait for it
+            await asyncio.wait({download.task})
+            if download.failed:
+                raise YTDLError(f"Couldn't download `{self.url}`")
+
+            self.filename = download.path
+            return
+
+        ytdl_log.info(f"Song '{self.extractor}-{self.id}' is not in the cache, downloading...")
+
+        info = await self.extract_info(self.ctx, self.url, download=True)
+
+        if info is None:
+            raise YTDLError(f"Couldn't download `{self.url}`")
+
+        if "entries" in info:
+            info = next(e for e in info["entries"] if e)
+
+        self.filename = self.ytdl.prepare_filename(info)
+
+        music = bot.get_cog("Music")
+        if music:
+            await music.register_download(self.filename, update_filename=True)
+
     @staticmethod
     def parse_youtube_id(search):
         yt_urls = re.compile(
@@ -426,13 +811,8 @@ class Song:
 
     @classmethod
     async def resolve_webpage_url(cls, ctx, search, *, send_errors=True):
-        loop = ctx.bot.loop
-
-        partial = functools.partial(
-            cls.ytdl.extract_info, search, download=False, process=False
-        )
         try:
-            data = await loop.run_in_executor(None, partial)
+            data = await cls.extract_info(ctx, search, download=False, process=False)
 
         except youtube_dl.DownloadError as e:
             ytdl_log.warning(f"Error while searching for '{search}': {e}")
@@ -477,28 +857,10 @@ class Song:
             )
             return song
 
-        # YTDL is weird about file extensions
-        # Since the file extension is always .NA, I'll have to
-        # take off the file extension and the cache/.
-        # Then I have to loop through the files in the cache,
-        # and take off their file extensions.
-        # I can then compare the filename to each file in
-        # the cache to see if the song has been downloaded.
-        # There are probably a thousand better ways to do this...
-        # ¯\_(ツ)_/¯
+        # unprocessed search results only have the extractor's key
+        extractor = extractor or process_info.get("ie_key", "").lower()
 
-        def is_in_cache(filename):
-            for f in os.listdir("cache"):
-                name = os.path.splitext(f)[0]
-
-                if filename == name:
-                    return True
-
-            return False
-
-        filename = cls.ytdl.prepare_filename(process_info)[6:-3]
-
-        if is_in_cache(filename):
+        if cls.is_downloaded(ctx.bot, extractor, song_id):
             ytdl_log.info(f"Song {song_id} is already downloaded. Skipping download.")
             download = False
         else:
@@ -575,11 +937,12 @@ class Song:
             webpage_url = search
             download = True
 
-        partial = functools.partial(
-            cls.ytdl.extract_info, webpage_url, download=download
-        )
+        # the player downloads it while it plays
+        if download and cls.is_streaming_enabled(ctx.bot):
+            download = False
+
         try:
-            processed_info = await loop.run_in_executor(None, partial)
+            processed_info = await cls.extract_info(ctx, webpage_url, download=download)
         except youtube_dl.DownloadError as e:
             ytdl_log.warning(f"Error while downloading '{webpage_url}': {e}")
             if send_errors:
@@ -615,14 +978,7 @@ class Song:
 
             if not song:
                 ytdl_log.info(f"Song '{extractor}-{song_id}' not in database, inserting")
-                query = """INSERT INTO songs (filename, title, song_id, extractor, info)
-                           VALUES ($1, $2, $3, $4, $5::jsonb)
-                           RETURNING songs.id;
-                        """
-
-                song_id = await ctx.db.fetchval(
-                    query, filename, info.get("title"), song_id, extractor, info
-                )
+                song_id = await cls.insert_song(ctx, filename, info)
 
             else:
                 ytdl_log.info(
@@ -630,6 +986,9 @@ class Song:
                 )
                 song_id = song.db_id
 
+            if download:
+                await cls.register_download(ctx, filename)
+
             query = """INSERT INTO song_aliases (alias, expires_at, song_id)
                        VALUES ($1, $2, $3);
                     """
@@ -659,6 +1018,75 @@ class Song:
 
             return song
 
+    @classmethod
+    async def fetch_many_from_database(cls, ctx, keys):
+        """Fetches songs by ``(extractor, id)`` in one query."""
+
+        query = "SELECT * FROM songs WHERE song_id = ANY($1::TEXT[]);"
+        records = await ctx.db.fetch(query, list({song_id for _, song_id in keys}))
+
+        wanted = set(keys)
+        songs = {}
+        for record in records:
+            key = (record["extractor"], record["song_id"])
+            if key in wanted and key not in songs:
+                songs[key] = cls.from_record(record, ctx)
+
+        return songs
+
+    @classmethod
+    async def fetch_playlist_entry(cls, ctx, video):
+        webpage_url = video["url"]
+        extractor = video.get("extractor") or "youtube"
+        download = not cls.is_downloaded(ctx.bot, extractor, video.get("id"))
+
+        # the player downloads it while it plays
+        if cls.is_streaming_enabled(ctx.bot):
+            download = False
+
+        ytdl_log.info(f"Fetching playlist song '{webpage_url}' (download: {download})")
+
+        try:
+            data = await cls.extract_info(ctx, webpage_url, playlist=True, download=download)
+        except youtube_dl.DownloadError as e:
+            ytdl_log.warning(f"Error while downloading '{webpage_url}': {e}")
+            return None
+
+        if data is None:
+            return None
+
+        if "entries" not in data:
+            info = data
+        else:
+            info = next((e for e in data["entries"] if e), None)
+            if info is None:
+                return None
+
+        song_id = info.get("id")
+        extractor = info.get("extractor")
+        filename = cls.playlist_ytdl.prepare_filename(info)
+
+        song = await cls.fetch_from_database(ctx, song_id, extractor)
+
+        if not song:
+            ytdl_log.info(f"Song '{extractor}-{song_id}' not in database, inserting")
+            await cls.insert_song(ctx, filename, info)
+
+        if download:
+            await cls.register_download(ctx, filename)
+
+        source = cls(
+            ctx,
+            data=info,
+            filename=filename,
+        )
+
+        music = ctx.bot.get_cog("Music")
+        if music:
+            ctx.bot.loop.create_task(music.check_song_duration(ctx, source))
+
+        return source
+
     @classmethod
     async def get_playlist(
         cls,
@@ -667,15 +1095,25 @@ class Song:
         progress_message,
         *,
         loop: asyncio.BaseEventLoop = None,
+        on_song=None,
+        concurrency=4,
     ):
-        loop = loop or asyncio.get_event_loop()
+        """Fetches every song in a playlist.
+
+        Songs already in the database are found with a single query, and
+        the rest are downloaded ``concurrency`` at a time. If ``on_song`` is
+        given, it's awaited with each song in playlist order as soon as
+        that song and every song before it are ready, so the queue fills
+        while the rest of the playlist is still downloading.
+
+        Returns the songs that were fetched and how many failed.
+        """
 
         ytdl_log.info("Searching for playlist")
 
-        partial = functools.partial(
-            cls.playlist_ytdl.extract_info, search, download=False, process=False
+        unproccessed = await cls.extract_info(
+            ctx, search, playlist=True, download=False, process=False
         )
-        unproccessed = await loop.run_in_executor(None, partial)
 
         if unproccessed is None:
             raise YTDLError("Couldn't find anything that matches `{}`".format(search))
@@ -697,107 +1135,67 @@ class Song:
 
         ytdl_log.info("Fetching songs in playlist")
 
-        playlist = []
-        counter = 0
-        for i, video in enumerate(data_list):
-            webpage_url = video["url"]
-            ytdl_log.info(f"Song: '{webpage_url}'")
+        # yes I know the extractor fallback is prone to failure, but I don't care
+        keys = [(video.get("extractor") or "youtube", video.get("id")) for video in data_list]
+        in_database = await cls.fetch_many_from_database(ctx, keys)
 
-            song_id = video.get("id")
-            extractor = video.get("extractor")
-
-            # yes I know this is prone to failure, but I don't care
-            extractor = extractor or "youtube"
-
-            song = await cls.fetch_from_database(ctx, song_id, extractor)
+        ytdl_log.info(f"{len(in_database)}/{length} playlist songs are in the database")
 
-            if song:
-                ytdl_log.info(
-                    f"Song '{extractor}-{song_id}' in database, skipping further extraction"
-                )
-                playlist.append(song)
-                progress_message.change_label(1, text=f"Getting songs ({i+1}/{length})")
-                progress_message.change_label(1, emoji=ctx.tick(True))
-                continue
+        semaphore = asyncio.Semaphore(concurrency)
+        done = 0
 
-            filename = cls.playlist_ytdl.prepare_filename(video)[:-3] + ".webm"
-            if os.path.isfile(filename):
-                ytdl_log.info("Song is already downloaded. Skipping download.")
-                download = False
-            else:
-                ytdl_log.info("Downloading song...")
-                download = True
+        async def fetch(key, video):
+            nonlocal done
 
-            full = functools.partial(
-                cls.playlist_ytdl.extract_info, webpage_url, download=download
-            )
-            try:
-                data = await loop.run_in_executor(None, full)
-            except youtube_dl.DownloadError:
-                counter += 1
-            else:
+            song = in_database.get(key)
+            if not song:
+                async with semaphore:
+                    try:
+                        song = await cls.fetch_playlist_entry(ctx, video)
+                    except Exception:
+                        # one bad entry shouldn't take the rest of the playlist with it
+                        ytdl_log.exception(f"Failed to fetch playlist song '{video.get('url')}'")
+                        song = None
+
+            done += 1
+            progress_message.change_label(1, text=f"Getting songs ({done}/{length})")
+            return song
 
-                if data is None:
-                    await ctx.send(f"Couldn't fetch `{webpage_url}`")
+        # a song that's in the playlist more than once is only fetched once
+        fetches = {}
+        for key, video in zip(keys, data_list):
+            if key not in fetches:
+                fetches[key] = asyncio.create_task(fetch(key, video))
 
-                if "entries" not in data:
-                    info = data
-                else:
-                    info = None
-                    while info is None:
-                        try:
-                            info = data["entries"].pop(0)
-                        except IndexError as e:
-                            print(e)
-                            await ctx.send(
-                                f"Couldn't retrieve any matches for `{webpage_url}`"
-                            )
-
-                song_id = info.get("id")
-                extractor = info.get("extractor")
-                filename = cls.playlist_ytdl.prepare_filename(info)
-
-                song = await cls.fetch_from_database(ctx, song_id, extractor)
+        tasks = [fetches[key] for key in keys]
+        length = len(fetches)
 
+        playlist = []
+        counter = 0
+        try:
+            for task in tasks:
+                song = await task
                 if not song:
-                    ytdl_log.info(f"Song '{extractor}-{song_id}' not in database, inserting")
-                    query = """INSERT INTO songs (filename, title, song_id, extractor, info)
-                               VALUES ($1, $2, $3, $4, $5::jsonb)
-                            """
-
-                    await ctx.db.execute(
-                        query, filename, info.get("title"), song_id, extractor, info
-                    )
-
-                else:
-                    ytdl_log.info(
-                        f"Song '{extractor}-{song_id}' is already in database, skipping insertion"
-                    )
-
-                source = cls(
-                    ctx,
-                    data=info,
-                    filename=filename,
-                )
-
-                music = ctx.bot.get_cog("Music")
-                if music:
-                    ctx.bot.loop.create_task(music.check_song_duration(ctx, source))
+                    counter += 1
+                    continue
 
-                playlist.append(source)
+                playlist.append(song)
+                if on_song:
+                    await on_song(song)
+                    progress_message.change_label(2, text=f"Enqueuing songs ({len(playlist)}/{len(keys)})")
 
-            progress_message.change_label(1, text=f"Getting songs ({i+1}/{length})")
-            progress_message.change_label(1, emoji=ctx.tick(True))
+        except BaseException:
+            for task in fetches.values():
+                task.cancel()
+            raise
 
+        progress_message.change_label(1, emoji=ctx.tick(True))
         return playlist, counter
 
     @classmethod
     async def search_ytdl(cls, ctx, search):
-        loop = ctx.bot.loop
-
         async with ctx.typing():
-            partial = functools.partial(cls.ytdl.extract_info, search, download=False)
-            info = await loop.run_in_executor(None, partial)
+            info = await cls.extract_info(ctx, search, download=False)
 
         if not info or not info["entries"]:
             await ctx.send("No results found.")
@@ -869,6 +1267,18 @@ class VoiceError(commands.CommandError):
 
 
 class SongQueue(asyncio.Queue):
+    def __init__(self, *, on_change=None):
+        super().__init__()
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _put(self, item):
+        super()._put(item)
+        self._changed()
+
     def __getitem__(self, item):
         if isinstance(item, slice):
             return list(itertools.islice(self._queue, item.start, item.stop, item.step))
@@ -881,14 +1291,21 @@ class SongQueue(asyncio.Queue):
     def __len__(self):
         return self.qsize()
 
+    def put_first(self, item):
+        self._queue.appendleft(item)
+        self._changed()
+
     def clear(self):
         self._queue.clear()
+        self._changed()
 
     def shuffle(self):
         random.shuffle(self._queue)
+        self._changed()
 
     def remove(self, index: int):
         del self._queue[index]
+        self._changed()
 
     def to_list(self):
         output = []
@@ -905,6 +1322,9 @@ class PlayerStatus(enum.Enum):
 
 
 class Player:
+    # how many of the next songs to download while the current one plays
+    PREFETCH_COUNT = 2
+
     def __init__(self, bot: commands.Bot, ctx: commands.Context):
         player_log.info(f"{ctx.guild}: Creating player...")
 
@@ -915,7 +1335,7 @@ class Player:
         self.voice = None
         self.text_channel = ctx.channel
         self.next = asyncio.Event()
-        self.songs = SongQueue()
+        self.songs = SongQueue(on_change=self.prefetch)
         self.duration = stopwatch.StopWatch()
         self.closed = False
         self.startover = False
@@ -925,9 +1345,12 @@ class Player:
         self._notify = False
         self._loop = False
         self._loop_queue = False
-        self._volume = 0.5
+        self._volume = DEFAULT_VOLUME
         self._votes = {}
 
+        # (extractor, id): ActiveDownload, for the songs coming up next
+        self.prefetching = {}
+
         player_log.info(f"{ctx.guild}: Starting player loop...")
         self.audio_player = bot.loop.create_task(self.player_loop())
 
@@ -970,6 +1393,67 @@ class Player:
     def volume(self, value: float):
         self._volume = value
 
+    def prefetch(self):
+        """Starts downloading the next songs in the queue that aren't cached.
+
+        Called whenever the queue changes. Prefetches for songs that are
+        no longer coming up, like after a shuffle or clear, are cancelled.
+        """
+
+        music = self.bot.get_cog("Music")
+        if not music:
+            return
+
+        upcoming = {}
+        if not self.closed:
+            for song in self.songs[: self.PREFETCH_COUNT]:
+                key = (song.extractor, song.id)
+                if key in upcoming or Song.is_downloaded(self.bot, *key):
+                    continue
+
+                upcoming[key] = self.prefetching.get(key) or music.start_download(song)
+
+        stale = self.prefetching.keys() - upcoming.keys()
+        self.prefetching = upcoming
+
+        for key in stale:
+            music.cancel_download(key)
+
+    def set_volume(self, value: float):
+        """Changes the volume, including the song that's playing.
+
+        Opus copies are sent without decoding, so their volume can't be
+        changed. If the song needs to switch between an Opus copy and the
+        PCM path, its source is swapped at the current position.
+        """
+
+        self.volume = value
+
+        song = self.current
+        if not song or not song.source:
+            return
+
+        song.volume = value
+
+        if song.source_mode == "stream" or song.source.is_opus() == bool(song.get_opus_copy()):
+            return
+
+        position = int(self.duration.get_time().total_seconds())
+
+        # detach the old source first, discarding it would end the song
+        old, song.source = song.source, None
+        song.ffmpeg_options["options"] = f"-ss {Song.timestamp_duration(position)}"
+        song.make_source()
+        song.ffmpeg_options = song.FFMPEG_OPTIONS.copy()
+
+        # swapping the source resumes the player
+        paused = self.voice.is_paused()
+        self.voice.source = song.source
+        if paused:
+            self.voice.pause()
+
+        old.cleanup()
+
     @property
     def is_playing(self):
         if self.voice:
@@ -1051,15 +1535,16 @@ class Player:
                 self.next.clear()
                 self.duration.stop()
 
-                if self.loop_queue and not self.startover:
+                if self.loop_queue and not self.startover and self.current:
                     await self.songs.put(self.current)
 
-                if not self.loop:
+                if not self.loop or not self.current:
                     self.status = PlayerStatus.WAITING
                     try:
                         async with timeout(180):  # 3 minutes
                             player_log.info(f"{ctx.guild}: Getting a song from the queue...")
                             self.current = await self.songs.get()
+                            dequeued_at = time.perf_counter()
                     except asyncio.TimeoutError:
                         player_log.info(
                             f"{ctx.guild}: Timed out while waiting for song. Stopping..."
@@ -1073,24 +1558,46 @@ class Player:
                             del ctx.bot.players[ctx.guild.id]
                         return
 
+                    try:
+                        await self.current.ensure_downloaded(self.bot)
+                    except (youtube_dl.DownloadError, YTDLError) as e:
+                        player_log.warning(f"{ctx.guild}: Couldn't download '{self.current.title}': {e}")
+                        await self.text_channel.send(f"**:x: Couldn't download** `{self.current.title}`, skipping.")
+                        self.current = None
+                        continue
+
+                else:
+                    dequeued_at = time.perf_counter()
+
                 self.current.volume = self._volume
 
-                self.current.make_source()
+                self.current.make_source(on_first_frame=self.first_frame_callback(dequeued_at))
                 self.current.ffmpeg_options = self.current.FFMPEG_OPTIONS.copy()
 
                 player_log.info(f"{ctx.guild}: Playing song '{self.current.title}'")
                 self.voice.play(self.current.source, after=self.play_next_song)
 
+                # the next songs can download while this one plays
+                self.prefetch()
+
                 # Start our stopwatch for keeping track of position
                 self.duration.start()
 
+                if self.current.start_position:
+                    self.duration.start_time -= datetime.timedelta(seconds=self.current.start_position)
+                    self.current.start_position = 0
+
                 # Set status to playing
                 self.status = PlayerStatus.PLAYING
 
-                query = "UPDATE songs SET plays = plays + 1 WHERE song_id=$1 AND extractor=$2;"
-                await self.bot.pool.execute(
-                    query, self.current.id, self.current.extractor
-                )
+                music = self.bot.get_cog("Music")
+                if music:
+                    music.register_play(self.current)
+                    music.cache.touch(self.current.extractor, self.current.id)
+
+                    # only encode copies that players at this volume can use
+                    if music.opus and self.current.source_mode == "file" and self.current.volume == music.opus.gain:
+                        music.opus.encode(self.current.filename, self.current.extractor, self.current.id)
 
                 if not self.loop and self.notify and not self.startover:
                     await self.text_channel.send(
@@ -1105,6 +1612,15 @@ class Player:
 
                 self.current.discard_source()
 
+                download = self.current.download
+                if self.current.source_mode == "stream" and download and download.failed:
+                    player_log.warning(f"{ctx.guild}: Download of '{self.current.title}' failed while streaming")
+                    await self.text_channel.send(
+                        f"**:x: Couldn't finish downloading** `{self.current.title}`, skipping."
+                    )
+                    # there's no file to loop or requeue
+                    self.current = None
+
         except Exception:
             player_log.exception(f"{ctx.guild}: Exception in player_loop")
 
@@ -1112,6 +1628,18 @@ class Player:
             self.audio_player.cancel()
             self.audio_player = self.bot.loop.create_task(self.player_loop())
 
+    def first_frame_callback(self, dequeued_at):
+        music = self.bot.get_cog("Music")
+        if not music:
+            return None
+
+        song = self.current
+
+        def callback():
+            music.first_audio.observe(time.perf_counter() - dequeued_at, mode=song.source_mode)
+
+        return callback
+
     def play_next_song(self, error=None):
         if error:
             raise VoiceError(str(error))
@@ -1400,6 +1928,350 @@ class Music(commands.Cog):
 
         self.players = self.bot.players
 
+        max_size = bot.config.music_cache_size
+        if max_size is not None:
+            max_size *= 1024 * 1024
+        self.cache = MusicCache("cache", max_size=max_size, policy=bot.config.music_cache_policy)
+
+        self.ytdl = YTDLExecutor(
+            workers=bot.config.ytdl_workers,
+            processes=bot.config.ytdl_processes,
+            metrics=bot.metrics,
+        )
+
+        # play songs while they download instead of waiting for the whole file
+        self.streaming = bot.config.music_streaming
+
+        # (extractor, id): ActiveDownload
+        self._downloads = {}
+
+        # whether song inserts can rely on songs_uniq_idx, checked in cog_load
+        self.songs_unique = False
+
+        # pre-encoded copies that can be played without transcoding
+        if bot.config.music_opus_cache:
+            self.opus = OpusCache(
+                os.path.join("cache", "opus"), bitrate=bot.config.music_opus_bitrate, gain=DEFAULT_VOLUME
+            )
+        else:
+            self.opus = None
+
+        self.first_audio = bot.metrics.histogram(
+            "clam_music_time_to_first_audio_seconds",
+            "Time from a song leaving the queue to its first audio frame.",
+            ("mode",),
+            buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+        )
+
+        # (extractor, id): plays and last play, flushed in one UPDATE
+        self._play_counts = Counter()
+        self._last_played = {}
+        # (extractor, id, guild_id, user_id, played_at)
+        self._play_history = []
+        self._plays_lock = asyncio.Lock()
+        self.bulk_update_plays.start()
+
+        bot.metrics.add_collector("music", self.collect_metrics)
+
+    async def cog_load(self):
+        query = "SELECT extractor, song_id, filename, file_size, plays, last_played FROM songs;"
+        try:
+            records = await self.bot.pool.fetch(query)
+        except asyncpg.UndefinedColumnError:
+            log.warning(
+                "The songs table is missing file_size and last_played. "
+                "Run 'python3 -m clam db migrate music' and 'python3 -m clam db upgrade music'."
+            )
+            query = "SELECT extractor, song_id, filename, plays FROM songs;"
+            records = await self.bot.pool.fetch(query)
+
+        await self.bot.loop.run_in_executor(None, self.cache.load, records)
+
+        query = "SELECT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'songs_uniq_idx');"
+        self.songs_unique = await self.bot.pool.fetchval(query)
+        if not self.songs_unique:
+            log.warning(
+                "The songs table is missing songs_uniq_idx, so concurrent fetches can insert duplicates. "
+                "Run 'python3 -m clam db repair music' and reload the cog."
+            )
+
+        if self.opus:
+            await self.bot.loop.run_in_executor(None, self.opus.load)
+
+        self._restore_task = self.bot.loop.create_task(self.restore_players())
+
+    def cog_unload(self):
+        self._restore_task.cancel()
+        self.bulk_update_plays.stop()
+        self.bot.metrics.remove_collector("music")
+
+        for download in self._downloads.values():
+            download.task.cancel()
+
+        if self.opus:
+            self.opus.close()
+
+        self.ytdl.shutdown()
+
+    def collect_metrics(self):
+        registry = self.bot.metrics
+        players = [p for p in self.players.values() if not p.closed]
+        registry.gauge("clam_music_players", "Active music players.").set(len(players))
+        registry.gauge("clam_music_players_playing", "Music players currently playing audio.").set(
+            sum(1 for p in players if p.is_playing)
+        )
+        registry.gauge("clam_music_queued_songs", "Songs waiting in every player's queue.").set(
+            sum(len(p.songs) for p in players)
+        )
+        registry.gauge("clam_music_cache_bytes", "Size of the music cache folder.").set(self.cache.size)
+        registry.gauge("clam_music_cache_files", "Songs in the music cache folder.").set(len(self.cache))
+        registry.gauge("clam_music_background_downloads", "Songs being downloaded in the background.").set(
+            len(self._downloads)
+        )
+        registry.gauge("clam_music_prefetching", "Queued songs being downloaded ahead of time.").set(
+            sum(len(p.prefetching) for p in players)
+        )
+        registry.gauge("clam_ytdl_jobs_pending", "youtube_dl jobs waiting for a worker.").set(self.ytdl.pending)
+        registry.gauge("clam_ytdl_jobs_running", "youtube_dl jobs currently running.").set(self.ytdl.running)
+        registry.gauge("clam_music_cache_evictions", "Songs evicted from the music cache.").set(
+            self.cache.evictions
+        )
+
+        registry.gauge(
+            "clam_batch_queue_depth", "Rows waiting to be bulk inserted.", ("queue",)
+        ).set(len(self._play_history), queue="song_plays")
+
+        if self.opus:
+            registry.gauge("clam_music_opus_bytes", "Size of the pre-encoded Opus copies.").set(self.opus.size)
+            registry.gauge("clam_music_opus_files", "Songs with a pre-encoded Opus copy.").set(len(self.opus))
+            registry.gauge("clam_music_opus_encoding", "Opus copies being encoded.").set(self.opus.pending)
+            registry.gauge("clam_music_opus_failures", "Opus copies that failed to encode.").set(self.opus.failed)
+
+    def register_play(self, song):
+        key = (song.extractor, song.id)
+        now = datetime.datetime.utcnow()
+        guild_id = song.ctx.guild.id if song.ctx.guild else None
+
+        self._play_counts[key] += 1
+        self._last_played[key] = now
+        self._play_history.append((*key, guild_id, song.requester.id, now))
+
+    async def flush_plays(self):
+        if not self._play_counts:
+            return
+
+        # swap the batch out so plays registered while this runs go in the next one
+        counts, self._play_counts = self._play_counts, Counter()
+        last_played, self._last_played = self._last_played, {}
+        history, self._play_history = self._play_history, []
+
+        keys = list(counts)
+
+        update = """UPDATE songs
+                    SET plays = songs.plays + x.plays, last_played = x.last_played
+                    FROM unnest($1::TEXT[], $2::TEXT[], $3::INTEGER[], $4::TIMESTAMP[])
+                         AS x(extractor, song_id, plays, last_played)
+                    WHERE songs.extractor = x.extractor AND songs.song_id = x.song_id;
+                 """
+
+        insert = """INSERT INTO song_plays (song_id, guild_id, user_id, played_at)
+                    SELECT songs.id, x.guild_id, x.user_id, x.played_at
+                    FROM unnest($1::TEXT[], $2::TEXT[], $3::BIGINT[], $4::BIGINT[], $5::TIMESTAMP[])
+                         AS x(extractor, song_id, guild_id, user_id, played_at)
+                    INNER JOIN songs ON songs.extractor = x.extractor AND songs.song_id = x.song_id;
+                 """
+
+        try:
+            async with self.bot.pool.acquire() as con:
+                async with con.transaction():
+                    await con.execute(
+                        update,
+                        [k[0] for k in keys],
+                        [k[1] for k in keys],
+                        [counts[k] for k in keys],
+                        [last_played[k] for k in keys],
+                    )
+                    await con.execute(insert, *(list(column) for column in zip(*history)))
+
+        except Exception:
+            log.exception("Failed to register %s song plays to the database", len(history))
+
+            # put them back to try again on the next flush
+            self._play_counts.update(counts)
+            for key, played_at in last_played.items():
+                self._last_played[key] = max(played_at, self._last_played.get(key, played_at))
+            self._play_history[:0] = history
+
+            dropped = len(self._play_history) - MAX_PENDING_PLAYS
+            if dropped > 0:
+                log.warning("Dropping the %s oldest song plays from the history", dropped)
+                del self._play_history[:dropped]
+
+            return
+
+        total = len(history)
+        if total > 1:
+            log.info("Registered %s song plays to the database.", total)
+
+    @tasks.loop(seconds=15.0)
+    async def bulk_update_plays(self):
+        async with self._plays_lock:
+            await self.flush_plays()
+
+    @bulk_update_plays.after_loop
+    async def after_bulk_update_plays(self):
+        # save plays from before the cog unloaded
+        if self.bulk_update_plays.is_being_cancelled():
+            return
+
+        async with self._plays_lock:
+            await self.flush_plays()
+
+    def protected_songs(self):
+        """Returns the songs that are playing or queued, which can't be evicted."""
+
+        protected = set()
+        for player in self.players.values():
+            if player.current:
+                protected.add((player.current.extractor, player.current.id))
+            protected.update((s.extractor, s.id) for s in player.songs)
+
+        return protected
+
+    def cached_paths(self, files):
+        """Returns the paths of cached files along with their Opus copies."""
+
+        paths = [f.path for f in files]
+        if self.opus:
+            for file in files:
+                if path := self.opus.discard(file.extractor, file.song_id):
+                    paths.append(path)
+
+        return paths
+
+    def remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning(f"Couldn't remove cached file '{path}': {e}")
+
+    async def register_download(self, filename, *, update_filename=False):
+        """Adds a downloaded file to the cache and evicts songs if it's full."""
+
+        try:
+            file = await self.bot.loop.run_in_executor(None, self.cache.add, filename)
+        except OSError as e:
+            log.warning(f"Couldn't add '{filename}' to the music cache: {e}")
+            return
+
+        if not file:
+            return
+
+        if update_filename:
+            query = "UPDATE songs SET file_size=$1, filename=$2 WHERE extractor=$3 AND song_id=$4;"
+            await self.bot.pool.execute(query, file.size, file.path, file.extractor, file.song_id)
+        else:
+            query = "UPDATE songs SET file_size=$1 WHERE extractor=$2 AND song_id=$3;"
+            await self.bot.pool.execute(query, file.size, file.extractor, file.song_id)
+
+        await self.evict_songs()
+
+    def start_download(self, song):
+        """Starts downloading a song in the background, or returns the download in progress."""
+
+        key = (song.extractor, song.id)
+        download = self._downloads.get(key)
+        if download:
+            return download
+
+        ytdl_log.info(f"Downloading '{song.extractor}-{song.id}' in the background")
+
+        download = ActiveDownload(song.filename)
+        download.task = self.bot.loop.create_task(self.run_download(key, song, download))
+        self._downloads[key] = download
+        return download
+
+    def get_download(self, song):
+        return self._downloads.get((song.extractor, song.id))
+
+    def cancel_download(self, key):
+        """Cancels a download if no player is playing or prefetching the song anymore.
+
+        Only downloads still waiting for a worker are cancelled. One that
+        has started runs to the end, so its file is registered in the cache
+        and can be reused if the song is queued again.
+        """
+
+        download = self._downloads.get(key)
+        if not download:
+            return
+
+        for player in self.players.values():
+            current = player.current
+            if current and (current.extractor, current.id) == key:
+                return
+            if key in player.prefetching:
+                return
+
+        if download.running:
+            return
+
+        ytdl_log.info(f"Cancelling download of '{key[0]}-{key[1]}', it's no longer coming up")
+        del self._downloads[key]
+        download.task.cancel()
+
+    async def run_download(self, key, song, download):
+        try:
+            info = await Song.extract_info(
+                song.ctx, song.url, download=True, on_start=download.mark_running
+            )
+
+            if info and "entries" in info:
+                info = next((e for e in info["entries"] if e), None)
+
+            if not info:
+                raise YTDLError(f"Couldn't download `{song.url}`")
+
+        except (youtube_dl.DownloadError, YTDLError) as e:
+            ytdl_log.warning(f"Error while downloading '{song.url}': {e}")
+            download.finish(failed=True)
+
+        except Exception:
+            ytdl_log.exception(f"Unexpected error while downloading '{song.url}'")
+            download.finish(failed=True)
+
+        else:
+            filename = Song.ytdl.prepare_filename(info)
+            song.filename = filename
+            download.finish(filename)
+            await self.register_download(filename, update_filename=True)
+
+        finally:
+            if self._downloads.get(key) is download:
+                del self._downloads[key]
+
+            if not download.done:
+                download.finish(failed=True)
+
+    async def evict_songs(self):
+        evicted = self.cache.evict(protected=self.protected_songs())
+        if not evicted:
+            return
+
+        log.info(f"Evicting {len(evicted)} songs from the music cache")
+        await self.bot.loop.run_in_executor(None, self.remove_files, self.cached_paths(evicted))
+
+        query = """UPDATE songs SET file_size=NULL
+                   FROM unnest($1::TEXT[], $2::TEXT[]) AS x(extractor, song_id)
+                   WHERE songs.extractor = x.extractor AND songs.song_id = x.song_id;
+                """
+        await self.bot.pool.execute(
+            query, [f.extractor for f in evicted], [f.song_id for f in evicted]
+        )
+
     def get_player(self, ctx: commands.Context):
         return self.players.get(ctx.guild.id)
 
@@ -1432,35 +2304,85 @@ class Music(commands.Cog):
             await ctx.send(str(error), ephemeral=True)
             ctx.handled = True
 
-    async def stop_all_players(self, *, save_queues=True):
-        for player in self.players.values():
-            # Get all songs in the queue
-            if len(player.songs) > 0:
-                songs = player.songs.to_list()
-                songs = [s.url for s in songs]
-                songs.insert(0, player.current.url)
-            elif player.current:
-                songs = [player.current.url]
-            else:
-                songs = None
+    def get_player_state(self, player):
+        """Returns the arguments to save a player with, or ``None`` if there's nothing to save."""
+
+        if player.closed or not player.voice:
+            return None
+
+        songs = player.songs.to_list()
+        if player.current:
+            songs.insert(0, player.current)
+
+        if not songs:
+            return None
+
+        position = int(player.duration.get_time().total_seconds()) if player.current else 0
+
+        return (
+            player.ctx.guild.id,
+            player.voice.channel.id,
+            player.text_channel.id,
+            [s.extractor for s in songs],
+            [s.id for s in songs],
+            [s.requester.id for s in songs],
+            position,
+            player.loop,
+            player.loop_queue,
+            player.notify,
+            player.volume,
+        )
+
+    async def save_players(self, players):
+        states = [state for state in map(self.get_player_state, players) if state]
+        if not states:
+            return []
+
+        query = """INSERT INTO music_player_states AS s (guild_id, voice_channel_id, text_channel_id,
+                                                         extractors, song_ids, requester_ids, position,
+                                                         loop, loop_queue, notify, volume)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+                   ON CONFLICT (guild_id) DO UPDATE
+                   SET voice_channel_id = EXCLUDED.voice_channel_id, text_channel_id = EXCLUDED.text_channel_id,
+                       extractors = EXCLUDED.extractors, song_ids = EXCLUDED.song_ids,
+                       requester_ids = EXCLUDED.requester_ids, position = EXCLUDED.position,
+                       loop = EXCLUDED.loop, loop_queue = EXCLUDED.loop_queue, notify = EXCLUDED.notify,
+                       volume = EXCLUDED.volume, saved_at = (now() at time zone 'utc');
+                """
+
+        await self.bot.pool.executemany(query, states)
+        return [state[0] for state in states]
+
+    async def stop_all_players(self, *, save_queues=False):
+        players = list(self.players.values())
+        saved = set()
+
+        if save_queues:
+            try:
+                saved.update(await self.save_players(players))
+            except Exception:
+                log.exception("Failed to save music players")
+
+        for player in players:
+            had_songs = player.current or len(player.songs) > 0
 
             await player.stop()
 
-            # Save the queue to clambin
-            if songs:
-                url = await self.post("\n".join(songs))
-                if url is None:
-                    return await player.text_channel.send(
-                        "**Sorry! All music players have been stopped due to bot maintenance.**"
-                        "\nUnfortunately, there was an error while automatically your saving queue. "
-                        "Sorry about that :("
-                    )
+            if not had_songs:
+                continue
 
-                prefix = self.bot.guild_prefix(player.ctx.guild)
-                await player.text_channel.send(
+            if player.ctx.guild.id in saved:
+                message = (
                     "**Sorry! All music players have been stopped due to bot maintenance.**\n"
-                    f"Good news, **I saved your queue!**\nTo resume where you left off, use: `{prefix}playbin {url}`"
+                    "Good news, **I saved your queue!** I'll pick up where you left off when I'm back."
                 )
+            else:
+                message = "**Sorry! All music players have been stopped due to bot maintenance.**"
+
+            try:
+                await player.text_channel.send(message)
+            except discord.HTTPException:
+                pass
 
         self.bot.players.clear()
         self.players = self.bot.players
@@ -1468,10 +2390,100 @@ class Music(commands.Cog):
         for voice in self.bot.voice_clients:
             await voice.disconnect()
 
-    def delete_all_songs(self):
-        for file in os.listdir("cache"):
-            if file.endswith(".webm"):
-                os.remove(file)
+    async def fetch_saved_songs(self, extractors, song_ids):
+        """Fetches the songs of a saved player, in order, in one query."""
+
+        query = """SELECT DISTINCT ON (x.idx) x.idx, songs.*
+                   FROM unnest($1::TEXT[], $2::TEXT[]) WITH ORDINALITY AS x(extractor, song_id, idx)
+                   INNER JOIN songs ON songs.extractor = x.extractor AND songs.song_id = x.song_id
+                   ORDER BY x.idx, songs.id;
+                """
+
+        return await self.bot.pool.fetch(query, extractors, song_ids)
+
+    async def restore_player(self, state):
+        guild = self.bot.get_guild(state["guild_id"])
+        if not guild or guild.id in self.players:
+            return
+
+        voice_channel = guild.get_channel(state["voice_channel_id"])
+        text_channel = guild.get_channel(state["text_channel_id"])
+        if not voice_channel or not text_channel:
+            return
+
+        # don't rejoin an empty channel just to leave again
+        if not any(not m.bot for m in voice_channel.members):
+            log.info(f"{guild}: Nobody is listening in {voice_channel}, not restoring the player")
+            return
+
+        records = await self.fetch_saved_songs(state["extractors"], state["song_ids"])
+        if not records:
+            return
+
+        log.info(f"{guild}: Restoring player with {len(records)} songs in {voice_channel}")
+
+        message = await text_channel.send("**:arrows_counterclockwise: I'm back! Restoring your queue...**")
+
+        # the player needs a context to send messages and create songs with
+        ctx = await self.bot.get_context(message)
+        player = self.create_player(ctx)
+
+        try:
+            player.voice = await voice_channel.connect()
+        except (discord.ClientException, asyncio.TimeoutError):
+            await player.stop()
+            del self.players[guild.id]
+            return await message.edit(content="**:x: I couldn't rejoin voice to restore your queue.**")
+
+        player.volume = state["volume"]
+        player.notify = state["notify"]
+        player.loop_queue = state["loop_queue"]
+
+        requester_ids = state["requester_ids"]
+        for record in records:
+            song = Song.from_record(record, ctx)
+            song.requester = guild.get_member(requester_ids[record["idx"] - 1]) or guild.me
+
+            # only the song that was playing has a position
+            if record["idx"] == 1 and state["position"]:
+                song.start_at(state["position"])
+
+            await player.songs.put(song)
+
+        player.loop = state["loop"]
+
+        await message.edit(content=f"**:white_check_mark: I'm back! Restored your queue** ({plural(len(records)):song})")
+
+    async def restore_players(self):
+        await self.bot.wait_until_ready()
+
+        # the states are only restored once, whether or not it works
+        query = """DELETE FROM music_player_states
+                   RETURNING *, saved_at > (now() at time zone 'utc') - $1::INTERVAL AS recent;
+                """
+        states = await self.bot.pool.fetch(query, PLAYER_STATE_MAX_AGE)
+
+        for state in states:
+            if not state["recent"]:
+                continue
+
+            try:
+                await self.restore_player(state)
+            except Exception:
+                log.exception(f"Failed to restore the music player in guild {state['guild_id']}")
+
+    async def delete_all_songs(self):
+        files = self.cache.clear()
+        paths = [f.path for f in files]
+        if self.opus:
+            paths.extend(self.opus.clear())
+
+        await self.bot.loop.run_in_executor(None, self.remove_files, paths)
+
+        query = "UPDATE songs SET file_size=NULL WHERE file_size IS NOT NULL;"
+        await self.bot.pool.execute(query)
+
+        return len(files)
 
     @commands.command()
     @commands.is_owner()
@@ -1502,9 +2514,9 @@ class Music(commands.Cog):
             "Are you sure you want to delete all songs in cache?"
         )
         if confirm:
-            self.delete_all_songs()
+            deleted = await self.delete_all_songs()
 
-            await ctx.send("Deleted all songs.")
+            await ctx.send(f"Deleted {plural(deleted):song}.")
 
     @commands.command()
     @commands.is_owner()
@@ -1945,9 +2957,7 @@ class Music(commands.Cog):
         if 0 > volume > 100:
             return await ctx.send("Volume must be between 0 and 100")
 
-        ctx.player.volume = volume / 100
-        ctx.player.voice.volume = volume / 100
-        ctx.player.current.source.volume = volume / 100
+        ctx.player.set_volume(volume / 100)
 
         await ctx.send(
             f"**{self.get_volume_emoji(volume)} Volume set to:** `{volume}%`"
@@ -1993,7 +3003,7 @@ class Music(commands.Cog):
         if not ctx.player.loop and not (
             ctx.player.loop_queue and len(ctx.player.songs) == 1
         ):
-            ctx.player.songs._queue.appendleft(song)
+            ctx.player.songs.put_first(song)
 
         ctx.player.skip()
 
@@ -2319,7 +3329,7 @@ class Music(commands.Cog):
             if not ctx.player.loop and not (
                 ctx.player.loop_queue and len(ctx.player.songs) == 1
             ):
-                ctx.player.songs._queue.appendleft(song)
+                ctx.player.songs.put_first(song)
 
             ctx.player.skip()
 
@@ -2339,9 +3349,7 @@ class Music(commands.Cog):
             if record:
                 song = Song.from_record(record, ctx)
 
-            partial = functools.partial(self.get_file_size, song.filename)
-            size = await self.bot.loop.run_in_executor(None, partial)
-            filesize = humanize.naturalsize(size, binary=True)
+            filesize = self.get_file_size(song)
 
             em = Player.now_playing_embed(song, "3+ Hour Song Downloaded", db_info=True, filesize=filesize)
             em.add_field(name="Context", value=f"[Jump to message]({ctx.message.jump_url})")
@@ -2370,7 +3378,7 @@ class Music(commands.Cog):
 
         try:
             playlist, failed_songs = await Song.get_playlist(
-                ctx, url, progress_message, loop=self.bot.loop
+                ctx, url, progress_message, on_song=ctx.player.songs.put
             )
 
         except YTDLError as e:
@@ -2391,12 +3399,7 @@ class Music(commands.Cog):
             description = ""
             total_duration = 0
             for i, song in enumerate(playlist):
-                if not song:
-                    failed_songs += 1
-                    continue
-
-                await ctx.player.songs.put(song)
-                total_duration += int(song.data.get("duration"))
+                total_duration += int(song.data.get("duration") or 0)
                 if i < 9:
                     description += f"\n• [{song.title}]({song.url}) `{song.duration}`"
                 elif i == 9 and len(playlist) > 10:
@@ -2792,15 +3795,8 @@ class Music(commands.Cog):
         if not ctx.player:
             player = self.create_player(ctx)
 
-        partial = functools.partial(
-            Song.ytdl.extract_info,
-            "hat kid electro",
-            download=False,
-            process=False,
-        )
-
         try:
-            data = await self.bot.loop.run_in_executor(None, partial)
+            data = await Song.extract_info(ctx, "hat kid electro", download=False, process=False)
 
         except youtube_dl.DownloadError as e:
             self.bot.log.exception("Could not connect to YouTube")
@@ -2850,51 +3846,109 @@ class Music(commands.Cog):
 
                 raise NotListeningError(f"{self.bot.user.name} is in another voice channel.{hint}")
 
-    # music db management commands
+    @cache.cache(maxsize=256)
+    async def resolve_title(self, search):
+        """Returns the ID of the song whose title is closest to a search.
 
-    def get_cache_size(self):
-        return sum(os.path.getsize("cache/" + f) for f in os.listdir("cache") if os.path.isfile("cache/" + f))
+        ``%`` and ``<->`` both use the trigram index, so this only looks at
+        songs that are similar enough instead of ranking the whole table.
+        """
 
-    def get_file_size(self, fp):
-        return os.path.getsize(fp)
+        query = """SELECT id
+                   FROM songs
+                   WHERE title % $1
+                   ORDER BY title <-> $1
+                   LIMIT 1;
+                """
+
+        return await self.bot.pool.fetchval(query, search)
+
+    async def fetch_song_by_title(self, search):
+        # trigrams ignore case anyway, so this only makes more searches hit the cache
+        search = search.strip().lower()
+
+        song_id = await self.resolve_title(search)
+        if song_id is None:
+            # don't remember misses, a matching song might be added later
+            self.resolve_title.invalidate(self, search)
+            return None
+
+        query = "SELECT * FROM songs WHERE id=$1;"
+        record = await self.bot.pool.fetchrow(query, song_id)
+
+        if not record:
+            # the song was deleted since it was cached
+            self.resolve_title.invalidate(self, search)
+            song_id = await self.resolve_title(search)
+            if song_id is None:
+                self.resolve_title.invalidate(self, search)
+                return None
+
+            record = await self.bot.pool.fetchrow(query, song_id)
+
+        return record
+
+    # music db management commands
+
+    def get_file_size(self, song):
+        file = self.cache.get(song.extractor, song.id)
+        if not file:
+            return None
+        return humanize.naturalsize(file.size, binary=True)
 
     @commands.group(aliases=["mdb"], invoke_without_command=True)
     @commands.is_owner()
     async def musicdb(self, ctx):
         """Commands to manage the music db."""
 
-        query = "SELECT COUNT(*), SUM(plays) FROM songs;"
-        count, total_plays = await ctx.db.fetchrow(query)
+        query = "SELECT songs, plays, duration, played_duration, cache_bytes FROM songs_summary WHERE id=1;"
+        record = await ctx.db.fetchrow(query)
 
-        total_plays = total_plays or 0
-
-        query = "SELECT info->>'duration', plays FROM songs;"
-        records = await ctx.db.fetch(query)
-
-        total = 0
-        total_with_plays = 0
-
-        for duration, plays in records:
-            if not duration:
-                continue
-            duration = float(duration)
-            total += duration
-            total_with_plays += duration * plays
+        if not record:
+            return await ctx.send("The music database summary is missing. Use `musicdb recount` to rebuild it.")
 
-        total = round(total)
-        total_with_plays = round(total_with_plays)
+        count, total_plays, total, total_with_plays, cache_bytes = record
 
-        duration = Song.parse_duration(total)
-        duration_with_plays = Song.parse_duration(total_with_plays)
+        duration = Song.parse_duration(round(total))
+        duration_with_plays = Song.parse_duration(round(total_with_plays))
 
-        cache_size = await self.bot.loop.run_in_executor(None, self.get_cache_size)
+        cache_size = humanize.naturalsize(self.cache.size, binary=True)
+        if self.cache.max_size is not None:
+            max_size = humanize.naturalsize(self.cache.max_size, binary=True)
+            cache_size += f" out of {max_size} ({self.cache.policy.upper()} eviction)"
 
         await ctx.send(
             f"Music database contains **{count:,} songs** with a total of **{total_plays:,} plays**.\n"
             f"That's **{duration}** of music cached, and **{duration_with_plays}** of music played!\n"
-            f"The total size of the cache folder is {humanize.naturalsize(cache_size, binary=True)}."
+            f"The cache folder holds {plural(len(self.cache)):song} and is {cache_size}, "
+            f"{humanize.naturalsize(cache_bytes, binary=True)} of which belongs to songs in the database."
         )
 
+    @musicdb.command(name="recount")
+    @commands.is_owner()
+    async def musicdb_recount(self, ctx):
+        """Rebuilds the music database summary from the songs table.
+
+        The summary is kept up to date automatically,
+        so this should only be needed if it was edited by hand.
+        """
+
+        query = f"""INSERT INTO songs_summary AS s (id, songs, plays, duration, played_duration, cache_bytes)
+                    SELECT 1, {SONGS_SUMMARY_AGGREGATES}
+                    FROM songs
+                    ON CONFLICT (id) DO UPDATE
+                    SET songs = EXCLUDED.songs, plays = EXCLUDED.plays, duration = EXCLUDED.duration,
+                        played_duration = EXCLUDED.played_duration, cache_bytes = EXCLUDED.cache_bytes;
+                 """
+
+        async with ctx.db.acquire() as con:
+            async with con.transaction():
+                # keep concurrent writes from changing the totals mid-count
+                await con.execute("LOCK TABLE songs IN SHARE MODE;")
+                await con.execute(query)
+
+        await ctx.send(ctx.tick(True, "Rebuilt the music database summary."))
+
     @musicdb.command(name="list", aliases=["all"])
     @commands.is_owner()
     async def musicdb_list(self, ctx):
@@ -2920,7 +3974,8 @@ class Music(commands.Cog):
 
         query = """SELECT id, title, plays, last_updated, (info->>'duration')::DOUBLE PRECISION AS duration
                    FROM songs
-                   ORDER BY similarity(title, $1) DESC
+                   WHERE title % $1
+                   ORDER BY title <-> $1
                    LIMIT 20;
                 """
 
@@ -2955,21 +4010,13 @@ class Music(commands.Cog):
         record = await ctx.db.fetchrow(query, song)
 
         if not record:
-            query = """SELECT *
-                       FROM songs
-                       ORDER BY similarity(title, $1) DESC
-                       LIMIT 1;
-                    """
-            record = await ctx.db.fetchrow(query, song)
+            record = await self.fetch_song_by_title(str(song))
 
             if not record:
                 return await ctx.send("No matching songs found.")
 
         song = Song.from_record(record, ctx)
-
-        partial = functools.partial(self.get_file_size, song.filename)
-        size = await self.bot.loop.run_in_executor(None, partial)
-        filesize = humanize.naturalsize(size, binary=True)
+        filesize = self.get_file_size(song)
 
         em = Player.now_playing_embed(song, "Song Info", db_info=True, filesize=filesize)
         await ctx.send(embed=em)
@@ -2983,18 +4030,19 @@ class Music(commands.Cog):
         Use `--delete-file` to delete the song's file too.
         """
 
-        query = (
-            """DELETE FROM songs WHERE id=$1 RETURNING songs.title, songs.filename;"""
-        )
+        query = """DELETE FROM songs WHERE id=$1
+                   RETURNING songs.title, songs.filename, songs.extractor, songs.song_id;
+                """
         record = await ctx.db.fetchrow(query, song_id)
 
         if not record:
             return await ctx.send(f"No song with the id of `{song_id}`")
 
-        title, filename = record
+        title, filename, extractor, platform_id = record
 
         if flags["delete_file"]:
             try:
+                self.cache.discard(extractor, platform_id)
                 os.remove(filename)
                 human_friendly = f" and removed file `{filename}`"
             except Exception as e:
@@ -3011,12 +4059,8 @@ class Music(commands.Cog):
     async def get_song_info(self, ctx, old_info):
         webpage_url = old_info["webpage_url"]
 
-        partial = functools.partial(
-            Song.ytdl.extract_info, old_info["webpage_url"], download=False
-        )
-
         try:
-            processed_info = await self.bot.loop.run_in_executor(None, partial)
+            processed_info = await Song.extract_info(ctx, webpage_url, download=False)
 
         except youtube_dl.DownloadError as e:
             await ctx.send(f"Error while fetching `{webpage_url}`\n```\n{e}\n```")
@@ -7,7 +7,7 @@ import logging
 import os
 import pkg_resources
 import typing
-from collections import Counter, defaultdict
+from collections import Counter
 
 import asyncpg
 import discord
@@ -20,13 +20,14 @@ from clam.utils import colors, db, humantime
 from clam.utils.emojis import VOICE_CHANNEL, TEXT_CHANNEL
 from clam.utils.flags import NoUsageFlagCommand
 from clam.utils.formats import plural, TabularData
+from clam.utils.timeseries import TimeSeriesCounter
 from clam.utils.utils import get_lines_of_code
 
 
 log = logging.getLogger("clam.stats")
 
 
-class Commands(db.Table):
+class Commands(db.Table, partition_by="invoked_at", partition_interval="month"):
     id = db.PrimaryKeyColumn()
     name = db.Column(db.String, index=True)
     guild_id = db.Column(db.Integer(big=True), index=True)
@@ -37,6 +38,95 @@ class Commands(db.Table):
     failed = db.Column(db.Boolean, index=True)
 
 
+# Command usage rollups.
+# These are kept up to date by the bulk insert loop so the stats
+# commands never have to scan the (ever growing) commands table.
+# guild_id is 0 for commands used in DMs since it's part of the key.
+# The per-member tables are nearly as big as the commands table, so totals
+# and top commands or guilds overall come from the smaller by_name and
+# by_guild tables instead.
+
+
+class CommandUsageHourly(db.Table, table_name="command_usage_hourly"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    name = db.Column(db.String, primary_key=True, index=True)
+    guild_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    uses = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+
+
+class CommandUsageDaily(db.Table, table_name="command_usage_daily"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    name = db.Column(db.String, primary_key=True, index=True)
+    guild_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    uses = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+
+
+class CommandUsageDailyByName(db.Table, table_name="command_usage_daily_by_name"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    name = db.Column(db.String, primary_key=True, index=True)
+    uses = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+
+
+class CommandUsageDailyByGuild(db.Table, table_name="command_usage_daily_by_guild"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    guild_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    uses = db.Column(db.Integer, default=0, nullable=False)
+    failures = db.Column(db.Integer, default=0, nullable=False)
+
+
+# Hourly rows are kept per member, so they're pruned after this.
+# Stats over longer periods use the daily rollups.
+HOURLY_ROLLUP_RETENTION = datetime.timedelta(days=30)
+
+# table: (bucket unit, key columns)
+ROLLUPS = {
+    "command_usage_hourly": ("hour", ("name", "guild_id", "author_id")),
+    "command_usage_daily": ("day", ("name", "guild_id", "author_id")),
+    "command_usage_daily_by_name": ("day", ("name",)),
+    "command_usage_daily_by_guild": ("day", ("guild_id",)),
+}
+
+# commands waiting in the bulk insert batch
+BATCH_SOURCE = """(SELECT name, COALESCE(guild, 0) AS guild_id, author AS author_id, invoked_at, failed
+                   FROM jsonb_to_recordset($1::jsonb) AS
+                   j(name TEXT, guild BIGINT, author BIGINT, invoked_at TIMESTAMP, failed BOOLEAN))"""
+
+# commands already in the database
+HISTORY_SOURCE = """(SELECT name, COALESCE(guild_id, 0) AS guild_id, author_id, invoked_at, failed
+                     FROM commands)"""
+
+
+def usage_rollup(interval):
+    """Returns the rollup table and bucket unit to use for stats over the last ``interval``."""
+
+    if interval <= HOURLY_ROLLUP_RETENTION:
+        return "command_usage_hourly", "hour"
+    return "command_usage_daily", "day"
+
+
+def rollup_query(table, source):
+    """Returns a query that adds the commands from ``source`` to a rollup table."""
+
+    unit, keys = ROLLUPS[table]
+    columns = ", ".join(keys)
+    values = ", ".join(f"x.{key}" for key in keys)
+    groups = ", ".join(str(i) for i in range(1, len(keys) + 2))
+
+    return f"""INSERT INTO {table} AS t (bucket, {columns}, uses, failures)
+               SELECT date_trunc('{unit}', x.invoked_at), {values},
+                      COUNT(*), COUNT(*) FILTER (WHERE x.failed)
+               FROM {source} AS x
+               GROUP BY {groups}
+               ON CONFLICT (bucket, {columns})
+               DO UPDATE SET uses = t.uses + EXCLUDED.uses, failures = t.failures + EXCLUDED.failures;
+            """
+
+
 class GuildConverter(commands.Converter):
     async def convert(self, ctx, argument):
         try:
@@ -66,6 +156,8 @@ class Stats(commands.Cog):
         self._data_batch = []
         self.bulk_insert_loop.add_exception_type(asyncpg.PostgresConnectionError)
         self.bulk_insert_loop.start()
+        self.partition_maintenance_loop.add_exception_type(asyncpg.PostgresConnectionError)
+        self.partition_maintenance_loop.start()
 
         if not hasattr(bot, "command_stats"):
             self.bot.command_stats = Counter()
@@ -73,6 +165,13 @@ class Stats(commands.Cog):
         if not hasattr(bot, "socket_stats"):
             self.bot.socket_stats = Counter()
 
+        # per-minute socket event counts for the last 24 hours
+        if not hasattr(bot, "socket_timeseries"):
+            self.bot.socket_timeseries = TimeSeriesCounter(resolution=60.0, size=1440)
+
+        bot.metrics.add_collector("stats", self.collect_metrics)
+        bot.metrics.add_export("socketstats", self.bot.socket_timeseries.to_dict)
+
     async def bulk_insert(self):
         query = """INSERT INTO commands (name, guild_id, channel_id, author_id, invoked_at, prefix, failed)
                    SELECT x.name, x.guild, x.channel, x.author, x.invoked_at, x.prefix, x.failed
@@ -81,20 +180,97 @@ class Stats(commands.Cog):
                 """
 
         if self._data_batch:
-            await self.bot.pool.execute(query, self._data_batch)
+            async with self.bot.pool.acquire() as con:
+                async with con.transaction():
+                    await con.execute(query, self._data_batch)
+                    for table in ROLLUPS:
+                        await con.execute(rollup_query(table, BATCH_SOURCE), self._data_batch)
+
             total = len(self._data_batch)
             if total > 1:
                 log.info("Registered %s commands to the database.", total)
             self._data_batch.clear()
 
+    async def backfill_rollups(self):
+        """Fills any empty rollup tables from the command history."""
+
+        async with self.bot.pool.acquire() as con:
+            async with con.transaction():
+                for table in ROLLUPS:
+                    if await con.fetchval(f"SELECT EXISTS (SELECT 1 FROM {table});"):
+                        continue
+
+                    log.info("Backfilling %s from the command history", table)
+                    await con.execute(rollup_query(table, HISTORY_SOURCE))
+
     def cog_unload(self):
         self.bulk_insert_loop.stop()
+        self.partition_maintenance_loop.cancel()
+        self.bot.metrics.remove_collector("stats")
+        self.bot.metrics.remove_export("socketstats")
+
+    def collect_metrics(self):
+        registry = self.bot.metrics
+        timeseries = self.bot.socket_timeseries
+
+        events = registry.counter("clam_gateway_events_total", "Gateway events received.", ("event",))
+        rates = registry.gauge(
+            "clam_gateway_events_per_second",
+            "Gateway events per second over the last five minutes.",
+            ("event",),
+        )
+        for event, count in list(self.bot.socket_stats.items()):
+            events.set(count, event=event or "None")
+            rates.set(timeseries.rate(event, window=300.0), event=event or "None")
+
+        registry.gauge(
+            "clam_batch_queue_depth", "Rows waiting to be bulk inserted.", ("queue",)
+        ).set(len(self._data_batch), queue="commands")
 
     @tasks.loop(seconds=10.0)
     async def bulk_insert_loop(self):
         async with self._batch_lock:
             await self.bulk_insert()
 
+    @bulk_insert_loop.before_loop
+    async def before_bulk_insert_loop(self):
+        # rollups start out empty, and the stats commands only read from them
+        async with self._batch_lock:
+            try:
+                await self.backfill_rollups()
+            except asyncpg.PostgresError:
+                log.warning(
+                    "Could not backfill the command usage rollups. "
+                    "Run 'python3 -m clam db init' to create them.",
+                    exc_info=True,
+                )
+
+    @tasks.loop(hours=12.0)
+    async def partition_maintenance_loop(self):
+        async with self.bot.pool.acquire() as con:
+            query = "DELETE FROM command_usage_hourly WHERE bucket < date_trunc('hour', CURRENT_TIMESTAMP - $1::interval);"
+            await con.execute(query, HOURLY_ROLLUP_RETENTION)
+
+            try:
+                await Commands.create_partitions(connection=con)
+            except asyncpg.PostgresError:
+                log.warning(
+                    "Could not create partitions for the commands table. "
+                    "Run 'python3 -m clam db partition stats' to convert it.",
+                    exc_info=True,
+                )
+                return
+
+            retention = self.bot.config.command_history_retention
+            if retention is None:
+                return
+
+            dropped = await Commands.drop_partitions(
+                datetime.timedelta(days=retention), connection=con
+            )
+            if dropped:
+                log.info("Dropped old command history partitions: %s", ", ".join(dropped))
+
     async def register_command(self, ctx):
         if ctx.command is None:
             return
@@ -150,8 +326,8 @@ class Stats(commands.Cog):
         )
 
         if not member:
-            query = """SELECT COUNT(*), MIN(invoked_at)
-                    FROM commands
+            query = """SELECT COALESCE(SUM(uses), 0), MIN(bucket)
+                    FROM command_usage_daily_by_guild
                     WHERE guild_id=$1;"""
             count = await ctx.db.fetchrow(query, ctx.guild.id)
 
@@ -167,8 +343,8 @@ class Stats(commands.Cog):
             em.set_footer(text=f"Tracking command usage since")
 
             query = """SELECT name,
-                        COUNT(*) as "uses"
-                FROM commands
+                        SUM(uses) as "uses"
+                FROM command_usage_daily
                 WHERE guild_id=$1
                 GROUP BY name
                 ORDER BY "uses" DESC
@@ -186,10 +362,10 @@ class Stats(commands.Cog):
             em.add_field(name=":trophy: Top Commands", value=value, inline=True)
 
             query = """SELECT name,
-                            COUNT(*) as "uses"
-                    FROM commands
+                            SUM(uses) as "uses"
+                    FROM command_usage_hourly
                     WHERE guild_id=$1
-                    AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                    AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                     GROUP BY name
                     ORDER BY "uses" DESC
                     LIMIT 5;
@@ -209,8 +385,8 @@ class Stats(commands.Cog):
             em.add_field(name="\u200b", value="\u200b", inline=True)
 
             query = """SELECT author_id,
-                            COUNT(*) AS "uses"
-                    FROM commands
+                            SUM(uses) AS "uses"
+                    FROM command_usage_daily
                     WHERE guild_id=$1
                     GROUP BY author_id
                     ORDER BY "uses" DESC
@@ -231,10 +407,10 @@ class Stats(commands.Cog):
             )
 
             query = """SELECT author_id,
-                            COUNT(*) AS "uses"
-                    FROM commands
+                            SUM(uses) AS "uses"
+                    FROM command_usage_hourly
                     WHERE guild_id=$1
-                    AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                    AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                     GROUP BY author_id
                     ORDER BY "uses" DESC
                     LIMIT 5;
@@ -256,8 +432,8 @@ class Stats(commands.Cog):
             await ctx.send(embed=em)
 
         else:
-            query = """SELECT COUNT(*), MIN(invoked_at)
-                       FROM commands
+            query = """SELECT COALESCE(SUM(uses), 0), MIN(bucket)
+                       FROM command_usage_daily
                        WHERE author_id=$1;
                     """
             count = await ctx.db.fetchrow(query, member.id)
@@ -273,8 +449,8 @@ class Stats(commands.Cog):
             em.set_thumbnail(url=member.display_avatar.url)
             em.set_footer(text="First command used")
 
-            query = """SELECT name, COUNT(*) AS "uses"
-                       FROM commands
+            query = """SELECT name, SUM(uses) AS "uses"
+                       FROM command_usage_daily
                        WHERE author_id=$1 AND guild_id = $2
                        GROUP BY name
                        ORDER BY "uses" DESC
@@ -292,10 +468,10 @@ class Stats(commands.Cog):
                 inline=True,
             )
 
-            query = """SELECT name, COUNT(*) AS "uses"
-                       FROM commands
+            query = """SELECT name, SUM(uses) AS "uses"
+                       FROM command_usage_hourly
                        WHERE author_id=$1 AND guild_id=$2
-                       AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                       AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                        GROUP BY name
                        ORDER BY "uses" DESC
                        LIMIT 5;
@@ -319,7 +495,7 @@ class Stats(commands.Cog):
     async def stats_global(self, ctx):
         """Shows global command usage stats."""
 
-        query = "SELECT COUNT(*), MIN(invoked_at) FROM commands;"
+        query = "SELECT COALESCE(SUM(uses), 0), MIN(bucket) FROM command_usage_daily_by_name;"
         count = await ctx.db.fetchrow(query)
 
         em = discord.Embed(
@@ -337,8 +513,8 @@ class Stats(commands.Cog):
             "`5.`",
         )
 
-        query = """SELECT name, COUNT(*) as "uses"
-                   FROM commands
+        query = """SELECT name, SUM(uses) as "uses"
+                   FROM command_usage_daily_by_name
                    GROUP BY name
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -351,8 +527,8 @@ class Stats(commands.Cog):
 
         em.add_field(name="Top Commands", value="\n".join(value) or "None")
 
-        query = """SELECT guild_id, COUNT(*) as "uses"
-                   FROM commands
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id, SUM(uses) as "uses"
+                   FROM command_usage_daily_by_guild
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -366,8 +542,8 @@ class Stats(commands.Cog):
 
         em.add_field(name="Top Guilds", value="\n".join(value) or "None")
 
-        query = """SELECT author_id, COUNT(*) as "uses"
-                   FROM commands
+        query = """SELECT author_id, SUM(uses) as "uses"
+                   FROM command_usage_daily
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -388,9 +564,9 @@ class Stats(commands.Cog):
     async def today(self, ctx):
         """Shows today's global command usage stats."""
 
-        query = """SELECT COUNT(*)
-                   FROM commands
-                   WHERE invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day');
+        query = """SELECT COALESCE(SUM(uses), 0)
+                   FROM command_usage_hourly
+                   WHERE bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day');
                 """
         count = await ctx.db.fetchrow(query)
 
@@ -408,9 +584,9 @@ class Stats(commands.Cog):
             "`5.`",
         )
 
-        query = """SELECT name, COUNT(*) as "uses"
-                   FROM commands
-                   WHERE invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT name, SUM(uses) as "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                    GROUP BY name
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -423,9 +599,9 @@ class Stats(commands.Cog):
 
         em.add_field(name="Top Commands", value="\n".join(value) or "None")
 
-        query = """SELECT guild_id, COUNT(*) as "uses"
-                   FROM commands
-                   WHERE invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id, SUM(uses) as "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -439,9 +615,9 @@ class Stats(commands.Cog):
 
         em.add_field(name="Top Guilds", value="\n".join(value) or "None")
 
-        query = """SELECT author_id, COUNT(*) as "uses"
-                   FROM commands
-                   WHERE invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT author_id, SUM(uses) as "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -470,8 +646,8 @@ class Stats(commands.Cog):
             "`5.`",
         )
 
-        query = """SELECT COUNT(*), MIN(invoked_at)
-                    FROM commands
+        query = """SELECT COALESCE(SUM(uses), 0), MIN(bucket)
+                    FROM command_usage_daily_by_guild
                     WHERE guild_id=$1;"""
         count = await ctx.db.fetchrow(query, guild.id)
 
@@ -487,8 +663,8 @@ class Stats(commands.Cog):
         em.set_footer(text=f"Tracking command usage since")
 
         query = """SELECT name,
-                    COUNT(*) as "uses"
-            FROM commands
+                    SUM(uses) as "uses"
+            FROM command_usage_daily
             WHERE guild_id=$1
             GROUP BY name
             ORDER BY "uses" DESC
@@ -506,10 +682,10 @@ class Stats(commands.Cog):
         em.add_field(name=":trophy: Top Commands", value=value, inline=True)
 
         query = """SELECT name,
-                        COUNT(*) as "uses"
-                FROM commands
+                        SUM(uses) as "uses"
+                FROM command_usage_hourly
                 WHERE guild_id=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY name
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -529,8 +705,8 @@ class Stats(commands.Cog):
         em.add_field(name="\u200b", value="\u200b", inline=True)
 
         query = """SELECT author_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+                        SUM(uses) AS "uses"
+                FROM command_usage_daily
                 WHERE guild_id=$1
                 GROUP BY author_id
                 ORDER BY "uses" DESC
@@ -551,10 +727,10 @@ class Stats(commands.Cog):
         )
 
         query = """SELECT author_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+                        SUM(uses) AS "uses"
+                FROM command_usage_hourly
                 WHERE guild_id=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY author_id
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -588,8 +764,8 @@ class Stats(commands.Cog):
             "`5.`",
         )
 
-        query = """SELECT COUNT(*), MIN(invoked_at)
-                    FROM commands
+        query = """SELECT COALESCE(SUM(uses), 0), MIN(bucket)
+                    FROM command_usage_daily
                     WHERE author_id=$1;"""
         count = await ctx.db.fetchrow(query, user.id)
 
@@ -604,8 +780,8 @@ class Stats(commands.Cog):
         em.set_footer(text="Tracking command usage since")
 
         query = """SELECT name,
-                    COUNT(*) as "uses"
-            FROM commands
+                    SUM(uses) as "uses"
+            FROM command_usage_daily
             WHERE author_id=$1
             GROUP BY name
             ORDER BY "uses" DESC
@@ -623,10 +799,10 @@ class Stats(commands.Cog):
         em.add_field(name=":trophy: Top Commands", value=value, inline=True)
 
         query = """SELECT name,
-                        COUNT(*) as "uses"
-                FROM commands
+                        SUM(uses) as "uses"
+                FROM command_usage_hourly
                 WHERE author_id=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY name
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -645,9 +821,9 @@ class Stats(commands.Cog):
         )
         em.add_field(name="\u200b", value="\u200b", inline=True)
 
-        query = """SELECT guild_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id,
+                        SUM(uses) AS "uses"
+                FROM command_usage_daily
                 WHERE author_id=$1
                 GROUP BY guild_id
                 ORDER BY "uses" DESC
@@ -670,11 +846,11 @@ class Stats(commands.Cog):
             inline=True,
         )
 
-        query = """SELECT guild_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id,
+                        SUM(uses) AS "uses"
+                FROM command_usage_hourly
                 WHERE author_id=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY guild_id
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -711,8 +887,8 @@ class Stats(commands.Cog):
             "`5.`",
         )
 
-        query = """SELECT COUNT(*), MIN(invoked_at)
-                    FROM commands
+        query = """SELECT COALESCE(SUM(uses), 0), MIN(bucket)
+                    FROM command_usage_daily_by_name
                     WHERE name=$1;"""
         count = await ctx.db.fetchrow(query, command)
 
@@ -725,9 +901,9 @@ class Stats(commands.Cog):
         em.description = f"`{command}` has **{plural(count[0], pretty=True):use}**."
         em.set_footer(text="Tracking command usage since")
 
-        query = """SELECT guild_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id,
+                        SUM(uses) AS "uses"
+                FROM command_usage_daily
                 WHERE name=$1
                 GROUP BY guild_id
                 ORDER BY "uses" DESC
@@ -750,11 +926,11 @@ class Stats(commands.Cog):
             inline=True,
         )
 
-        query = """SELECT guild_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+        query = """SELECT NULLIF(guild_id, 0) AS guild_id,
+                        SUM(uses) AS "uses"
+                FROM command_usage_hourly
                 WHERE name=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY guild_id
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -778,8 +954,8 @@ class Stats(commands.Cog):
         em.add_field(name="\u200b", value="\u200b", inline=True)
 
         query = """SELECT author_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+                        SUM(uses) AS "uses"
+                FROM command_usage_daily
                 WHERE name=$1
                 GROUP BY author_id
                 ORDER BY "uses" DESC
@@ -800,10 +976,10 @@ class Stats(commands.Cog):
         )
 
         query = """SELECT author_id,
-                        COUNT(*) AS "uses"
-                FROM commands
+                        SUM(uses) AS "uses"
+                FROM command_usage_hourly
                 WHERE name=$1
-                AND invoked_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                AND bucket >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '1 day')
                 GROUP BY author_id
                 ORDER BY "uses" DESC
                 LIMIT 5;
@@ -990,21 +1166,23 @@ class Stats(commands.Cog):
     ):
         """Shows command history for a command."""
 
-        query = """SELECT *, t.success + t.failed AS "total"
-                   FROM (
-                       SELECT guild_id,
-                              SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                              SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                       FROM commands
-                       WHERE name=$1
-                       AND invoked_at > (CURRENT_TIMESTAMP - $2::interval)
-                       GROUP BY guild_id
-                   ) AS t
-                   ORDER BY "total" DESC
-                   LIMIT 30;
-                """
-
-        await self.tabulate_query(ctx, query, command, datetime.timedelta(days=days))
+        interval = datetime.timedelta(days=days)
+        table, unit = usage_rollup(interval)
+        query = f"""SELECT *, t.success + t.failed AS "total"
+                    FROM (
+                        SELECT NULLIF(guild_id, 0) AS guild_id,
+                               SUM(uses - failures) AS "success",
+                               SUM(failures) AS "failed"
+                        FROM {table}
+                        WHERE name=$1
+                        AND bucket >= date_trunc('{unit}', CURRENT_TIMESTAMP - $2::interval)
+                        GROUP BY guild_id
+                    ) AS t
+                    ORDER BY "total" DESC
+                    LIMIT 30;
+                 """
+
+        await self.tabulate_query(ctx, query, command, interval)
 
     @command_history.command(name="guild", aliases=["server"])
     @commands.is_owner()
@@ -1050,16 +1228,18 @@ class Stats(commands.Cog):
     async def command_history_log(self, ctx, days=7):
         """Shows the command history log for the last N days."""
 
-        query = """SELECT name, COUNT(*)
-                   FROM commands
-                   WHERE invoked_at > (CURRENT_TIMESTAMP - $1::interval)
-                   GROUP BY name
-                   ORDER BY 2 DESC
-                """
+        interval = datetime.timedelta(days=days)
+        table, unit = usage_rollup(interval)
+        query = f"""SELECT name, SUM(uses)
+                    FROM {table}
+                    WHERE bucket >= date_trunc('{unit}', CURRENT_TIMESTAMP - $1::interval)
+                    GROUP BY name
+                    ORDER BY 2 DESC
+                 """
 
         all_commands = {c.qualified_name: 0 for c in self.bot.walk_commands()}
 
-        records = await ctx.db.fetch(query, datetime.timedelta(days=days))
+        records = await ctx.db.fetch(query, interval)
         for name, uses in records:
             if name in all_commands:
                 all_commands[name] = uses
@@ -1099,73 +1279,83 @@ class Stats(commands.Cog):
         """Shows command history for a cog or grouped by a cog."""
 
         interval = datetime.timedelta(days=days)
+        table, unit = usage_rollup(interval)
         if cog is not None:
             cog = self.bot.get_cog(cog)
             if cog is None:
                 return await ctx.send(f"Unknown cog: {cog}")
 
-            query = """SELECT *, t.success + t.failed AS "total"
-                       FROM (
-                           SELECT name,
-                                  SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                                  SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                           FROM commands
-                           WHERE name = any($1::text[])
-                           AND invoked_at > (CURRENT_TIMESTAMP - $2::interval)
-                           GROUP BY name
-                       ) AS t
-                       ORDER BY "total" DESC
-                       LIMIT 30;
-                    """
+            query = f"""SELECT *, t.success + t.failed AS "total"
+                        FROM (
+                            SELECT name,
+                                   SUM(uses - failures) AS "success",
+                                   SUM(failures) AS "failed"
+                            FROM {table}
+                            WHERE name = any($1::text[])
+                            AND bucket >= date_trunc('{unit}', CURRENT_TIMESTAMP - $2::interval)
+                            GROUP BY name
+                        ) AS t
+                        ORDER BY "total" DESC
+                        LIMIT 30;
+                     """
             return await self.tabulate_query(
                 ctx, query, [c.qualified_name for c in cog.walk_commands()], interval
             )
 
-        # A more manual query with a manual grouper.
-        query = """SELECT *, t.success + t.failed AS "total"
-                   FROM (
-                       SELECT name,
-                              SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                              SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                       FROM commands
-                       WHERE invoked_a t> (CURRENT_TIMESTAMP - $1::interval)
-                       GROUP BY name
-                   ) AS t;
-                """
+        # Map each command to its cog and let PostgreSQL do the grouping.
+        names, cogs = [], []
+        for command in self.bot.walk_commands():
+            names.append(command.qualified_name)
+            cogs.append(command.cog.qualified_name if command.cog else "No Cog")
+
+        query = f"""SELECT COALESCE(c.cog, 'No Cog') AS "cog",
+                           SUM(u.uses - u.failures) AS "success",
+                           SUM(u.failures) AS "failed",
+                           SUM(u.uses) AS "total"
+                    FROM {table} u
+                    LEFT JOIN unnest($2::text[], $3::text[]) AS c(name, cog) ON c.name = u.name
+                    WHERE u.bucket >= date_trunc('{unit}', CURRENT_TIMESTAMP - $1::interval)
+                    GROUP BY 1
+                    ORDER BY "total" DESC;
+                 """
+
+        records = await ctx.db.fetch(query, interval, names, cogs)
 
-        class Count:
-            __slots__ = ("success", "failed", "total")
+        table = TabularData()
+        table.set_columns(["Cog", "Success", "Failed", "Total"])
+        table.add_rows(list(r.values()) for r in records)
+        render = table.render()
+        await ctx.send(discord.utils.escape_mentions(f"```\n{render}\n```"))
 
-            def __init__(self):
-                self.success = 0
-                self.failed = 0
-                self.total = 0
+    @command_history.command(name="rebuild", aliases=["rollup"])
+    @commands.is_owner()
+    async def command_history_rebuild(self, ctx):
+        """Rebuilds the command usage rollups from the raw command history.
 
-            def add(self, record):
-                self.success += record["success"]
-                self.failed += record["failed"]
-                self.total += record["total"]
+        Only buckets covered by the command history are rebuilt. Older
+        rollups are kept, since their raw history is already gone.
+        """
 
-        data = defaultdict(Count)
-        records = await ctx.db.fetch(query, interval)
-        for record in records:
-            command = self.bot.get_command(record["name"])
-            if command is None or command.cog is None:
-                data["No Cog"].add(record)
-            else:
-                data[command.cog.qualified_name].add(record)
+        confirm = await ctx.confirm("This will rebuild the command usage rollups. Are you sure?")
+        if not confirm:
+            return await ctx.send("Aborted.")
 
-        table = TabularData()
-        table.set_columns(["Cog", "Success", "Failed", "Total"])
-        data = sorted(
-            [(cog, e.success, e.failed, e.total) for cog, e in data.items()],
-            key=lambda t: t[-1],
-            reverse=True,
-        )
+        async with ctx.typing():
+            async with self._batch_lock:
+                await self.bulk_insert()
 
-        table.add_rows(data)
-        render = table.render()
-        await ctx.send(discord.utils.escape_mentions(f"```\n{render}\n```"))
+                async with ctx.db.acquire() as con:
+                    async with con.transaction():
+                        oldest = await con.fetchval("SELECT MIN(invoked_at) FROM commands;")
+                        if oldest is None:
+                            return await ctx.send("There's no command history to rebuild from.")
+
+                        for table, (unit, _) in ROLLUPS.items():
+                            query = f"DELETE FROM {table} WHERE bucket >= date_trunc('{unit}', $1::timestamp);"
+                            await con.execute(query, oldest)
+                            await con.execute(rollup_query(table, HISTORY_SOURCE))
+
+        await ctx.send(ctx.tick(True, "Rebuilt command usage rollups."))
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
@@ -1206,24 +1396,36 @@ class Stats(commands.Cog):
     @commands.Cog.listener()
     async def on_socket_event_type(self, event_type):
         self.bot.socket_stats[event_type] += 1
+        self.bot.socket_timeseries.increment(event_type)
 
     @flags.add_flag("--sort", "-s", default="count")
+    @flags.add_flag("--window", "-w", type=int, default=60)
     @flags.add_flag("--json", action="store_true")
     @commands.command(aliases=["socket", "websocket"], cls=NoUsageFlagCommand)
     async def socketstats(self, ctx, **flags):
         """Shows websocket stats.
 
         Flags:
-          `--sort` `-s`  Sort by 'name' or by 'count'. Defaults to 'name'
-          `--json`  Save socketstats to a json file for use programmatically
+          `--sort` `-s`  Sort by 'name' or by 'count'. Defaults to 'count'
+          `--window` `-w`  How many minutes back to show rates for. Defaults to 60
+          `--json`  Save socketstats and per-minute counts to a json file for use programmatically
         """
 
+        timeseries = self.bot.socket_timeseries
+        window = flags["window"]
+
+        if not 1 <= window <= 1440:
+            raise commands.BadArgument("`--window` flag must be between 1 and 1440 minutes")
+
+        window *= 60
+
         if flags["json"]:
             stats = {
-                "uptime": datetime.timestamp(self.bot.uptime),
+                "uptime": self.bot.uptime.replace(tzinfo=datetime.timezone.utc).timestamp(),
                 "total": sum(self.bot.socket_stats.values()),
             }
             stats.update(self.bot.socket_stats)
+            stats["timeseries"] = timeseries.to_dict()
 
             output = io.BytesIO()
             output.write(json.dumps(stats, indent=2).encode())
@@ -1237,31 +1439,36 @@ class Stats(commands.Cog):
         if sort not in ["name", "count"]:
             raise commands.BadArgument("`--sort` flag must be either 'name' or 'count'")
 
-        sorted_stats = {}
-
         if sort == "name":
-            the_stats_sorted = sorted(self.bot.socket_stats.keys())
+            the_stats_sorted = sorted(self.bot.socket_stats.keys(), key=lambda k: k or "")
 
         else:
-            the_stats_sorted = {
-                k: v
-                for k, v in reversed(
-                    sorted(self.bot.socket_stats.items(), key=lambda item: item[1])
-                )
-            }
+            the_stats_sorted = sorted(
+                self.bot.socket_stats.keys(),
+                key=lambda k: self.bot.socket_stats[k],
+                reverse=True,
+            )
 
+        data = []
         for name in the_stats_sorted:
-            sorted_stats[name] = self.bot.socket_stats[name]
+            _, peak = timeseries.peak(name, window=window)
+            rate = timeseries.rate(name, window=window)
+            count = self.bot.socket_stats[name]
+            data.append([name or "None", f"{count} ({rate:.2f}/s, peak {peak}/min)"])
 
-        data = [[n or "None", v] for n, v in sorted_stats.items()]
-        data.insert(0, ["Total", sum(self.bot.socket_stats.values())])
+        total = sum(self.bot.socket_stats.values())
+        rate = timeseries.rate(window=window)
+        data.insert(0, ["Total", f"{total} ({rate:.2f}/s)"])
 
         delta = datetime.datetime.utcnow() - self.bot.uptime
         minutes = delta.total_seconds() / 60
-        total = sum(self.bot.socket_stats.values())
         cpm = total / minutes
 
-        description = f"Total socket events observed: {total} ({cpm:.2f}/minute)"
+        recent = timeseries.count(window=window) / (window / 60)
+        description = (
+            f"Total socket events observed: {total} ({cpm:.2f}/minute)\n"
+            f"Last {window // 60} minutes: {recent:.2f}/minute"
+        )
         pages = ctx.table_pages(data, title="Websocket Stats", description=description)
         await pages.start()
 
@@ -1289,7 +1496,7 @@ class Stats(commands.Cog):
         description = [
             f"Total `Pool.acquire` Waiters: {total_waiting}",
             f"Current Pool Generation: {current_generation}",
-            f"Connections In Use: {len(pool._holders) - pool._queue.qsize()}",
+            f"Connections In Use: {pool.get_size() - pool.get_idle_size()}",
         ]
 
         questionable_connections = 0
@@ -1379,10 +1586,172 @@ class Stats(commands.Cog):
         if global_rate_limit or total_warnings >= 9:
             embed.colour = UNHEALTHY
 
+        monitor = self.bot.loop_monitor
+        if monitor is not None:
+            description.append(
+                f"Event Loop Lag: {monitor.lag * 1000:.2f}ms (worst {monitor.max_lag * 1000:.2f}ms)"
+            )
+            if monitor.lag >= monitor.threshold:
+                total_warnings += 1
+                embed.colour = WARNING
+
         embed.set_footer(text=f"{total_warnings} warning(s)")
         embed.description = "\n".join(description)
         await ctx.send(embed=embed)
 
+    def get_loop_monitor(self):
+        monitor = self.bot.loop_monitor
+        if monitor is None:
+            raise commands.BadArgument("The event loop monitor isn't running.")
+        return monitor
+
+    @commands.group(hidden=True, invoke_without_command=True, aliases=["slowcallbacks", "blocking"])
+    @commands.is_owner()
+    async def looplag(self, ctx):
+        """Shows event loop lag and the worst offenders for blocking the loop."""
+
+        monitor = self.get_loop_monitor()
+        offenders = monitor.worst_offenders(10)
+
+        description = (
+            f"Current lag: {monitor.lag * 1000:.2f}ms\n"
+            f"Worst lag: {monitor.max_lag * 1000:.2f}ms\n"
+            f"Times blocked over {monitor.threshold * 1000:.0f}ms: {monitor.total_events}"
+        )
+
+        if not offenders:
+            return await ctx.send(f"{description}\nNothing has blocked the loop yet.")
+
+        table = TabularData()
+        table.set_columns(["#", "Total", "Count", "Worst", "Task", "Location"])
+        table.add_rows(
+            [
+                index,
+                f"{o.total * 1000:.0f}ms",
+                o.count,
+                f"{o.worst.duration * 1000:.0f}ms",
+                o.task or "Callback",
+                o.location,
+            ]
+            for index, o in enumerate(offenders, start=1)
+        )
+        render = table.render()
+
+        fmt = f"{description}\n```\n{render}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode("utf-8"))
+            await ctx.send(description, file=discord.File(fp, "offenders.txt"))
+        else:
+            await ctx.send(fmt)
+
+    @looplag.command(name="trace", aliases=["traceback"])
+    @commands.is_owner()
+    async def looplag_trace(self, ctx, rank: int = 1):
+        """Shows the stack captured for an offender's worst block."""
+
+        monitor = self.get_loop_monitor()
+        offenders = monitor.worst_offenders(max(rank, 1))
+        if not 1 <= rank <= len(offenders):
+            raise commands.BadArgument("There's no offender with that rank.")
+
+        offender = offenders[rank - 1]
+        event = offender.worst
+        header = (
+            f"**{offender.task or 'Callback'}** at `{offender.location}` "
+            f"blocked the loop for {event.duration * 1000:.0f}ms"
+        )
+
+        stack = event.format_stack()
+        fmt = f"{header}\n```py\n{stack}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(stack.encode("utf-8"))
+            await ctx.send(header, file=discord.File(fp, "traceback.txt"))
+        else:
+            await ctx.send(fmt)
+
+    @looplag.command(name="recent")
+    @commands.is_owner()
+    async def looplag_recent(self, ctx):
+        """Shows the most recent times the loop was blocked."""
+
+        monitor = self.get_loop_monitor()
+        events = list(monitor.events)[-15:]
+        if not events:
+            return await ctx.send("Nothing has blocked the loop yet.")
+
+        table = TabularData()
+        table.set_columns(["When", "Duration", "Task", "Location"])
+        now = datetime.datetime.utcnow()
+        table.add_rows(
+            [
+                humantime.timedelta(
+                    datetime.datetime.utcfromtimestamp(e.occurred_at), source=now, brief=True, discord_fmt=False
+                ),
+                f"{e.duration * 1000:.0f}ms",
+                e.task or "Callback",
+                e.location,
+            ]
+            for e in reversed(events)
+        )
+        render = table.render()
+
+        fmt = f"```\n{render}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode("utf-8"))
+            await ctx.send(file=discord.File(fp, "recent.txt"))
+        else:
+            await ctx.send(fmt)
+
+    @looplag.command(name="reset")
+    @commands.is_owner()
+    async def looplag_reset(self, ctx):
+        """Resets the recorded offenders."""
+
+        self.get_loop_monitor().reset()
+        await ctx.send(ctx.tick(True, "Reset the event loop monitor."))
+
+    @commands.group(hidden=True, invoke_without_command=True, aliases=["messagestages", "onmessage"])
+    @commands.is_owner()
+    async def pipeline(self, ctx):
+        """Shows how long each on_message stage takes."""
+
+        pipeline = self.bot.message_pipeline
+        stages = sorted(pipeline.stages.values(), key=lambda s: s.total, reverse=True)
+        description = f"Messages processed: {pipeline.messages:,}"
+
+        if not stages:
+            return await ctx.send(f"{description}\nNo stages are registered.")
+
+        table = TabularData()
+        table.set_columns(["Stage", "Calls", "Errors", "Average", "Worst", "Total"])
+        table.add_rows(
+            [
+                s.name,
+                f"{s.calls:,}",
+                s.errors,
+                f"{s.average * 1000:.3f}ms",
+                f"{s.worst * 1000:.1f}ms",
+                f"{s.total:.2f}s",
+            ]
+            for s in stages
+        )
+        render = table.render()
+
+        fmt = f"{description}\n```\n{render}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode("utf-8"))
+            await ctx.send(description, file=discord.File(fp, "stages.txt"))
+        else:
+            await ctx.send(fmt)
+
+    @pipeline.command(name="reset")
+    @commands.is_owner()
+    async def pipeline_reset(self, ctx):
+        """Resets the on_message stage timings."""
+
+        self.bot.message_pipeline.reset()
+        await ctx.send(ctx.tick(True, "Reset the message stage timings."))
+
 
 async def setup(bot):
     await bot.add_cog(Stats(bot))
@@ -260,6 +260,44 @@ class Timers(commands.Cog):
 
         return timer
 
+    async def create_timers(self, timers, *, connection=None):
+        """Creates many timers with a single query.
+
+        Parameters
+        -----------
+        timers: List[Tuple[datetime.datetime, str, List]]
+            A list of ``(when, event, args)`` tuples.
+            See :meth:`create_timer` for what each of these mean.
+        connection: asyncpg.Connection
+            A specific connection to use for the DB request.
+        """
+
+        connection = connection or self.bot.pool
+        now = discord.utils.utcnow().astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+        records = []
+        for when, event, args in timers:
+            when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            delta = (when - now).total_seconds()
+            if delta <= 60:
+                timer = Timer.temporary(event=event, args=args, kwargs={}, expires=when, created=now)
+                self.bot.loop.create_task(self.short_timer_optimisation(delta, timer))
+                continue
+
+            records.append({"event": event, "extra": {"args": args, "kwargs": {}}, "expires": when.isoformat()})
+
+        if not records:
+            return
+
+        query = """INSERT INTO timers (event, extra, expires, created)
+                   SELECT x.event, x.extra, x.expires, $2
+                   FROM jsonb_to_recordset($1::jsonb) AS
+                   x(event TEXT, extra JSONB, expires TIMESTAMP);
+                """
+
+        await connection.execute(query, records, now)
+        self._have_data.set()
+
     @commands.hybrid_group(
         aliases=["remind", "timer"], fallback="create", invoke_without_command=True
     )
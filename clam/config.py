@@ -62,6 +62,25 @@ class Config:
         self.debug = DebugMode(self._data.get("debug", 0))
         # Webhook for status messages
         self.status_hook = self._data.get("status-hook")
+        # How many days of raw command history to keep (forever if unset)
+        self.command_history_retention = self._data.get("command-history-retention")
+        # Serve Prometheus metrics on this port (disabled if unset)
+        self.metrics_port = self._data.get("metrics-port")
+        self.metrics_host = self._data.get("metrics-host", "127.0.0.1")
+        # Record anything that blocks the event loop for longer than this (in ms)
+        self.slow_callback_threshold = self._data.get("slow-callback-threshold", 100)
+        # Maximum size of the music cache folder in MiB (unbounded if unset)
+        self.music_cache_size = self._data.get("music-cache-size")
+        # Which songs to evict first when the music cache is full: lru or lfu
+        self.music_cache_policy = self._data.get("music-cache-policy", "lru")
+        # How many youtube_dl extractions can run at once, and whether they run in processes
+        self.ytdl_workers = self._data.get("ytdl-workers", 4)
+        self.ytdl_processes = self._data.get("ytdl-processes", True)
+        # Start playing songs that aren't cached while they download
+        self.music_streaming = self._data.get("music-streaming", True)
+        # Keep Opus copies of played songs so they can be sent without re-encoding
+        self.music_opus_cache = self._data.get("music-opus-cache", False)
+        self.music_opus_bitrate = self._data.get("music-opus-bitrate", 128)
 
         self.twitch_client_id = self._data.get("twitch-client-id")
         self.twitch_client_secret = self._data.get("twitch-client-secret")
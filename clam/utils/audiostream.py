@@ -0,0 +1,142 @@
+"""Playing songs while they're still downloading.
+
+youtube_dl downloads into ``<filename>.part`` and renames it once it's
+done. :class:`GrowingFileReader` reads that file as it grows and hands
+the bytes to FFmpeg through a pipe, so playback can start after the
+first few kilobytes while the same download fills the music cache.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger("clam.music.stream")
+
+
+class ActiveDownload:
+    """A song download that's in progress.
+
+    Parameters
+    -----------
+    path: str
+        Where youtube_dl is expected to save the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.failed = False
+        self.task = None
+        # whether a ytdl worker has picked the download up
+        self.running = False
+
+        # set from the event loop, waited on from FFmpeg's pipe thread
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def started(self):
+        """Whether youtube_dl has started writing the file."""
+
+        return os.path.exists(self.path + ".part") or os.path.exists(self.path)
+
+    async def wait_started(self, *, poll=0.1):
+        """Waits until the download starts writing or finishes.
+
+        A download can sit in the ytdl worker queue for a while, so this
+        waits on the download itself instead of a set amount of time.
+        """
+
+        while not self.done and not self.started:
+            await asyncio.sleep(poll)
+
+    def mark_running(self):
+        self.running = True
+
+    def finish(self, path=None, *, failed=False):
+        if path:
+            self.path = path
+
+        self.failed = failed
+        self._done.set()
+
+    def open(self, **kwargs):
+        return GrowingFileReader(self, **kwargs)
+
+
+class GrowingFileReader:
+    """A file-like object that reads a download as it's written.
+
+    Reads block until more data is written, and only return an empty
+    bytes object once the download has finished and everything has been
+    read, or the reader is closed. Use :meth:`ActiveDownload.wait_started`
+    before reading, since a download that hasn't started yet blocks reads
+    until it does.
+
+    Parameters
+    -----------
+    download: :class:`ActiveDownload`
+        The download to read.
+    poll: float
+        How long to wait for more data before checking again, in seconds.
+    """
+
+    def __init__(self, download, *, poll=0.05):
+        self.download = download
+        self.poll = poll
+
+        self._file = None
+        self._closed = False
+
+    def _open(self):
+        # check the .part first, it's renamed to the final path when it's done
+        for path in (self.download.path + ".part", self.download.path):
+            try:
+                return open(path, "rb")
+            except FileNotFoundError:
+                continue
+
+        return None
+
+    def read(self, size=-1):
+        while not self._closed:
+            if self._file is None:
+                finished = self.download.done
+                self._file = self._open()
+
+                if self._file is None:
+                    if finished:
+                        log.warning("'%s' finished without writing anything", self.download.path)
+                        return b""
+
+                    time.sleep(self.poll)
+                    continue
+
+            # check before reading so bytes written right before finishing aren't missed
+            finished = self.download.done
+            data = self._file.read(size)
+            if data:
+                return data
+
+            if finished:
+                break
+
+            time.sleep(self.poll)
+
+        self._closed = True
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+        return b""
+
+    def close(self):
+        # the file is closed by the thread that's reading it
+        self._closed = True
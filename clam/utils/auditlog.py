@@ -0,0 +1,164 @@
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+
+import discord
+
+
+log = logging.getLogger("clam.auditlog")
+
+
+class AuditLogPoller:
+    """Serves audit log lookups for a guild from a shared, recent cache.
+
+    Events like bans and kicks don't say who did them, so they have to be
+    matched against the audit log. Instead of fetching the log once per
+    event, lookups that miss the cache wait on a single fetch that runs
+    after a short debounce, so a mass ban costs one or two requests.
+
+    Entries are matched by target ID, so concurrent actions on different
+    members can't be mixed up.
+
+    Parameters
+    -----------
+    guild: :class:`discord.Guild`
+        The guild to poll.
+    debounce: float
+        How long to wait for more lookups before fetching, in seconds.
+    ttl: float
+        How long entries are kept, in seconds.
+    """
+
+    def __init__(self, guild, *, debounce=1.0, ttl=60.0):
+        self.guild = guild
+        self.debounce = debounce
+        self.ttl = datetime.timedelta(seconds=ttl)
+
+        self.fetches = 0
+
+        # target ID: entries, newest first
+        self._entries = defaultdict(list)
+        self._last_id = None
+        self._pending = None
+        self._task = None
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+
+        if self._pending and not self._pending.done():
+            self._pending.cancel()
+
+    def _prune(self):
+        cutoff = discord.utils.utcnow() - self.ttl
+        for target_id in list(self._entries):
+            entries = [e for e in self._entries[target_id] if e.created_at >= cutoff]
+            if entries:
+                self._entries[target_id] = entries
+            else:
+                del self._entries[target_id]
+
+    def _add(self, entry):
+        target_id = getattr(entry.target, "id", None)
+        self._entries[target_id].insert(0, entry)
+
+        if self._last_id is None or entry.id > self._last_id:
+            self._last_id = entry.id
+
+    async def _fetch(self):
+        if self._last_id is None:
+            # no need to go further back than what we keep
+            after = discord.utils.utcnow() - self.ttl
+        else:
+            after = discord.Object(id=self._last_id)
+
+        self.fetches += 1
+
+        # everything since the last fetch, paged 100 entries at a time
+        entries = [entry async for entry in self.guild.audit_logs(limit=None, after=after)]
+
+        for entry in sorted(entries, key=lambda e: e.id):
+            self._add(entry)
+
+        self._prune()
+
+    async def _fetch_later(self, future):
+        await asyncio.sleep(self.debounce)
+
+        # lookups from now on need a fetch that starts after their event
+        self._pending = None
+
+        try:
+            await self._fetch()
+
+        except discord.HTTPException as e:
+            log.info("Failed to fetch audit logs for guild %s: %s", self.guild.id, e)
+
+        finally:
+            if not future.done():
+                future.set_result(None)
+
+    def refresh(self):
+        """Returns a future that's done once a fetch has finished.
+
+        Calls made before the debounce runs out share the same fetch.
+        """
+
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._fetch_later(self._pending))
+
+        return self._pending
+
+    def get(self, actions, *, target_id=None, since=None):
+        """Returns the newest cached entry matching the arguments, if any.
+
+        A ``target_id`` of ``None`` matches any target.
+        """
+
+        if target_id is None:
+            candidates = [e for entries in self._entries.values() for e in entries]
+            candidates.sort(key=lambda e: e.id, reverse=True)
+        else:
+            candidates = self._entries.get(target_id, ())
+
+        for entry in candidates:
+            if since is not None and entry.created_at < since:
+                break
+
+            if entry.action in actions:
+                return entry
+
+        return None
+
+    async def find(self, actions, *, target_id=None, since=None, attempts=2):
+        """Finds an audit log entry, fetching new entries if it isn't cached.
+
+        Audit log entries sometimes show up a little after the gateway event,
+        so the log is checked up to ``attempts`` times before giving up.
+
+        Parameters
+        -----------
+        actions: Tuple[:class:`discord.AuditLogAction`]
+            The actions to match.
+        target_id: Optional[int]
+            The ID of the entry's target. ``None`` matches any target.
+        since: Optional[:class:`datetime.datetime`]
+            Ignore entries created before this.
+        attempts: int
+            How many fetches to wait on.
+        """
+
+        entry = self.get(actions, target_id=target_id, since=since)
+        if entry:
+            return entry
+
+        for _ in range(attempts):
+            await self.refresh()
+
+            entry = self.get(actions, target_id=target_id, since=since)
+            if entry:
+                return entry
+
+        return None
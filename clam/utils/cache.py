@@ -35,6 +35,11 @@ from functools import wraps
 from lru import LRU
 
 
+# qualified function name: cached function
+# used to report hit ratios
+caches = {}
+
+
 def _wrap_and_store_coroutine(cache, key, coro):
     async def func():
         value = await coro
@@ -87,13 +92,14 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
     def decorator(func):
         if strategy is Strategy.lru:
             _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            _stats = lambda: (0, 0)
         elif strategy is Strategy.timed:
             _internal_cache = ExpiringCache(maxsize)
-            _stats = lambda: (0, 0)
+
+        # hits, misses
+        _counts = [0, 0]
+        _stats = lambda: tuple(_counts)
 
         def _make_key(args, kwargs):
             # this is a bit of a cluster fuck
@@ -125,6 +131,7 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
             try:
                 value = _internal_cache[key]
             except KeyError:
+                _counts[1] += 1
                 value = func(*args, **kwargs)
 
                 if inspect.isawaitable(value):
@@ -133,6 +140,7 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
                 _internal_cache[key] = value
                 return value
             else:
+                _counts[0] += 1
                 if asyncio.iscoroutinefunction(func):
                     return _wrap_new_coroutine(value)
                 return value
@@ -161,6 +169,7 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
         wrapper.invalidate = _invalidate
         wrapper.get_stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
+        caches[f"{func.__module__}.{func.__qualname__}"] = wrapper
         return wrapper
 
     return decorator
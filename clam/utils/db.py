@@ -531,6 +531,28 @@ class MaybeAcquire:
             await self.pool.release(self._connection)
 
 
+def _truncate_period(dt, interval):
+    if interval == "day":
+        return datetime.datetime(dt.year, dt.month, dt.day)
+    if interval == "month":
+        return datetime.datetime(dt.year, dt.month, 1)
+    return datetime.datetime(dt.year, 1, 1)
+
+
+def _next_period(dt, interval):
+    if interval == "day":
+        return dt + datetime.timedelta(days=1)
+    if interval == "month":
+        if dt.month == 12:
+            return dt.replace(year=dt.year + 1, month=1)
+        return dt.replace(month=dt.month + 1)
+    return dt.replace(year=dt.year + 1)
+
+
+# interval: partition name suffix format
+_PARTITION_INTERVALS = {"day": "%Y%m%d", "month": "%Y%m", "year": "%Y"}
+
+
 class TableMeta(type):
     @classmethod
     def __prepare__(cls, name, bases, **kwargs):
@@ -546,6 +568,17 @@ class TableMeta(type):
 
         dct["__tablename__"] = table_name
 
+        partition_by = kwargs.get("partition_by")
+        partition_interval = kwargs.get("partition_interval", "month")
+        if partition_by is not None and partition_interval not in _PARTITION_INTERVALS:
+            raise SchemaError(
+                "partition_interval must be one of %s." % ", ".join(_PARTITION_INTERVALS)
+            )
+
+        dct["__partition_by__"] = partition_by
+        dct["__partition_interval__"] = partition_interval
+        dct["__partitions_ahead__"] = kwargs.get("partitions_ahead", 3)
+
         for elem, value in dct.items():
             if isinstance(value, Column):
                 if value.name is None:
@@ -874,10 +907,22 @@ class Table(metaclass=TableMeta):
             if col.primary_key:
                 primary_keys.append(col.name)
 
+        # partitioned tables need the partition key in the primary key
+        partition_by = cls.__partition_by__
+        if partition_by is not None and partition_by not in primary_keys:
+            primary_keys.append(partition_by)
+
         column_creations.append("PRIMARY KEY (%s)" % ", ".join(primary_keys))
         builder.append("(%s)" % ", ".join(column_creations))
+
+        if partition_by is not None:
+            builder.append("PARTITION BY RANGE (%s)" % partition_by)
+
         statements.append(" ".join(builder) + ";")
 
+        if partition_by is not None:
+            statements.extend(cls._create_partitions())
+
         # handle the index creations
         for column in cls.columns:
             if column.index:
@@ -888,6 +933,207 @@ class Table(metaclass=TableMeta):
 
         return "\n".join(statements)
 
+    @classmethod
+    def is_partitioned(cls):
+        return cls.__partition_by__ is not None
+
+    @classmethod
+    def partition_name(cls, start):
+        """Returns the name of the partition holding the period starting at ``start``."""
+        fmt = _PARTITION_INTERVALS[cls.__partition_interval__]
+        return "%s_p%s" % (cls.__tablename__, start.strftime(fmt))
+
+    @classmethod
+    def _create_partitions(cls, *, now=None, ahead=None):
+        interval = cls.__partition_interval__
+        ahead = cls.__partitions_ahead__ if ahead is None else ahead
+        start = _truncate_period(now or datetime.datetime.utcnow(), interval)
+
+        # the default partition catches anything that falls outside
+        # the partitions we've made, so inserts never fail
+        fmt = "CREATE TABLE IF NOT EXISTS {0}_default PARTITION OF {0} DEFAULT;"
+        statements = [fmt.format(cls.__tablename__)]
+
+        fmt = "CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} FOR VALUES FROM ('{2}') TO ('{3}');"
+        for _ in range(ahead + 1):
+            end = _next_period(start, interval)
+            statements.append(
+                fmt.format(cls.partition_name(start), cls.__tablename__, start, end)
+            )
+            start = end
+
+        return statements
+
+    @classmethod
+    async def create_partitions(cls, *, ahead=None, verbose=False, connection=None):
+        """Creates the partition for the current period and the ones after it.
+
+        Parameters
+        -----------
+        ahead: Optional[int]
+            How many future partitions to create. Defaults to the
+            table's ``partitions_ahead`` option.
+        verbose: bool
+            Whether to output some information to stdout.
+        connection: Optional[asyncpg.Connection]
+            The connection to use, if not provided will acquire one from
+            the internal pool.
+        """
+
+        if not cls.is_partitioned():
+            raise RuntimeError("%s is not a partitioned table." % cls.__tablename__)
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            sql = "\n".join(cls._create_partitions(ahead=ahead))
+            if verbose:
+                print(sql)
+            await con.execute(sql)
+
+    @classmethod
+    async def drop_partitions(cls, older_than, *, verbose=False, connection=None):
+        """Drops every partition whose entire range is older than ``older_than``.
+
+        This is much cheaper than running a ``DELETE`` on the table.
+
+        Parameters
+        -----------
+        older_than: datetime.timedelta
+            How long to keep data around for.
+        verbose: bool
+            Whether to output some information to stdout.
+        connection: Optional[asyncpg.Connection]
+            The connection to use, if not provided will acquire one from
+            the internal pool.
+
+        Returns
+        --------
+        List[str]
+            The names of the partitions that were dropped.
+        """
+
+        if not cls.is_partitioned():
+            raise RuntimeError("%s is not a partitioned table." % cls.__tablename__)
+
+        interval = cls.__partition_interval__
+        cutoff = datetime.datetime.utcnow() - older_than
+        prefix = "%s_p" % cls.__tablename__
+
+        query = """SELECT child.relname
+                   FROM pg_inherits
+                   JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                   JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                   WHERE parent.relname = $1;
+                """
+
+        dropped = []
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            for (name,) in await con.fetch(query, cls.__tablename__):
+                if not name.startswith(prefix):
+                    continue
+
+                try:
+                    start = datetime.datetime.strptime(
+                        name[len(prefix):], _PARTITION_INTERVALS[interval]
+                    )
+                except ValueError:
+                    continue
+
+                if _next_period(start, interval) > cutoff:
+                    continue
+
+                sql = "DROP TABLE IF EXISTS %s;" % name
+                if verbose:
+                    print(sql)
+                await con.execute(sql)
+                dropped.append(name)
+
+        return dropped
+
+    @classmethod
+    async def repair(cls, *, verbose=False, connection=None):
+        """Applies changes to an existing table that migrations can't express.
+
+        :meth:`create_table` only runs for new tables, so tables that add
+        things like unique indexes later override this to build them on
+        databases that already exist. This should be run in a transaction.
+
+        Returns
+        --------
+        bool
+            ``True`` if anything was changed, ``False`` if
+            there was nothing to do.
+        """
+
+        return False
+
+    @classmethod
+    async def convert_to_partitioned(cls, *, verbose=False, connection=None):
+        """Converts an existing unpartitioned table into a partitioned one.
+
+        PostgreSQL can't do this in place, so the old table is renamed,
+        its rows are copied into the new partitioned table, and then
+        the old table is dropped. This should be run in a transaction.
+
+        Returns
+        --------
+        bool
+            ``True`` if the table was converted, ``False`` if
+            there was nothing to do.
+        """
+
+        if not cls.is_partitioned():
+            raise RuntimeError("%s is not a partitioned table." % cls.__tablename__)
+
+        name = cls.__tablename__
+        old_name = "%s_unpartitioned" % name
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            kind = await con.fetchval("SELECT relkind FROM pg_class WHERE relname=$1;", name)
+            if kind != "r":
+                return False
+
+            statements = ["ALTER TABLE %s RENAME TO %s;" % (name, old_name)]
+
+            # the old indexes would clash with the new ones
+            query = "SELECT indexname FROM pg_indexes WHERE tablename=$1;"
+            for (index,) in await con.fetch(query, name):
+                statements.append("ALTER INDEX %s RENAME TO %s_old;" % (index, index))
+
+            statements.append(cls.create_table(exists_ok=True))
+
+            # make sure every row from the old table has somewhere to go
+            column = cls.__partition_by__
+            oldest = await con.fetchval("SELECT MIN(%s) FROM %s;" % (column, name))
+            if oldest is not None:
+                interval = cls.__partition_interval__
+                start = _truncate_period(oldest, interval)
+                now = datetime.datetime.utcnow()
+                ahead = 0
+                while start <= now:
+                    start = _next_period(start, interval)
+                    ahead += 1
+
+                statements.extend(cls._create_partitions(now=oldest, ahead=ahead))
+
+            columns = ", ".join(c.name for c in cls.columns)
+            statements.append(
+                "INSERT INTO %s (%s) SELECT %s FROM %s;" % (name, columns, columns, old_name)
+            )
+            statements.append("DROP TABLE %s CASCADE;" % old_name)
+
+            # keep the serial columns counting from where they were
+            for col in cls.columns:
+                if isinstance(col.column_type, Integer) and col.column_type.auto_increment:
+                    fmt = "SELECT setval(pg_get_serial_sequence('{0}', '{1}'), COALESCE(MAX({1}), 1)) FROM {0};"
+                    statements.append(fmt.format(name, col.name))
+
+            sql = "\n".join(statements)
+            if verbose:
+                print(sql)
+            await con.execute(sql)
+
+        return True
+
     @classmethod
     async def insert(cls, connection=None, **kwargs):
         """Inserts an element to the table."""
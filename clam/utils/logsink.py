@@ -0,0 +1,132 @@
+import logging
+from collections import Counter
+
+import discord
+
+
+log = logging.getLogger("clam.logsink")
+
+
+# Discord's limits for a single message
+EMBEDS_PER_MESSAGE = 10
+EMBED_CHARACTERS_PER_MESSAGE = 6000
+
+
+def chunk_embeds(embeds):
+    """Splits embeds into groups that fit in a single message."""
+
+    chunk = []
+    size = 0
+
+    for embed in embeds:
+        length = len(embed)
+        if chunk and (len(chunk) == EMBEDS_PER_MESSAGE or size + length > EMBED_CHARACTERS_PER_MESSAGE):
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append(embed)
+        size += length
+
+    if chunk:
+        yield chunk
+
+
+class LogSink:
+    """Buffers log embeds for a guild and sends them in batches.
+
+    Embeds are sent up to 10 per message, through the log webhook if the
+    guild has one set. If more than ``overflow`` embeds pile up between
+    flushes, only the first ones are sent and the rest are summarized.
+
+    Parameters
+    -----------
+    bot: :class:`clam.bot.Clam`
+        The bot.
+    guild_id: int
+        The guild this sink sends logs for.
+    overflow: int
+        How many embeds can be sent per flush before summarizing.
+    """
+
+    def __init__(self, bot, guild_id, *, overflow=30):
+        self.bot = bot
+        self.guild_id = guild_id
+        self.overflow = overflow
+
+        self.sent = 0
+        self.summarized = 0
+
+        self._pending = []
+        self._webhook = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, embed):
+        self._pending.append(embed)
+
+    def summary_embed(self, embeds):
+        counts = Counter(e.title or "Untitled" for e in embeds)
+
+        em = discord.Embed(
+            title="\N{WARNING SIGN} Log Overflow",
+            description=(
+                f"{len(embeds)} more log entries came in too fast to send. "
+                "Check the server's audit log for details."
+            ),
+            color=discord.Color.orange(),
+        )
+
+        lines = [f"{count}x {title}" for title, count in counts.most_common(10)]
+        if len(counts) > 10:
+            lines.append(f"...and {len(counts) - 10} more kinds")
+
+        em.add_field(name="Skipped Entries", value="\n".join(lines)[:1024], inline=False)
+        return em
+
+    def get_webhook(self, url):
+        if self._webhook is None or self._webhook.url != url:
+            self._webhook = discord.Webhook.from_url(url, session=self.bot.session)
+        return self._webhook
+
+    async def send(self, guild_log, embeds):
+        if guild_log.webhook_url:
+            webhook = self.get_webhook(guild_log.webhook_url)
+            try:
+                await webhook.send(
+                    embeds=embeds,
+                    username=self.bot.user.name,
+                    avatar_url=self.bot.user.display_avatar.url,
+                )
+                return
+
+            except discord.NotFound:
+                log.info("Log webhook for guild %s was deleted, falling back to the channel", self.guild_id)
+
+        await guild_log.channel.send(embeds=embeds)
+
+    async def flush(self, guild_log):
+        """Sends everything that's pending to the guild's log."""
+
+        if not self._pending:
+            return
+
+        embeds, self._pending = self._pending, []
+
+        if not guild_log or not guild_log.channel:
+            return
+
+        if len(embeds) > self.overflow:
+            skipped = embeds[self.overflow - 1:]
+            embeds = embeds[:self.overflow - 1]
+            embeds.append(self.summary_embed(skipped))
+            self.summarized += len(skipped)
+
+        for chunk in chunk_embeds(embeds):
+            try:
+                await self.send(guild_log, chunk)
+                self.sent += len(chunk)
+
+            except discord.HTTPException as e:
+                log.info("Failed to send %s log embeds in guild %s: %s", len(chunk), self.guild_id, e)
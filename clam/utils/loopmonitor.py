@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+# used to figure out which frame in a stack is ours
+_PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BlockingEvent:
+    """A single time the event loop was blocked for longer than the threshold."""
+
+    __slots__ = ("occurred_at", "duration", "task", "location", "stack")
+
+    def __init__(self, occurred_at, duration, task, location, stack):
+        self.occurred_at = occurred_at
+        self.duration = duration
+        self.task = task
+        self.location = location
+        self.stack = stack
+
+    def format_stack(self):
+        return "".join(traceback.format_list(self.stack))
+
+
+class Offender:
+    """Aggregated blocking stats for a single task and location."""
+
+    __slots__ = ("task", "location", "count", "total", "worst")
+
+    def __init__(self, task, location):
+        self.task = task
+        self.location = location
+        self.count = 0
+        self.total = 0.0
+        self.worst = None
+
+    def add(self, event):
+        self.count += 1
+        self.total += event.duration
+        if self.worst is None or event.duration > self.worst.duration:
+            self.worst = event
+
+
+class _Stall:
+    __slots__ = ("beat", "stack", "task")
+
+    def __init__(self, beat, stack, task):
+        self.beat = beat
+        self.stack = stack
+        self.task = task
+
+
+class LoopMonitor:
+    """Samples event loop lag and records what was blocking the loop.
+
+    A heartbeat task wakes up every ``interval`` seconds and measures how
+    late it was. A watchdog thread watches the heartbeat, and if it goes
+    quiet for longer than ``threshold`` seconds, grabs the loop thread's
+    current stack. This works with both asyncio and uvloop, and costs
+    nothing per callback.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop to watch. :meth:`start` must be called from its thread.
+    interval: float
+        How often the heartbeat runs, in seconds.
+    threshold: float
+        How long the loop has to be blocked before it's recorded, in seconds.
+    history: int
+        How many recent blocking events to keep.
+    max_offenders: int
+        How many distinct offenders to keep stats for.
+    """
+
+    def __init__(self, loop, *, interval=0.05, threshold=0.1, history=50, max_offenders=100):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.total_events = 0
+        self.events = collections.deque(maxlen=history)
+        self.offenders = {}
+
+        self._beat = time.perf_counter()
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._beat = time.perf_counter()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="clam-loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.max_lag = 0.0
+        self.total_events = 0
+        self.events.clear()
+        self.offenders.clear()
+
+    def worst_offenders(self, limit=10):
+        return sorted(self.offenders.values(), key=lambda o: o.total, reverse=True)[:limit]
+
+    async def _heartbeat(self):
+        while True:
+            start = time.perf_counter()
+            self._beat = start
+            await asyncio.sleep(self.interval)
+
+            now = time.perf_counter()
+            self._beat = now
+            self.lag = max(0.0, now - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+
+            with self._lock:
+                stall, self._pending = self._pending, None
+
+            if stall is not None:
+                self._record(stall, self.lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            if time.perf_counter() - beat - self.interval < self.threshold:
+                continue
+
+            with self._lock:
+                # we already have a sample for this stall
+                if self._pending is not None and self._pending.beat == beat:
+                    continue
+
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+
+                stack = traceback.extract_stack(frame)
+                del frame
+                self._pending = _Stall(beat, stack, self._current_task())
+
+    def _current_task(self):
+        # reading this from another thread is racy, but it's only informational
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+        if current_tasks is None:
+            return None
+
+        task = current_tasks.get(self.loop)
+        if task is None:
+            return None
+
+        coro = task.get_coro()
+        qualname = getattr(coro, "__qualname__", None) or repr(coro)
+        return f"{task.get_name()} ({qualname})"
+
+    @staticmethod
+    def _find_location(stack):
+        # prefer the innermost frame that's in our own code
+        for frame in reversed(stack):
+            if frame.filename.startswith(_PACKAGE_DIRECTORY) and not frame.filename.endswith(
+                "loopmonitor.py"
+            ):
+                break
+        else:
+            frame = stack[-1]
+
+        filename = os.path.relpath(frame.filename, os.path.dirname(_PACKAGE_DIRECTORY))
+        return f"{filename}:{frame.lineno} in {frame.name}"
+
+    def _record(self, stall, duration):
+        if not stall.stack:
+            return
+
+        location = self._find_location(stall.stack)
+        event = BlockingEvent(time.time(), duration, stall.task, location, stall.stack)
+        self.events.append(event)
+        self.total_events += 1
+
+        key = (stall.task, location)
+        try:
+            offender = self.offenders[key]
+        except KeyError:
+            if len(self.offenders) >= self.max_offenders:
+                # make room by forgetting the least harmful offender
+                least = min(self.offenders, key=lambda k: self.offenders[k].total)
+                del self.offenders[least]
+            offender = self.offenders[key] = Offender(stall.task, location)
+
+        offender.add(event)
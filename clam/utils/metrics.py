@@ -0,0 +1,216 @@
+"""A tiny Prometheus-style metrics registry and exporter.
+
+This deliberately doesn't depend on prometheus_client.
+It only implements the text exposition format, which is all we need.
+"""
+
+import logging
+
+from aiohttp import web
+
+
+log = logging.getLogger("clam.metrics")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    inner = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def clear(self):
+        self._values.clear()
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name, documentation, labelnames=(), *, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def set(self, value, **labels):
+        raise TypeError("Cannot set a histogram, use observe instead.")
+
+    def inc(self, amount=1, **labels):
+        raise TypeError("Cannot increment a histogram, use observe instead.")
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        try:
+            counts, total = self._values[key]
+        except KeyError:
+            counts, total = [0] * len(self.buckets), 0.0
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+
+        self._values[key] = (counts, total + value)
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative
+
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """Holds every metric and the collectors that update them on scrape.
+
+    Collectors are plain callables that are run right before rendering.
+    They're meant for values that are cheaper to read on demand than to
+    keep updated, like queue sizes.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+        self._exports = {}
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        try:
+            metric = self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        else:
+            if not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.type}")
+
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), **kwargs):
+        return self._get_or_create(Histogram, name, documentation, labelnames, **kwargs)
+
+    def add_collector(self, name, collector):
+        self._collectors[name] = collector
+
+    def remove_collector(self, name):
+        self._collectors.pop(name, None)
+
+    def add_export(self, name, callback):
+        """Adds a JSON export, served at ``/<name>.json``."""
+        self._exports[name] = callback
+
+    def remove_export(self, name):
+        self._exports.pop(name, None)
+
+    def get_export(self, name):
+        return self._exports.get(name)
+
+    def collect(self):
+        for name, collector in list(self._collectors.items()):
+            try:
+                collector()
+            except Exception:
+                log.exception("Metrics collector %s failed", name)
+
+    def render(self):
+        self.collect()
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+class MetricsServer:
+    """Serves a registry over HTTP for Prometheus to scrape."""
+
+    def __init__(self, registry, *, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self.handle_metrics)
+        self.app.router.add_get("/{name}.json", self.handle_export)
+
+    async def handle_metrics(self, request):
+        body = self.registry.render()
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+    async def handle_export(self, request):
+        callback = self.registry.get_export(request.match_info["name"])
+        if callback is None:
+            raise web.HTTPNotFound()
+
+        return web.json_response(callback())
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        log.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,228 @@
+import datetime
+import logging
+import os
+
+
+log = logging.getLogger("clam.music.cache")
+
+
+class CachedFile:
+    __slots__ = ("extractor", "song_id", "path", "size", "last_played", "plays")
+
+    def __init__(self, extractor, song_id, path, size, *, last_played=None, plays=0):
+        self.extractor = extractor
+        self.song_id = song_id
+        self.path = path
+        self.size = size
+        self.last_played = last_played
+        self.plays = plays
+
+    def __repr__(self):
+        return f"<CachedFile path='{self.path}' size={self.size} plays={self.plays}>"
+
+    @property
+    def key(self):
+        return self.extractor, self.song_id
+
+
+class MusicCache:
+    """An index of the downloaded songs in the music cache folder.
+
+    Files are indexed by ``(extractor, id)``, so checking whether a song
+    is downloaded never touches the disk. The index is kept in least
+    recently played order, which makes LRU eviction O(1).
+
+    When ``max_size`` is set, :meth:`evict` removes files until the cache
+    fits. The ``lru`` policy drops the least recently played songs first,
+    and ``lfu`` drops the least played songs first.
+
+    Parameters
+    -----------
+    directory: str
+        The cache folder. youtube_dl saves files here as ``extractor-id.ext``.
+    max_size: Optional[int]
+        The most bytes the cache can hold, or ``None`` for no limit.
+    policy: str
+        Either ``lru`` or ``lfu``.
+    """
+
+    POLICIES = ("lru", "lfu")
+
+    def __init__(self, directory="cache", *, max_size=None, policy="lru"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}'")
+
+        self.directory = directory
+        self.max_size = max_size
+        self.policy = policy
+
+        self.size = 0
+        self.evictions = 0
+
+        # (extractor, id): CachedFile, least recently played first
+        self._files = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key):
+        return key in self._files
+
+    def __iter__(self):
+        return iter(self._files.values())
+
+    @staticmethod
+    def parse_filename(filename):
+        """Returns the ``(extractor, id)`` a cache filename belongs to.
+
+        IDs can contain dashes but extractor names don't, so only split once.
+        """
+
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        extractor, sep, song_id = stem.partition("-")
+        if not sep:
+            return None
+        return extractor, song_id
+
+    def get(self, extractor, song_id):
+        return self._files.get((extractor, song_id))
+
+    def _insert(self, file):
+        old = self._files.pop(file.key, None)
+        if old:
+            self.size -= old.size
+
+        self._files[file.key] = file
+        self.size += file.size
+
+    def load(self, records):
+        """Builds the index from song records and the files on disk.
+
+        Files the records already know the size of aren't stat'd again.
+        This blocks, so run it in an executor.
+
+        Parameters
+        -----------
+        records: List[Mapping]
+            Rows with ``extractor``, ``song_id``, ``filename`` and ``plays``,
+            and optionally ``file_size`` and ``last_played``.
+        """
+
+        known = {}
+        for record in records:
+            known[os.path.basename(record["filename"] or "")] = record
+
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                key = self.parse_filename(entry.name)
+                if not key or not entry.is_file():
+                    continue
+
+                path = os.path.join(self.directory, entry.name)
+                record = known.get(entry.name)
+
+                if record and record.get("file_size") is not None:
+                    size = record["file_size"]
+                else:
+                    size = entry.stat().st_size
+
+                if record:
+                    file = CachedFile(
+                        *key, path, size, last_played=record.get("last_played"), plays=record["plays"] or 0
+                    )
+                else:
+                    file = CachedFile(*key, path, size)
+
+                files.append(file)
+
+        # songs that have never been played go first
+        files.sort(key=lambda f: f.last_played or datetime.datetime.min)
+
+        self._files.clear()
+        self.size = 0
+        for file in files:
+            self._insert(file)
+
+        log.info("Indexed %s cached songs (%s bytes)", len(self._files), self.size)
+
+    def add(self, path):
+        """Registers a file that was just downloaded and returns it.
+
+        This stats the file, so it blocks.
+        """
+
+        key = self.parse_filename(path)
+        if not key:
+            return None
+
+        old = self._files.get(key)
+        file = CachedFile(*key, path, os.path.getsize(path))
+        if old:
+            file.plays = old.plays
+            file.last_played = old.last_played
+
+        self._insert(file)
+        return file
+
+    def touch(self, extractor, song_id):
+        """Marks a song as just played."""
+
+        file = self._files.pop((extractor, song_id), None)
+        if file is None:
+            return None
+
+        file.plays += 1
+        file.last_played = datetime.datetime.utcnow()
+        self._files[file.key] = file
+        return file
+
+    def discard(self, extractor, song_id):
+        """Removes a song from the index without deleting its file."""
+
+        file = self._files.pop((extractor, song_id), None)
+        if file:
+            self.size -= file.size
+        return file
+
+    def _victims(self):
+        if self.policy == "lru":
+            return iter(list(self._files.values()))
+
+        return iter(sorted(self._files.values(), key=lambda f: (f.plays, f.last_played or datetime.datetime.min)))
+
+    def evict(self, *, protected=()):
+        """Drops files from the index until the cache fits in ``max_size``.
+
+        Returns the files that were dropped. Deleting them is up to the caller.
+
+        Parameters
+        -----------
+        protected: Container[Tuple[str, str]]
+            Keys that can't be evicted, such as songs that are queued.
+        """
+
+        if self.max_size is None or self.size <= self.max_size:
+            return []
+
+        evicted = []
+        for file in self._victims():
+            if self.size <= self.max_size:
+                break
+
+            if file.key in protected:
+                continue
+
+            self.discard(*file.key)
+            evicted.append(file)
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def clear(self):
+        """Empties the index and returns every file that was in it."""
+
+        files = list(self._files.values())
+        self._files.clear()
+        self.size = 0
+        return files
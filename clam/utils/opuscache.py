@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+
+
+log = logging.getLogger("clam.music.opus")
+
+
+class OpusCache:
+    """Pre-encoded Ogg Opus copies of songs in the music cache.
+
+    Playing a song normally decodes it to PCM with FFmpeg, then encodes
+    it back to Opus for Discord on every play. A song with an Opus copy
+    can be sent as-is by :class:`discord.FFmpegOpusAudio` with the codec
+    copied, which skips both steps.
+
+    Copies are named like the songs they belong to, and are deleted
+    along with them. Since the copy can't be turned down when it's sent,
+    it's encoded at the volume most songs are played at.
+
+    Parameters
+    -----------
+    directory: str
+        Where to keep the copies.
+    bitrate: int
+        The bitrate to encode at, in kbps.
+    gain: float
+        The volume to encode at, where 1.0 is the original loudness.
+    concurrency: int
+        How many songs can be encoded at once.
+    """
+
+    def __init__(self, directory="cache/opus", *, bitrate=128, gain=1.0, concurrency=2):
+        self.directory = directory
+        self.bitrate = bitrate
+        self.gain = gain
+
+        self.size = 0
+        self.encoded = 0
+        self.failed = 0
+
+        # (extractor, id): size
+        self._files = {}
+        self._tasks = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key):
+        return key in self._files
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    def path_for(self, extractor, song_id):
+        return os.path.join(self.directory, f"{extractor}-{song_id}.opus")
+
+    def get(self, extractor, song_id):
+        """Returns the path to a song's Opus copy if it has one."""
+
+        if (extractor, song_id) in self._files:
+            return self.path_for(extractor, song_id)
+        return None
+
+    def load(self):
+        """Indexes the copies on disk. This blocks, so run it in an executor."""
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._files.clear()
+        self.size = 0
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                extractor, sep, song_id = stem.partition("-")
+                if ext != ".opus" or not sep or not entry.is_file():
+                    continue
+
+                size = entry.stat().st_size
+                self._files[(extractor, song_id)] = size
+                self.size += size
+
+        log.info("Indexed %s Opus copies (%s bytes)", len(self._files), self.size)
+
+    def encode(self, source, extractor, song_id):
+        """Starts encoding an Opus copy of a song in the background.
+
+        Does nothing if the song already has a copy or is being encoded.
+        """
+
+        key = (extractor, song_id)
+        if key in self._files or key in self._tasks:
+            return
+
+        self._tasks[key] = asyncio.create_task(self._encode(source, key))
+
+    async def _encode(self, source, key):
+        path = self.path_for(*key)
+        temp = path + ".part"
+
+        args = (
+            "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+            "-i", source,
+            "-vn", "-map_metadata", "-1", "-af", f"volume={self.gain}",
+            "-c:a", "libopus", "-b:a", f"{self.bitrate}k", "-ar", "48000", "-ac", "2",
+            "-f", "ogg", temp,
+        )
+
+        process = None
+        try:
+            async with self._semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await process.communicate()
+
+            if process.returncode != 0:
+                self.failed += 1
+                log.warning("Couldn't encode '%s' to Opus: %s", source, stderr.decode(errors="replace").strip())
+                self._remove(temp)
+                return
+
+            os.replace(temp, path)
+            size = os.path.getsize(path)
+
+        except asyncio.CancelledError:
+            # cancelling communicate() leaves FFmpeg running, and it would keep writing the file
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+
+            self._remove(temp)
+            raise
+
+        except OSError as e:
+            self.failed += 1
+            log.warning("Couldn't encode '%s' to Opus: %s", source, e)
+            self._remove(temp)
+            return
+
+        finally:
+            self._tasks.pop(key, None)
+
+        self._files[key] = size
+        self.size += size
+        self.encoded += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def discard(self, extractor, song_id):
+        """Removes a song's copy from the index and returns its path, if it had one.
+
+        Deleting the file is up to the caller.
+        """
+
+        key = (extractor, song_id)
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+        size = self._files.pop(key, None)
+        if size is None:
+            return None
+
+        self.size -= size
+        return self.path_for(extractor, song_id)
+
+    def clear(self):
+        """Empties the index and returns the path of every copy that was in it."""
+
+        paths = [self.path_for(*key) for key in self._files]
+        self.close()
+        self._files.clear()
+        self.size = 0
+        return paths
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+        self._tasks.clear()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+
+import discord
+
+
+log = logging.getLogger("clam.overwrites")
+
+
+class OverwriteResult:
+    """The outcome of an :class:`OverwriteUpdater` run."""
+
+    __slots__ = ("changed", "unchanged", "failed")
+
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        # (channel, exception) pairs
+        self.failed = []
+
+    @property
+    def attempted(self):
+        return len(self.changed) + len(self.failed)
+
+    @property
+    def total(self):
+        return self.attempted + len(self.unchanged)
+
+
+class OverwriteUpdater:
+    """Applies one permission overwrite for a role or member across a guild.
+
+    Only channels whose overwrite for the target differs are edited.
+    Each edit only touches the target's overwrite instead of re-sending
+    every overwrite on the channel.
+
+    Discord doesn't push a category's overwrites down to its channels, so
+    categories are updated first. Channels synced with a category are then
+    edited to the same overwrite, so they stay synced.
+
+    Parameters
+    -----------
+    guild: :class:`discord.Guild`
+        The guild to update.
+    target: Union[:class:`discord.Role`, :class:`discord.Member`]
+        Who the overwrite is for.
+    overwrite: :class:`discord.PermissionOverwrite`
+        The overwrite every channel should have.
+    reason: Optional[str]
+        The audit log reason.
+    concurrency: int
+        How many edits can be in flight at once.
+    retries: int
+        How many times to retry an edit that failed with a server error.
+    """
+
+    def __init__(self, guild, target, overwrite, *, reason=None, concurrency=4, retries=3):
+        self.guild = guild
+        self.target = target
+        self.overwrite = overwrite
+        self.reason = reason
+        self.retries = retries
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def plan(self):
+        """Returns the categories and channels that need changing, and the ones that don't."""
+
+        categories = []
+        channels = []
+        unchanged = []
+
+        for channel in self.guild.channels:
+            if channel.overwrites_for(self.target) == self.overwrite:
+                unchanged.append(channel)
+
+            elif isinstance(channel, discord.CategoryChannel):
+                categories.append(channel)
+
+            else:
+                channels.append(channel)
+
+        return categories, channels, unchanged
+
+    async def _apply(self, channel):
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    await channel.set_permissions(
+                        self.target, overwrite=self.overwrite, reason=self.reason
+                    )
+                    return
+
+                except discord.DiscordServerError:
+                    if attempt == self.retries:
+                        raise
+
+                    log.info(
+                        "Server error editing overwrites in channel %s, retrying (%s/%s)",
+                        channel.id,
+                        attempt + 1,
+                        self.retries,
+                    )
+                    await asyncio.sleep(2 ** attempt)
+
+    async def _apply_all(self, channels, result):
+        results = await asyncio.gather(
+            *(self._apply(channel) for channel in channels), return_exceptions=True
+        )
+
+        for channel, error in zip(channels, results):
+            if error is None:
+                result.changed.append(channel)
+
+            elif isinstance(error, discord.HTTPException):
+                result.failed.append((channel, error))
+
+            else:
+                raise error
+
+    async def run(self):
+        """Applies the overwrite and returns an :class:`OverwriteResult`."""
+
+        result = OverwriteResult()
+        categories, channels, result.unchanged = self.plan()
+
+        await self._apply_all(categories, result)
+        await self._apply_all(channels, result)
+
+        return result
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+import traceback
+
+import discord
+
+
+log = logging.getLogger("clam.pipeline")
+
+
+class MessageFacts:
+    """Things about a message that more than one stage wants to know.
+
+    Everything is worked out lazily and at most once per message.
+    """
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+        self.content = message.content
+        self.is_bot = message.author.bot
+        self.is_dm = message.guild is None
+
+        self._lowered = None
+        self._words = None
+        self._role_ids = None
+        self._settings = None
+        self._ignored = None
+
+    @property
+    def lowered(self):
+        if self._lowered is None:
+            self._lowered = self.content.lower()
+        return self._lowered
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._words = self.lowered.split()
+        return self._words
+
+    @property
+    def role_ids(self):
+        """The IDs of the author's roles, excluding @everyone."""
+
+        if self._role_ids is None:
+            if isinstance(self.author, discord.Member):
+                # Member.roles sorts and resolves every role, we only need the IDs
+                self._role_ids = frozenset(self.author._roles)
+            else:
+                self._role_ids = frozenset()
+        return self._role_ids
+
+    async def _fetch_settings(self):
+        moderation = self.bot.get_cog("Moderation")
+        if moderation is None or self.guild is None:
+            return None
+
+        return await moderation.get_guild_settings(self.guild.id)
+
+    async def get_settings(self):
+        """Returns the moderation settings for the message's guild, if any."""
+
+        # stages can run at the same time, so they share one fetch
+        if self._settings is None:
+            self._settings = asyncio.ensure_future(self._fetch_settings())
+
+        return await asyncio.shield(self._settings)
+
+    async def is_ignored(self):
+        """Whether the guild's moderation settings ignore this message's channel, author or roles."""
+
+        if self._ignored is None:
+            settings = await self.get_settings()
+            self._ignored = (
+                settings is not None
+                and isinstance(self.author, discord.Member)
+                and settings.is_automod_ignored(self.channel.id, self.author.id, self.role_ids)
+            )
+
+        return self._ignored
+
+
+class Stage:
+    __slots__ = ("name", "callback", "guilds", "dms", "bots", "background", "calls", "errors", "total", "worst")
+
+    def __init__(self, name, callback, *, guilds, dms, bots, background):
+        self.name = name
+        self.callback = callback
+        self.guilds = guilds
+        self.dms = dms
+        self.bots = bots
+        self.background = background
+
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def should_run(self, facts):
+        if facts.is_bot and not self.bots:
+            return False
+
+        return self.dms if facts.is_dm else self.guilds
+
+    @property
+    def average(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+
+class MessagePipeline:
+    """Runs every registered message stage from a single on_message listener.
+
+    Stages are coroutines that take the message and its :class:`MessageFacts`.
+    They run one after the other in the order they were added. Stages that
+    wait on the network, like enforcement, should be added with
+    ``background=True`` so they run in their own task and don't hold up
+    the stages after them.
+
+    An exception in one stage is logged and doesn't stop the rest.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.stages = {}
+        self.messages = 0
+        self._tasks = set()
+        self._timings = bot.metrics.histogram(
+            "clam_message_stage_seconds",
+            "Time taken by each on_message pipeline stage.",
+            ("stage",),
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+        )
+
+    def add_stage(self, name, callback, *, guilds=True, dms=True, bots=True, background=False):
+        """Registers a stage.
+
+        Parameters
+        -----------
+        name: str
+            A unique name for the stage, used in stats.
+        callback: coroutine
+            Called with ``(message, facts)``.
+        guilds: bool
+            Whether the stage runs for guild messages.
+        dms: bool
+            Whether the stage runs for DMs.
+        bots: bool
+            Whether the stage runs for messages sent by bots.
+        background: bool
+            Whether the stage runs in its own task instead of being waited on.
+        """
+
+        self.stages[name] = Stage(name, callback, guilds=guilds, dms=dms, bots=bots, background=background)
+
+    def remove_stage(self, name):
+        self.stages.pop(name, None)
+
+    def reset(self):
+        self.messages = 0
+        for stage in self.stages.values():
+            stage.reset()
+
+    async def run_stage(self, stage, message, facts):
+        start = time.perf_counter()
+        try:
+            await stage.callback(message, facts)
+        except Exception:
+            stage.errors += 1
+            log.error(
+                "Message stage %s failed for message %s\n%s",
+                stage.name,
+                message.id,
+                traceback.format_exc(),
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            stage.calls += 1
+            stage.total += elapsed
+            stage.worst = max(stage.worst, elapsed)
+            self._timings.observe(elapsed, stage=stage.name)
+
+    async def process(self, message):
+        self.messages += 1
+        facts = MessageFacts(self.bot, message)
+
+        for stage in list(self.stages.values()):
+            if not stage.should_run(facts):
+                continue
+
+            if stage.background:
+                task = asyncio.create_task(self.run_stage(stage, message, facts))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                await self.run_stage(stage, message, facts)
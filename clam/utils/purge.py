@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+from collections import Counter
+
+import discord
+
+
+# Discord won't bulk delete messages older than this
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14)
+
+# Messages per bulk delete request
+BULK_DELETE_LIMIT = 100
+
+
+def compile_predicate(predicates, *, require_all=True, negate=False):
+    """Combines a list of predicates into a single check.
+
+    This is equivalent to ``all(p(m) for p in predicates)`` (or ``any``),
+    optionally negated, without building a generator for every message.
+    """
+
+    predicates = tuple(predicates)
+
+    if require_all:
+        def check(message):
+            for predicate in predicates:
+                if not predicate(message):
+                    return negate
+            return not negate
+
+    else:
+        def check(message):
+            for predicate in predicates:
+                if predicate(message):
+                    return not negate
+            return negate
+
+    return check
+
+
+class PurgeEngine:
+    """Deletes messages from a channel while streaming through its history.
+
+    Matching messages are bulk deleted in chunks of 100 while the history is
+    still being paged, with a few chunks in flight at once. Messages too old
+    to be bulk deleted are deleted one at a time in the background.
+
+    Parameters
+    -----------
+    channel: :class:`discord.abc.Messageable`
+        The channel to purge.
+    limit: int
+        How many messages to search through.
+    check: Callable[[:class:`discord.Message`], bool]
+        Whether a message should be deleted.
+    before: Optional[:class:`discord.abc.Snowflake`]
+        Only search messages before this.
+    after: Optional[:class:`discord.abc.Snowflake`]
+        Only search messages after this.
+    concurrency: int
+        How many bulk deletes can be in flight at once.
+    """
+
+    def __init__(self, channel, *, limit, check, before=None, after=None, concurrency=2):
+        self.channel = channel
+        self.limit = limit
+        self.check = check
+        self.before = before
+        self.after = after
+
+        self.scanned = 0
+        self.old = 0
+
+        # author display name: deleted messages
+        self.deleted = Counter()
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = []
+        self._old_queue = None
+        self._progress = None
+
+    @property
+    def total_deleted(self):
+        return sum(self.deleted.values())
+
+    def _record(self, messages):
+        self.deleted.update(m.author.display_name for m in messages)
+        self._update_progress()
+
+    def _update_progress(self):
+        progress = self._progress
+        if progress is None:
+            return
+
+        searched = f"Searched {self.scanned:,}/{self.limit:,} messages"
+        deleted = f"Deleted {self.total_deleted:,} messages"
+        if self.old:
+            deleted += f" ({self.old:,} too old to bulk delete)"
+
+        progress.change_label(0, text=searched)
+        progress.change_label(1, text=deleted)
+
+    async def _bulk_delete(self, messages):
+        async with self._semaphore:
+            if len(messages) == 1:
+                try:
+                    await messages[0].delete()
+                except discord.NotFound:
+                    return
+            else:
+                await self.channel.delete_messages(messages)
+
+        self._record(messages)
+
+    async def _delete_old(self):
+        # single deletes have a much stricter rate limit, so only one runs at a time
+        queue = self._old_queue
+        while True:
+            message = await queue.get()
+            if message is None:
+                return
+
+            try:
+                await message.delete()
+            except discord.NotFound:
+                continue
+
+            self._record([message])
+
+    def _queue_old(self, message):
+        if self._old_queue is None:
+            self._old_queue = asyncio.Queue()
+            self._tasks.append(asyncio.ensure_future(self._delete_old()))
+
+        self.old += 1
+        self._old_queue.put_nowait(message)
+
+    def _queue_chunk(self, chunk):
+        self._tasks.append(asyncio.ensure_future(self._bulk_delete(chunk)))
+
+    async def run(self, progress=None):
+        """Runs the purge and returns a Counter of deleted messages per author.
+
+        If ``progress`` is a :class:`clam.utils.menus.UpdatingMessage`, its
+        first two labels are updated with how far along the purge is.
+        """
+
+        self._progress = progress
+
+        # a minute of leeway so messages don't age out while we page
+        minimum_time = discord.utils.utcnow() - BULK_DELETE_MAX_AGE + datetime.timedelta(minutes=1)
+        minimum_id = discord.utils.time_snowflake(minimum_time)
+
+        chunk = []
+        history = self.channel.history(limit=self.limit, before=self.before, after=self.after)
+
+        try:
+            async for message in history:
+                self.scanned += 1
+                if self.scanned % BULK_DELETE_LIMIT == 0:
+                    self._update_progress()
+
+                if not self.check(message):
+                    continue
+
+                if message.id < minimum_id:
+                    self._queue_old(message)
+                    continue
+
+                chunk.append(message)
+                if len(chunk) == BULK_DELETE_LIMIT:
+                    self._queue_chunk(chunk)
+                    chunk = []
+
+            if chunk:
+                self._queue_chunk(chunk)
+
+            if self._old_queue is not None:
+                self._old_queue.put_nowait(None)
+
+            await asyncio.gather(*self._tasks)
+
+        except BaseException:
+            for task in self._tasks:
+                task.cancel()
+            raise
+
+        finally:
+            self._update_progress()
+
+        return self.deleted
@@ -0,0 +1,138 @@
+import time
+from collections import Counter
+
+
+class _Series:
+    __slots__ = ("buckets", "last_index")
+
+    def __init__(self, size, index):
+        self.buckets = [0] * size
+        self.last_index = index
+
+    def advance(self, index):
+        """Zeroes out every bucket we skipped over since the last update."""
+        last = self.last_index
+        if index <= last:
+            return
+
+        size = len(self.buckets)
+        for i in range(last + 1, min(index, last + size) + 1):
+            self.buckets[i % size] = 0
+
+        self.last_index = index
+
+
+class TimeSeriesCounter:
+    """Counts events per key in fixed time windows.
+
+    Each key gets a ring buffer of ``size`` buckets that are each
+    ``resolution`` seconds wide, so the defaults keep per-minute
+    counts for the last 24 hours. Incrementing is O(1); stale buckets
+    are only cleared when a key is touched again.
+
+    Parameters
+    -----------
+    resolution: float
+        How many seconds each bucket covers.
+    size: int
+        How many buckets to keep around.
+    """
+
+    def __init__(self, *, resolution=60.0, size=1440):
+        self.resolution = resolution
+        self.size = size
+        self.totals = Counter()
+        self._series = {}
+        self._started_at = time.time()
+
+    def _index(self, now):
+        return int(now // self.resolution)
+
+    def increment(self, key, amount=1):
+        index = self._index(time.time())
+
+        try:
+            series = self._series[key]
+        except KeyError:
+            series = self._series[key] = _Series(self.size, index)
+        else:
+            series.advance(index)
+
+        series.buckets[index % self.size] += amount
+        self.totals[key] += amount
+
+    def keys(self):
+        return self._series.keys()
+
+    def _window(self, window):
+        # the amount of buckets covering the last `window` seconds,
+        # capped by how much data we actually have
+        buckets = max(1, int(-(-window // self.resolution)))
+        available = self._index(time.time()) - self._index(self._started_at) + 1
+        return min(buckets, self.size, available)
+
+    def _bounds(self, window):
+        index = self._index(time.time())
+        if window is None:
+            window = self.size * self.resolution
+        return index, self._window(window)
+
+    def series(self, key, *, window=None):
+        """Returns a list of ``(timestamp, count)`` tuples, oldest first.
+
+        ``window`` is how many seconds to go back. Defaults to everything.
+        """
+
+        index, count = self._bounds(window)
+
+        series = self._series.get(key)
+        if series is not None:
+            series.advance(index)
+
+        result = []
+        for i in range(index - count + 1, index + 1):
+            value = series.buckets[i % self.size] if series is not None else 0
+            result.append((i * self.resolution, value))
+
+        return result
+
+    def count(self, key=None, *, window):
+        """Returns how many events happened in the last ``window`` seconds.
+
+        If ``key`` is ``None``, every key is counted.
+        """
+
+        keys = self._series.keys() if key is None else (key,)
+        return sum(v for k in list(keys) for _, v in self.series(k, window=window))
+
+    def rate(self, key=None, *, window=60.0):
+        """Returns the average events per second over the last ``window`` seconds."""
+
+        now = time.time()
+        buckets = self._window(window)
+
+        # the current bucket is only partially filled
+        elapsed = (buckets - 1) * self.resolution + (now % self.resolution)
+        elapsed = min(elapsed, now - self._started_at)
+        if elapsed <= 0:
+            return 0.0
+
+        return self.count(key, window=window) / elapsed
+
+    def peak(self, key, *, window=None):
+        """Returns the ``(timestamp, count)`` of the busiest bucket."""
+
+        return max(self.series(key, window=window), key=lambda t: t[1], default=(None, 0))
+
+    def to_dict(self, *, window=None):
+        index, count = self._bounds(window)
+        return {
+            "resolution": self.resolution,
+            "started_at": self._started_at,
+            "series_start": (index - count + 1) * self.resolution,
+            "totals": {str(k): v for k, v in self.totals.items()},
+            "series": {
+                str(key): [count for _, count in self.series(key, window=window)]
+                for key in list(self._series)
+            },
+        }
@@ -0,0 +1,206 @@
+"""Fast multi-word matching for the forbidden words filter.
+
+Words are compiled into an Aho-Corasick automaton, so a message is
+scanned once no matter how many words are forbidden. Normalization
+(lowercasing, confusable folding and whitespace stripping) happens
+character by character during the scan.
+
+Repeated characters in the text aren't collapsed. A repeat of the
+character that led to a state can either be skipped or matched as usual,
+so the scan follows both, which keeps a handful of states at most. The
+words keep their own spelling, so ``ass`` still needs two s's to match.
+"""
+
+# characters that are commonly used to dodge filters
+_CONFUSABLES = {
+    # leetspeak
+    "0": "o",
+    "1": "i",
+    "!": "i",
+    "|": "i",
+    "3": "e",
+    "4": "a",
+    "@": "a",
+    "5": "s",
+    "$": "s",
+    "7": "t",
+    "+": "t",
+    "8": "b",
+    "9": "g",
+    # cyrillic
+    "а": "a",
+    "в": "b",
+    "е": "e",
+    "ё": "e",
+    "к": "k",
+    "м": "m",
+    "н": "h",
+    "о": "o",
+    "р": "p",
+    "с": "c",
+    "т": "t",
+    "у": "y",
+    "х": "x",
+    "і": "i",
+    "ј": "j",
+    "ѕ": "s",
+    # greek
+    "α": "a",
+    "β": "b",
+    "ε": "e",
+    "ι": "i",
+    "κ": "k",
+    "ν": "v",
+    "ο": "o",
+    "ρ": "p",
+    "τ": "t",
+    "υ": "u",
+    "χ": "x",
+    # accented latin
+    "à": "a", "á": "a", "â": "a", "ã": "a", "ä": "a", "å": "a",
+    "è": "e", "é": "e", "ê": "e", "ë": "e",
+    "ì": "i", "í": "i", "î": "i", "ï": "i", "ı": "i",
+    "ò": "o", "ó": "o", "ô": "o", "õ": "o", "ö": "o", "ø": "o",
+    "ù": "u", "ú": "u", "û": "u", "ü": "u",
+    "ç": "c", "ñ": "n", "ý": "y", "ÿ": "y",
+}
+
+# fullwidth ascii, e.g. ｗｏｒｄ
+_CONFUSABLES.update({chr(c + 0xFEE0): chr(c).lower() for c in range(0x21, 0x7F)})
+
+
+def normalize_char(char):
+    """Returns the normalized form of a single character.
+
+    Whitespace normalizes to an empty string.
+    """
+
+    if char.isspace():
+        return ""
+
+    char = char.lower()
+    return _CONFUSABLES.get(char, char)
+
+
+def normalize(text):
+    """Normalizes a word the same way :meth:`WordMatcher.search` folds text."""
+
+    return "".join(normalize_char(char) for char in text)
+
+
+class WordMatcher:
+    """Finds any of a set of words in text in a single pass.
+
+    Both the words and the text are normalized, so ``"b a d"``,
+    ``"BAAAD"`` and ``"b4d"`` all match the word ``bad``. Letters can be
+    repeated in the text, but a word's own double letters are required.
+
+    Parameters
+    -----------
+    words: Iterable[str]
+        The words to match. The original spelling is what's returned
+        by :meth:`search`.
+    """
+
+    __slots__ = ("words", "_goto", "_fail", "_output", "_char", "_cache")
+
+    def __init__(self, words):
+        self.words = tuple(words)
+
+        # state 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        # the character that leads into each state
+        self._char = [None]
+
+        # normalize_char results, shared by every search on this matcher
+        self._cache = {}
+
+        for word in self.words:
+            self._add(word)
+
+        self._build()
+
+    def __len__(self):
+        return len(self.words)
+
+    def _add(self, word):
+        pattern = normalize(word)
+        if not pattern:
+            return
+
+        state = 0
+        for char in pattern:
+            try:
+                state = self._goto[state][char]
+            except KeyError:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._char.append(char)
+                new = len(self._goto) - 1
+                self._goto[state][char] = new
+                state = new
+
+        if self._output[state] is None:
+            self._output[state] = word
+
+    def _build(self):
+        # breadth first, so a state's fail link is always resolved before its children
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                queue.append(child)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+
+                # a match at the fail target is also a match here
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+
+    def search(self, text):
+        """Returns the first forbidden word found in text, or ``None``."""
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        chars = self._char
+        cache = self._cache
+
+        states = (0,)
+        last = None
+        for char in text:
+            try:
+                folded = cache[char]
+            except KeyError:
+                folded = cache[char] = normalize_char(char)
+
+            for char in folded:
+                repeat = char == last
+                last = char
+
+                following = []
+                for state in states:
+                    # a repeat of the letter we just matched, like the extra a's in "baaad"
+                    # it's also matched below in case a word needs it, like "aax" in "baax"
+                    if repeat and char == chars[state]:
+                        following.append(state)
+
+                    while state and char not in goto[state]:
+                        state = fail[state]
+                    state = goto[state].get(char, 0)
+
+                    if output[state] is not None:
+                        return output[state]
+
+                    following.append(state)
+
+                states = tuple(dict.fromkeys(following)) if len(following) > 1 else following
+
+        return None
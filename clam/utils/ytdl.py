@@ -0,0 +1,244 @@
+"""A dedicated worker pool for youtube_dl.
+
+Extraction is mostly CPU-heavy Python, so it runs in its own processes
+instead of the default thread pool every other cog shares. Jobs are
+queued per guild and handed to workers round robin, so one guild
+queueing a huge playlist can't starve everyone else.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import logging
+import multiprocessing
+import sys
+import time
+import types
+
+import youtube_dl
+
+
+log = logging.getLogger("clam.music.ytdl")
+
+# Silence useless bug reports messages
+youtube_dl.utils.bug_reports_message = lambda: ""
+
+
+# options: YoutubeDL, per worker
+_instances = {}
+
+
+def _extract_info(options, url, download, process):
+    key = tuple(sorted(options.items()))
+    ytdl = _instances.get(key)
+    if ytdl is None:
+        ytdl = _instances[key] = youtube_dl.YoutubeDL(options)
+
+    try:
+        info = ytdl.extract_info(url, download=download, process=process)
+    except youtube_dl.DownloadError as e:
+        # the original holds a traceback, which can't be sent back from a process
+        raise youtube_dl.DownloadError(str(e)) from None
+
+    # unprocessed playlists have a generator of entries, which can't be pickled
+    if info and "entries" in info and not isinstance(info["entries"], list):
+        info["entries"] = list(info["entries"])
+
+    return info
+
+
+def _ready():
+    return True
+
+
+@contextlib.contextmanager
+def _slim_main():
+    """Hides the real ``__main__`` from workers spawned inside this block.
+
+    Spawned processes import the parent's main module before running
+    anything. For the bot that's ``clam.__main__``, which loads the whole
+    bot and its config, so workers get an empty module instead.
+    """
+
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class _Job:
+    __slots__ = ("args", "future", "on_start", "queued_at")
+
+    def __init__(self, args, future, on_start=None):
+        self.args = args
+        self.future = future
+        self.on_start = on_start
+        self.queued_at = time.perf_counter()
+
+
+class YTDLExecutor:
+    """Runs youtube_dl calls on a bounded pool with per-guild fairness.
+
+    Parameters
+    -----------
+    workers: int
+        How many extractions can run at once.
+    processes: bool
+        Whether to use worker processes instead of threads.
+    metrics: Optional[:class:`clam.utils.metrics.Registry`]
+        Where to record how long jobs wait in the queue.
+    """
+
+    def __init__(self, *, workers=4, processes=True, metrics=None):
+        self.workers = workers
+        self.processes = processes
+        self._executor = self._create_executor()
+
+        self.running = 0
+        self.completed = 0
+
+        # guild_id: jobs, in the order guilds are served
+        self._queues = collections.OrderedDict()
+
+        if metrics is not None:
+            self._waits = metrics.histogram(
+                "clam_ytdl_queue_wait_seconds",
+                "Time youtube_dl jobs spend waiting for a worker.",
+                buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+            )
+        else:
+            self._waits = None
+
+    @property
+    def pending(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def _create_executor(self):
+        if not self.processes:
+            return concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="ytdl")
+
+        # spawn so workers don't inherit the bot's event loop and threads
+        context = multiprocessing.get_context("spawn")
+        executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+
+        # start every worker now, while the slim main module is in place
+        with _slim_main():
+            for _ in range(self.workers):
+                executor.submit(_ready)
+
+        return executor
+
+    def _replace_broken(self, executor):
+        # jobs that were running on the broken pool all fail, only replace it once
+        if executor is not self._executor:
+            return
+
+        log.warning("A youtube_dl worker died, starting a new worker pool")
+        executor.shutdown(wait=False)
+        self._executor = self._create_executor()
+
+    def _submit(self, loop, job):
+        executor = self._executor
+        try:
+            return executor, loop.run_in_executor(executor, _extract_info, *job.args)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._replace_broken(executor)
+
+        executor = self._executor
+        return executor, loop.run_in_executor(executor, _extract_info, *job.args)
+
+    def shutdown(self):
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+
+        self._queues.clear()
+        self._executor.shutdown(wait=False)
+
+    def _next_job(self):
+        guild_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+
+        # move the guild to the back so the others get a turn
+        del self._queues[guild_id]
+        if queue:
+            self._queues[guild_id] = queue
+
+        return job
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+
+        while self.running < self.workers and self._queues:
+            job = self._next_job()
+            if job.future.cancelled():
+                continue
+
+            try:
+                executor, task = self._submit(loop, job)
+            except Exception as e:
+                log.exception("Couldn't start a youtube_dl job")
+                job.future.set_exception(e)
+                continue
+
+            if self._waits:
+                self._waits.observe(time.perf_counter() - job.queued_at)
+
+            if job.on_start:
+                job.on_start()
+
+            self.running += 1
+            task.add_done_callback(lambda t, job=job, executor=executor: self._finished(t, job, executor))
+
+    def _finished(self, task, job, executor):
+        self.running -= 1
+        self.completed += 1
+
+        if not task.cancelled() and isinstance(task.exception(), concurrent.futures.process.BrokenProcessPool):
+            self._replace_broken(executor)
+
+        if not job.future.done():
+            if task.cancelled():
+                job.future.cancel()
+            elif task.exception():
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+
+        self._dispatch()
+
+    async def extract_info(
+        self, options, url, *, download=True, process=True, guild_id=None, on_start=None
+    ):
+        """Runs ``YoutubeDL.extract_info`` on the pool.
+
+        Each worker keeps one :class:`youtube_dl.YoutubeDL` per set of options.
+
+        Parameters
+        -----------
+        options: dict
+            The youtube_dl options to extract with.
+        url: str
+            What to extract.
+        download: bool
+            Whether to download the file.
+        process: bool
+            Whether to resolve every entry of a playlist or search.
+        guild_id: Optional[int]
+            The guild the job is for, used to share the workers fairly.
+        on_start: Optional[Callable[[], None]]
+            Called when a worker picks the job up. Once it has, cancelling
+            only stops waiting for the result, the worker still finishes.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        args = (options, url, download, process)
+
+        self._queues.setdefault(guild_id, collections.deque()).append(_Job(args, future, on_start))
+        self._dispatch()
+
+        return await future
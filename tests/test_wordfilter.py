@@ -0,0 +1,55 @@
+import pytest
+
+from clam.utils.wordfilter import WordMatcher, normalize
+
+
+@pytest.fixture
+def matcher():
+    return WordMatcher(["ass", "poop", "bad"])
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["that was fun", "has it", "as well", "pop", "a pop song", "bd", "nothing to see here"],
+)
+def test_innocent_text_is_not_flagged(matcher, text):
+    assert matcher.search(text) is None
+
+
+@pytest.mark.parametrize(
+    "text, word",
+    [
+        ("ass", "ass"),
+        ("a s s", "ass"),
+        ("asssss", "ass"),
+        ("@$$", "ass"),
+        ("poop", "poop"),
+        ("pooooop", "poop"),
+        ("BAAAD", "bad"),
+        ("b4d", "bad"),
+        ("b a d", "bad"),
+        ("ｂａｄ", "bad"),
+        ("that's so bad", "bad"),
+    ],
+)
+def test_dodges_are_flagged(matcher, text, word):
+    assert matcher.search(text) == word
+
+
+@pytest.mark.parametrize(
+    "words, text, word",
+    [
+        (["bac", "aax"], "baax", "aax"),
+        (["bac", "aax"], "baaax", "aax"),
+        (["bad", "aax"], "baaad", "bad"),
+        (["abc", "bbd"], "abbd", "bbd"),
+        (["abc", "bbd"], "abbbc", "abc"),
+    ],
+)
+def test_repeats_dont_hide_overlapping_words(words, text, word):
+    assert WordMatcher(words).search(text) == word
+
+
+def test_words_keep_their_double_letters():
+    assert normalize("Poop") == "poop"
+    assert normalize("a s s") == "ass"